@@ -1,15 +1,23 @@
+import datetime
+
 import elasticsearch
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.db import models
-from django.http import Http404
+from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import path
+from django.utils import timezone
+from django.utils.http import urlencode
 
 from auditlog.filters import ActorInputFilter, DateTimeFilter, ChangesFilter, ActionChoiceFilter, \
-    ContentTypeChoiceFilter
+    ContentTypeChoiceFilter, ActorChoiceFilter
+from . import analytics
 from .documents import LogEntry
 from .mixins import LogEntryAdminMixin
-from .utils.admin import get_headers, results, CustomChangeList, CustomPaginator
+from .utils.admin import get_headers, results, CustomChangeList, CursorPaginator, HitRow, IGNORED_PARAMS
 
 
 class LogModel(models.Model):
@@ -20,26 +28,44 @@ class LogModel(models.Model):
 
 class DummyModelAdmin(admin.ModelAdmin, LogEntryAdminMixin):
     list_fields = ['timestamp', 'action', 'content_type_model', 'object_repr', 'actor', 'changed_fields']
+    # The fields of the source the list columns are built from, the rest (e.g. the old and new values of the changes)
+    # is not fetched for the list.
+    list_source_fields = ['timestamp', 'action', 'content_type_model', 'object_repr', 'actor_email', 'actor_first_name',
+                          'actor_last_name', 'changes.field']
     filters = [ActorInputFilter, 'object_repr', ActionChoiceFilter, ('timestamp', DateTimeFilter),
-               ChangesFilter, ContentTypeChoiceFilter]
+               ChangesFilter, ContentTypeChoiceFilter, ActorChoiceFilter]
     detail_fields = {
         'Details': ('created', 'user', 'resource'),
         'Changes': ('action', 'changes')
     }
 
-    paginator = CustomPaginator
+    paginator = CursorPaginator
+    # Count matching entries up to this number, counting all of them is expensive on large indices.
+    track_total_hits = 10000
+    # Seconds the choices and counts of the filters are cached, 0 disables caching.
+    facet_cache_timeout = 30
+    # The periods the dashboard can show, in days, and the interval of their activity histogram.
+    dashboard_periods = {1: 'hour', 7: 'day', 30: 'day', 365: 'month'}
+    dashboard_default_period = 30
+    # Seconds the aggregations of the dashboard are cached, 0 disables caching.
+    dashboard_cache_timeout = 60
     readonly_fields = []
 
     def get_urls(self):
         info = self.model._meta.app_label, self.model._meta.model_name
         return [
             path('', self.list_view, name='%s_%s_changelist' % info),
+            path('dashboard/', self.admin_site.admin_view(self.dashboard_view), name='%s_%s_dashboard' % info),
             path('<path:object_id>/', self.detail_view, name='%s_%s_change' % info),
         ]
 
     def has_add_permission(self, request, obj=None):
         return False
 
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset.source(self.list_source_fields), per_page,
+                              track_total_hits=self.track_total_hits, row_class=HitRow)
+
     def get_queryset(self, request):
         s = LogEntry.search()
         s = s.sort('-timestamp')
@@ -47,7 +73,13 @@ class DummyModelAdmin(admin.ModelAdmin, LogEntryAdminMixin):
 
     def list_view(self, request):
         cl = CustomChangeList(self, request, list_filter=self.filters)
-        cl.get_results()
+        try:
+            cl.get_results()
+        except IncorrectLookupParameters:
+            # A malformed cursor, e.g. from an edited URL, falls back to the first page with the same filters.
+            if not any(param in request.GET for param in IGNORED_PARAMS):
+                raise
+            return HttpResponseRedirect('%s?%s' % (request.path, urlencode(cl.get_filters_params())))
 
         context = {
             'title': 'Log entries',
@@ -60,6 +92,38 @@ class DummyModelAdmin(admin.ModelAdmin, LogEntryAdminMixin):
 
         return render(request, 'admin/logs_list.html', context=context)
 
+    def dashboard_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = int(request.GET.get('days', self.dashboard_default_period))
+        except ValueError:
+            days = self.dashboard_default_period
+        if days not in self.dashboard_periods:
+            days = self.dashboard_default_period
+
+        cache_key = 'auditlog:dashboard:%d' % days
+        summary = cache.get(cache_key) if self.dashboard_cache_timeout else None
+        if summary is None:
+            since = timezone.now() - datetime.timedelta(days=days)
+            summary = analytics.summary(LogEntry.objects.since(since), interval=self.dashboard_periods[days])
+            if self.dashboard_cache_timeout:
+                cache.set(cache_key, summary, self.dashboard_cache_timeout)
+
+        peak = max([bucket['count'] for bucket in summary['histogram']] or [0])
+        context = {
+            'title': 'Log entries dashboard',
+            'opts': self.model._meta,
+            'days': days,
+            'periods': sorted(self.dashboard_periods),
+            'histogram': [dict(bucket, percentage=100 * bucket['count'] // peak if peak else 0)
+                          for bucket in summary['histogram']],
+            'actors': summary['actors'],
+            'models': summary['models'],
+            'fields': summary['fields'],
+        }
+        return render(request, 'admin/logs_dashboard.html', context=context)
+
     def detail_view(self, request, object_id):
         try:
             obj = LogEntry.get(object_id)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+from elasticsearch_dsl.response import Response
+
+from auditlog.buffer import BulkResults, get_bulk_options, prepare_entries
+from auditlog.connection import get_client_kwargs
+from auditlog.documents import LogEntry
+from auditlog.shipper import BLOCK, DROP_OLDEST, SPILL, get_config
+from auditlog.spool import get_spool, is_unavailable
+
+_clients = {}
+
+
+def get_async_client():
+    """
+    Returns the ``AsyncElasticsearch`` client of the running event loop, configured like the sync client (see
+    :py:func:`auditlog.connection.get_client`). The client, and with it its connection pool, is shared by everything
+    that runs on the loop. This requires the ``async`` extra of the ``elasticsearch`` package.
+
+    :rtype: AsyncElasticsearch
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        _prune(_clients)
+        try:
+            from elasticsearch import AsyncElasticsearch
+        except ImportError:
+            raise ImproperlyConfigured("The async API of Auditlog requires 'elasticsearch[async]' to be installed.")
+        client = _clients[loop] = AsyncElasticsearch(**get_client_kwargs())
+    return client
+
+
+async def close_async_client():
+    """
+    Close the ``AsyncElasticsearch`` client of the running event loop, if there is one.
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+async def async_index_entries(entries, client=None):
+    """
+    Async version of :py:func:`auditlog.buffer.index_entries`.
+
+    :param entries: The log entries to index.
+    :type entries: list
+    :param client: The Elasticsearch client, defaults to the client of the running event loop.
+    :type client: AsyncElasticsearch
+    :return: The log entries that could not be indexed.
+    :rtype: list
+    """
+    spool = get_spool()
+    if spool is not None and is_unavailable():
+        spool.append(entries)
+        return []
+
+    results = BulkResults(entries, spool)
+    try:
+        async for ok, item in LogEntry.async_streaming_bulk(client or get_async_client(), entries,
+                                                            **get_bulk_options()):
+            results.add(ok, item)
+    except Exception:
+        results.abort()
+    return results.finish()
+
+
+async def async_send_entries(entries, client=None):
+    """
+    Async version of :py:func:`auditlog.buffer.send_entries`, indexes the entries on the running event loop.
+
+    :param entries: The log entries to index.
+    :type entries: list
+    :return: The log entries that could not be indexed.
+    :rtype: list
+    """
+    valid, failed = prepare_entries(entries)
+    if not valid:
+        return failed
+    return failed + await async_index_entries(valid, client=client)
+
+
+async def asearch(search, client=None):
+    """
+    Execute a search with the ``AsyncElasticsearch`` client.
+
+    :param search: The search to execute.
+    :type search: Search
+    :param client: The Elasticsearch client, defaults to the client of the running event loop.
+    :type client: AsyncElasticsearch
+    :rtype: Response
+    """
+    client = client or get_async_client()
+    raw = await client.search(index=search._index, body=search.to_dict(), **search._params)
+    return Response(search, raw)
+
+
+async def aget_history(instance, after=None, before=None, per_page=100, client=None):
+    """
+    Returns a page of the log entries of a model instance, newest first, like the history view of
+    :py:class:`auditlog.mixins.AuditlogAdminHistoryMixin`. Pages are addressed with the sort values of the entry before
+    or after them, e.g. ``after=page.object_list[-1].meta.sort`` (see :py:class:`auditlog.utils.admin.CursorPaginator`).
+
+    :param instance: The model instance to get the log entries for.
+    :type instance: Model
+    :param after: The sort values of the entry before the page.
+    :type after: list
+    :param before: The sort values of the entry after the page.
+    :type before: list
+    :param per_page: The number of log entries per page.
+    :type per_page: int
+    :param client: The Elasticsearch client, defaults to the client of the running event loop.
+    :type client: AsyncElasticsearch
+    :rtype: CursorPage
+    """
+    from auditlog.utils.admin import CursorPaginator
+
+    paginator = CursorPaginator(LogEntry.objects.for_object(instance).search, per_page)
+    response = await asearch(paginator.get_search(after=after, before=before), client=client)
+    return paginator.get_page(response, after=after, before=before)
+
+
+class AsyncLogShipper(object):
+    """
+    Indexes log entries from tasks on an asyncio event loop, the asyncio counterpart of
+    :py:class:`auditlog.shipper.LogShipper`.
+
+    Entries are put on a bounded queue, from any thread. A collector task gathers up to ``batch_size`` entries, or
+    whatever arrived within ``flush_interval`` seconds, and indexes them with the ``AsyncElasticsearch`` client. Up to
+    ``max_workers`` bulk requests run concurrently. ``overflow`` works like it does for the threaded shipper, except
+    that spilled entries are indexed by a task of their own, and that on the event loop thread itself ``'block'``
+    behaves like ``'spill'``.
+    """
+
+    def __init__(self, loop, queue_size=None, batch_size=None, flush_interval=None, overflow=None, max_workers=None):
+        config = get_config()
+        overflow = overflow or config['OVERFLOW']
+        if overflow not in (BLOCK, DROP_OLDEST, SPILL):
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size or config['QUEUE_SIZE'])
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.flush_interval = config['FLUSH_INTERVAL'] if flush_interval is None else flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+
+        self._semaphore = asyncio.Semaphore(max(1, max_workers or config['MAX_WORKERS']))
+        self._tasks = set()
+        self._collector = None
+
+    @property
+    def running(self):
+        return self._collector is not None and not self._collector.done() and not self.loop.is_closed()
+
+    def start(self):
+        """
+        Start the collector task, must be called on the event loop.
+        """
+        if self._collector is None:
+            self._collector = self.loop.create_task(self._run())
+
+    def put(self, entries):
+        """
+        Queue log entries for indexing. May be called from any thread.
+
+        :param entries: The log entries to index.
+        :type entries: list
+        :return: The log entries that could not be indexed, always empty. Entries that do not fit in the queue are
+            indexed by a task of their own.
+        :rtype: list
+        """
+        if self._on_loop():
+            self._put(entries)
+        elif self.overflow == BLOCK:
+            asyncio.run_coroutine_threadsafe(self._put_wait(entries), self.loop).result()
+        else:
+            self.loop.call_soon_threadsafe(self._put, entries)
+        return []
+
+    async def stop(self, timeout=None):
+        """
+        Stop the shipper after the queue has been drained and all bulk requests have finished. Entries still queued
+        after ``timeout`` seconds are lost.
+        """
+        timeout = get_config()['SHUTDOWN_TIMEOUT'] if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.error("Audit log shipper stopped with %d log entries left in the queue", self.queue.qsize())
+        if self._collector is not None:
+            self._collector.cancel()
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def _put_wait(self, entries):
+        for entry in entries:
+            await self.queue.put(entry)
+
+    def _put(self, entries):
+        spilled = []
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                if self.overflow != DROP_OLDEST:
+                    spilled.append(entry)
+                    continue
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+                logging.warning("Audit log shipper queue is full, dropped the oldest log entry (%d in total)",
+                                self.dropped)
+                self.queue.put_nowait(entry)
+        if spilled:
+            self._spawn(self._flush(spilled))
+
+    def _spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._semaphore.acquire()
+            self._spawn(self._flush(batch, queued=True))
+
+    async def _flush(self, batch, queued=False):
+        if not queued:
+            await self._semaphore.acquire()
+        try:
+            await async_index_entries(batch)
+        except Exception:
+            logging.exception("Error when saving logs to elasticsearch", extra={'count': len(batch)})
+        finally:
+            self._semaphore.release()
+            if queued:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _drain(self):
+        await self.queue.join()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_async_shippers = {}
+
+
+def _prune(per_loop):
+    for loop in [loop for loop in per_loop if loop.is_closed()]:
+        del per_loop[loop]
+
+
+def start_async_shipper():
+    """
+    Returns the shipper of the running event loop, starting it first if needed, or ``None`` when background delivery
+    with asyncio is disabled (``AUDITLOG_SHIPPER['ENABLED']`` and ``AUDITLOG_SHIPPER['ASYNC']``). Must be called on
+    the event loop, the async code path of :py:class:`auditlog.middleware.AuditlogMiddleware` does so for every request.
+
+    :rtype: AsyncLogShipper
+    """
+    config = get_config()
+    if not (config['ENABLED'] and config['ASYNC']):
+        return None
+    loop = asyncio.get_running_loop()
+    shipper = _async_shippers.get(loop)
+    if shipper is None:
+        _prune(_async_shippers)
+        shipper = _async_shippers[loop] = AsyncLogShipper(loop)
+        shipper.start()
+    return shipper
+
+
+def get_async_shipper():
+    """
+    Returns a running asyncio shipper, or ``None`` when there is none. Log entries created in threads that serve
+    async views (e.g. by :py:func:`asgiref.sync.sync_to_async`) are handed to it.
+
+    :rtype: AsyncLogShipper
+    """
+    config = get_config()
+    if not (config['ENABLED'] and config['ASYNC']):
+        return None
+    try:
+        shipper = _async_shippers.get(asyncio.get_running_loop())
+    except RuntimeError:
+        shipper = None
+    if shipper is None:
+        shipper = next((shipper for shipper in list(_async_shippers.values()) if shipper.running), None)
+    if shipper is not None and shipper.running:
+        return shipper
+    return None
@@ -0,0 +1,193 @@
+import datetime
+
+INTERVALS = ('minute', 'hour', 'day', 'week', 'month', 'quarter', 'year')
+TOP_SIZE = 10
+COMPOSITE_SIZE = 1000
+
+
+def _base_search(queryset):
+    if queryset is None:
+        from auditlog.documents import LogEntry
+
+        queryset = LogEntry.objects.all()
+    # Only aggregations are needed, no hits and no exact count.
+    return queryset.search.sort().extra(size=0, track_total_hits=False)
+
+
+def _to_datetime(milliseconds):
+    return datetime.datetime.fromtimestamp(milliseconds / 1000, tz=datetime.timezone.utc)
+
+
+def _add_histogram(search, interval, size):
+    if interval not in INTERVALS:
+        raise ValueError("Unknown interval: %r, expected one of %s" % (interval, ', '.join(INTERVALS)))
+    search.aggs.bucket('histogram', 'date_histogram', field='timestamp', calendar_interval=interval) \
+        .bucket('app_labels', 'terms', field='content_type_app_label', size=size) \
+        .bucket('models', 'terms', field='content_type_model', size=size) \
+        .bucket('actions', 'terms', field='action')
+
+
+def _parse_histogram(aggregations):
+    histogram = []
+    for bucket in aggregations['histogram']['buckets']:
+        breakdown = []
+        for app_label in bucket['app_labels']['buckets']:
+            for model in app_label['models']['buckets']:
+                for action in model['actions']['buckets']:
+                    breakdown.append({
+                        'content_type': '%s.%s' % (app_label['key'], model['key']),
+                        'action': action['key'],
+                        'count': action['doc_count'],
+                    })
+        histogram.append({'date': _to_datetime(bucket['key']), 'count': bucket['doc_count'], 'breakdown': breakdown})
+    return histogram
+
+
+def _add_top_actors(search, size):
+    search.aggs.bucket('actors', 'terms', field='actor_id', size=size) \
+        .bucket('emails', 'terms', field='actor_email', size=1)
+
+
+def _parse_top_actors(aggregations):
+    return [{
+        'actor_id': bucket['key'],
+        'actor_email': bucket['emails']['buckets'][0]['key'] if bucket['emails']['buckets'] else None,
+        'count': bucket['doc_count'],
+    } for bucket in aggregations['actors']['buckets']]
+
+
+def _add_top_models(search, size):
+    # Bucket by content type rather than by model name, models of different apps may have the same name.
+    content_types = search.aggs.bucket('content_types', 'terms', field='content_type_id', size=size)
+    content_types.bucket('app_labels', 'terms', field='content_type_app_label', size=1)
+    content_types.bucket('models', 'terms', field='content_type_model', size=1)
+
+
+def _parse_top_models(aggregations):
+    models = []
+    for bucket in aggregations['content_types']['buckets']:
+        app_label = bucket['app_labels']['buckets'][0]['key'] if bucket['app_labels']['buckets'] else ''
+        model = bucket['models']['buckets'][0]['key'] if bucket['models']['buckets'] else ''
+        models.append({
+            'content_type_id': bucket['key'],
+            'content_type': '%s.%s' % (app_label, model),
+            'count': bucket['doc_count'],
+        })
+    return models
+
+
+def _add_top_fields(search, size):
+    search.aggs.bucket('changes', 'nested', path='changes') \
+        .bucket('fields', 'terms', field='changes.field', size=size) \
+        .bucket('entries', 'reverse_nested')
+
+
+def _parse_top_fields(aggregations):
+    return [{
+        'field': bucket['key'],
+        'entries': bucket['entries']['doc_count'],
+    } for bucket in aggregations['changes']['fields']['buckets']]
+
+
+def _aggregate(queryset, *builders):
+    search = _base_search(queryset)
+    for builder in builders:
+        builder(search)
+    return search.execute().aggregations.to_dict()
+
+
+def activity_histogram(queryset=None, interval='day', size=TOP_SIZE):
+    """
+    Returns the number of log entries per interval, broken down by content type and action.
+
+    :param queryset: The log entries to aggregate, e.g. ``LogEntry.objects.since(timestamp)``, defaults to all.
+    :type queryset: LogEntryQuerySet
+    :param interval: One of :py:data:`INTERVALS`.
+    :type interval: str
+    :param size: The maximum number of app labels, and of models per app label, per interval.
+    :type size: int
+    :return: A dict per interval with its ``date``, ``count`` and ``breakdown``, a list of dicts with
+        ``content_type``, ``action`` and ``count`` keys.
+    :rtype: list
+    """
+    return _parse_histogram(_aggregate(queryset, lambda search: _add_histogram(search, interval, size)))
+
+
+def top_actors(queryset=None, size=TOP_SIZE):
+    """
+    Returns the actors with the most log entries.
+
+    :return: A dict per actor with ``actor_id``, ``actor_email`` and ``count`` keys, most active first.
+    :rtype: list
+    """
+    return _parse_top_actors(_aggregate(queryset, lambda search: _add_top_actors(search, size)))
+
+
+def top_models(queryset=None, size=TOP_SIZE):
+    """
+    Returns the models with the most log entries.
+
+    :return: A dict per model with ``content_type_id``, ``content_type`` (``'app_label.model'``) and ``count`` keys.
+    :rtype: list
+    """
+    return _parse_top_models(_aggregate(queryset, lambda search: _add_top_models(search, size)))
+
+
+def top_fields(queryset=None, size=TOP_SIZE):
+    """
+    Returns the fields that are changed most often, by the number of log entries that changed them.
+
+    :return: A dict per field with ``field`` and ``entries`` keys.
+    :rtype: list
+    """
+    return _parse_top_fields(_aggregate(queryset, lambda search: _add_top_fields(search, size)))
+
+
+def summary(queryset=None, interval='day', size=TOP_SIZE):
+    """
+    Returns the activity histogram, top actors, models and fields, computed with a single search.
+
+    :return: A dict with ``histogram``, ``actors``, ``models`` and ``fields`` keys, see :py:func:`activity_histogram`,
+        :py:func:`top_actors`, :py:func:`top_models` and :py:func:`top_fields`.
+    :rtype: dict
+    """
+    aggregations = _aggregate(
+        queryset,
+        lambda search: _add_histogram(search, interval, size),
+        lambda search: _add_top_actors(search, size),
+        lambda search: _add_top_models(search, size),
+        lambda search: _add_top_fields(search, size),
+    )
+    return {
+        'histogram': _parse_histogram(aggregations),
+        'actors': _parse_top_actors(aggregations),
+        'models': _parse_top_models(aggregations),
+        'fields': _parse_top_fields(aggregations),
+    }
+
+
+def iter_breakdown(fields, queryset=None, size=COMPOSITE_SIZE):
+    """
+    Yield the number of log entries for every combination of values of the fields, e.g. per actor and content type.
+    The combinations are paged through with a composite aggregation, ``size`` per request, so breakdowns with many
+    combinations do not have to fit in memory, neither here nor in Elasticsearch.
+
+    :param fields: Keyword fields of the log entries, e.g. ``['actor_id', 'content_type_model']``.
+    :type fields: list
+    :return: A dict per combination with the value of every field and the ``count``.
+    :rtype: generator
+    """
+    sources = [{field: {'terms': {'field': field}}} for field in fields]
+    after = None
+    while True:
+        search = _base_search(queryset)
+        params = {'sources': sources, 'size': size}
+        if after is not None:
+            params['after'] = after
+        search.aggs.bucket('breakdown', 'composite', **params)
+        breakdown = search.execute().aggregations.to_dict()['breakdown']
+        for bucket in breakdown['buckets']:
+            yield dict(bucket['key'], count=bucket['doc_count'])
+        after = breakdown.get('after_key')
+        if after is None or len(breakdown['buckets']) < size:
+            return
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AuditlogConfig(AppConfig):
     name = 'auditlog'
     verbose_name = "Audit log"
+
+    def ready(self):
+        from auditlog.registry import auditlog
+
+        for model in auditlog.get_models():
+            auditlog.get_diff_plan(model)
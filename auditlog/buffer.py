@@ -0,0 +1,252 @@
+import logging
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import transaction
+
+from auditlog.connection import get_client, get_timeout
+from auditlog.documents import LogEntry, log_created
+from auditlog.spool import get_spool, is_retryable, is_unavailable, mark_unavailable
+
+_local = threading.local()
+
+
+class _CommitHook(object):
+    """
+    Callable registered with :py:func:`django.db.transaction.on_commit`.
+
+    The transaction's list of commit hooks holds the only strong reference to a hook. When Django drops the hook because
+    its (savepoint) transaction was rolled back, weak references to it die as well, which is how the buffer learns which
+    log entries must be discarded.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.entries = []
+
+    def __call__(self):
+        if self.callback is not None:
+            self.callback()
+
+
+class LogEntryBuffer(object):
+    """
+    Collects the log entries created within a single transaction and indexes them in bulk once the transaction commits.
+
+    Entries are grouped in segments, one per savepoint they were created in, so entries created in a savepoint that is
+    rolled back are dropped along with it.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.flushed = False
+        self._segments = []
+        self._segment_sids = None
+
+        hook = _CommitHook(self.flush)
+        self._hook = weakref.ref(hook)
+        transaction.on_commit(hook, using=using)
+
+    @property
+    def pending(self):
+        """
+        Whether the buffer still waits for its transaction to commit.
+        """
+        return not self.flushed and self._hook() is not None
+
+    def add(self, log_entry, savepoint_ids):
+        segment = self._segments[-1]() if self._segments else None
+        if segment is None or self._segment_sids != savepoint_ids:
+            segment = _CommitHook()
+            self._segments.append(weakref.ref(segment))
+            self._segment_sids = savepoint_ids
+            transaction.on_commit(segment, using=self.using)
+        segment.entries.append(log_entry)
+
+    def flush(self):
+        self.flushed = True
+        buffers = getattr(_local, 'buffers', {})
+        if buffers.get(self.using) is self:
+            del buffers[self.using]
+
+        entries = []
+        for ref in self._segments:
+            segment = ref()
+            if segment is not None:
+                entries.extend(segment.entries)
+        self._segments = []
+        if entries:
+            send_entries(entries)
+
+
+def enqueue(log_entry, using=None):
+    """
+    Schedule a log entry to be indexed when the current transaction on database ``using`` commits. All entries of one
+    transaction are sent together through the bulk API. Outside of a transaction the entry is sent immediately.
+
+    :param log_entry: The log entry to index.
+    :type log_entry: LogEntry
+    :param using: The database alias of the transaction.
+    :type using: str
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        transaction.on_commit(lambda: send_entries([log_entry]), using=using)
+        return
+
+    if not hasattr(_local, 'buffers'):
+        _local.buffers = {}
+    buffer = _local.buffers.get(using)
+    if buffer is None or not buffer.pending:
+        buffer = _local.buffers[using] = LogEntryBuffer(using)
+    buffer.add(log_entry, tuple(connection.savepoint_ids))
+
+
+def send_entries(entries):
+    """
+    Send the :py:data:`log_created` signal for each of the given log entries and index them with the bulk API. When the
+    background shipper is enabled (see :py:mod:`auditlog.shipper`) the entries are handed to it instead of being
+    indexed on the current thread. When the asyncio shipper is running (see :py:mod:`auditlog.aio`), they are handed to
+    that one.
+
+    :param entries: The log entries to index.
+    :type entries: list
+    :return: The log entries that could not be indexed.
+    :rtype: list
+    """
+    from auditlog.aio import get_async_shipper
+    from auditlog.shipper import get_shipper
+
+    valid, failed = prepare_entries(entries)
+    if not valid:
+        return failed
+
+    shipper = get_async_shipper() or get_shipper()
+    if shipper is not None:
+        return failed + shipper.put(valid)
+    return failed + index_entries(valid)
+
+
+def prepare_entries(entries):
+    """
+    Send the :py:data:`log_created` signal for each of the given log entries and validate them.
+
+    :param entries: The log entries to prepare.
+    :type entries: list
+    :return: The valid log entries and the log entries that failed.
+    :rtype: tuple
+    """
+    failed = []
+    valid = []
+    for entry in entries:
+        try:
+            log_created.send(LogEntry, instance=entry)
+            entry.full_clean()
+        except Exception:
+            logging.exception("Error when saving log to elasticsearch", extra={'log_entry': entry.to_dict()})
+            failed.append(entry)
+        else:
+            valid.append(entry)
+    return valid, failed
+
+
+def get_bulk_options():
+    """
+    Returns the keyword arguments for the bulk helpers, see :py:func:`index_entries`.
+
+    :rtype: dict
+    """
+    return {
+        'chunk_size': getattr(settings, 'AUDITLOG_BULK_CHUNK_SIZE', 500),
+        'refresh': getattr(settings, 'AUDITLOG_BULK_REFRESH', False),
+        'raise_on_error': False,
+        'raise_on_exception': False,
+        'request_timeout': get_timeout('bulk'),
+    }
+
+
+class BulkResults(object):
+    """
+    Sorts the results of a bulk request into the log entries that failed and the ones to spool, or without a spool the
+    ones to send again when ``resend`` is given.
+    """
+
+    def __init__(self, entries, spool, resend=None):
+        self.entries = entries
+        self.spool = spool
+        self.resend = resend
+        self.failed = []
+        self.retry = []
+        self.done = 0
+
+    def add(self, ok, item):
+        entry = self.entries[self.done]
+        self.done += 1
+        if ok:
+            return
+        if self.spool is not None and is_retryable(item):
+            self.retry.append(entry)
+        elif self.resend is not None and is_retryable(item):
+            self.resend.append(entry)
+        else:
+            logging.error("Error when saving log to elasticsearch: %s", item, extra={'log_entry': entry.to_dict()})
+            self.failed.append(entry)
+
+    def abort(self):
+        """
+        Handle the exception that interrupted the bulk request, for the entries without a result.
+        """
+        remaining = self.entries[self.done:]
+        if self.spool is not None:
+            self.retry.extend(remaining)
+        elif self.resend is not None:
+            logging.warning("Error when saving logs to elasticsearch", exc_info=True, extra={'count': len(remaining)})
+            self.resend.extend(remaining)
+        else:
+            logging.exception("Error when saving logs to elasticsearch", extra={'count': len(remaining)})
+            self.failed.extend(remaining)
+
+    def finish(self):
+        """
+        Spool the entries that may be indexed later.
+
+        :return: The log entries that could not be indexed.
+        :rtype: list
+        """
+        if self.retry:
+            logging.warning("Elasticsearch is unavailable, spooling %d log entries", len(self.retry))
+            mark_unavailable()
+            self.spool.append(self.retry)
+        return self.failed
+
+
+def index_entries(entries, resend=None):
+    """
+    Index the given log entries with the bulk API.
+
+    The number of documents per bulk request and the refresh policy are configured with the
+    ``AUDITLOG_BULK_CHUNK_SIZE`` (default ``500``) and ``AUDITLOG_BULK_REFRESH`` (default ``False``) settings.
+    Documents that fail are reported individually. When the spool is enabled (see :py:mod:`auditlog.spool`), documents
+    that failed because Elasticsearch was unavailable are written to the spool to be indexed later.
+
+    :param entries: The log entries to index.
+    :type entries: list
+    :param resend: Without a spool, the documents that failed because Elasticsearch was unavailable are added to this
+        list instead of being returned, so the caller can send them again.
+    :type resend: list
+    :return: The log entries that could not be indexed.
+    :rtype: list
+    """
+    spool = get_spool()
+    if spool is not None and is_unavailable():
+        spool.append(entries)
+        return []
+
+    results = BulkResults(entries, spool, resend)
+    try:
+        for ok, item in LogEntry.streaming_bulk(get_client(), entries, **get_bulk_options()):
+            results.add(ok, item)
+    except Exception:
+        results.abort()
+    return results.finish()
@@ -0,0 +1,124 @@
+import os
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from elasticsearch_dsl import connections
+
+DEFAULTS = {
+    'ALIAS': 'auditlog',
+    'HOSTS': None,
+    'TIMEOUT': 10,
+    'BULK_TIMEOUT': 60,
+    'SEARCH_TIMEOUT': 30,
+    'MAXSIZE': 10,
+    'HTTP_COMPRESS': False,
+    'RETRY_ON_TIMEOUT': False,
+    'MAX_RETRIES': 3,
+    'SNIFF_ON_START': False,
+    'SNIFF_ON_CONNECTION_FAIL': False,
+    'SNIFFER_TIMEOUT': None,
+    'OPTIONS': {},
+}
+
+
+def get_config():
+    """
+    Returns the connection configuration, the ``AUDITLOG_ELASTICSEARCH`` setting merged with the defaults. When no
+    ``HOSTS`` are configured, the ``ELASTICSEARCH_HOST`` setting is used.
+
+    :rtype: dict
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AUDITLOG_ELASTICSEARCH', {}))
+    if not config['HOSTS']:
+        host = getattr(settings, 'ELASTICSEARCH_HOST', None)
+        config['HOSTS'] = [host] if host else None
+    elif isinstance(config['HOSTS'], str):
+        config['HOSTS'] = [config['HOSTS']]
+    return config
+
+
+def get_client_kwargs(config=None):
+    """
+    Returns the keyword arguments to create an Elasticsearch client with, sync or async.
+
+    :rtype: dict
+    """
+    config = config or get_config()
+    kwargs = {
+        'hosts': config['HOSTS'],
+        'timeout': config['TIMEOUT'],
+        'maxsize': config['MAXSIZE'],
+        'http_compress': config['HTTP_COMPRESS'],
+        'retry_on_timeout': config['RETRY_ON_TIMEOUT'],
+        'max_retries': config['MAX_RETRIES'],
+        'sniff_on_start': config['SNIFF_ON_START'],
+        'sniff_on_connection_fail': config['SNIFF_ON_CONNECTION_FAIL'],
+    }
+    if config['SNIFFER_TIMEOUT'] is not None:
+        kwargs['sniffer_timeout'] = config['SNIFFER_TIMEOUT']
+    kwargs.update(config['OPTIONS'])
+    return kwargs
+
+
+_pids = {}
+_lock = threading.Lock()
+# The client registered as the default connection as well, see get_client.
+_default = {'client': None}
+
+
+def _owns_default_connection():
+    try:
+        return connections.get_connection() is _default['client']
+    except KeyError:
+        return True
+
+
+def get_client():
+    """
+    Returns the Elasticsearch client Auditlog uses, registered with ``elasticsearch_dsl.connections`` under the
+    configured alias. The client is created on first use rather than on import, and anew in a forked child process, so
+    worker processes never share the sockets of their parent.
+
+    Unless the project configured a ``'default'`` connection of its own, the client is registered as the default
+    connection as well, so searches without ``using`` keep working.
+
+    :rtype: Elasticsearch
+    """
+    config = get_config()
+    alias = config['ALIAS']
+    pid = os.getpid()
+    if _pids.get(alias) != pid:
+        with _lock:
+            if _pids.get(alias) != pid:
+                client = connections.create_connection(alias, **get_client_kwargs(config))
+                _pids[alias] = pid
+                if alias != 'default' and _owns_default_connection():
+                    connections.add_connection('default', client)
+                    _default['client'] = client
+    return connections.get_connection(alias)
+
+
+def reset_client():
+    """
+    Drop the client, the next call to :py:func:`get_client` creates a new one with the current settings.
+    """
+    with _lock:
+        _pids.pop(get_config()['ALIAS'], None)
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    if setting in ('AUDITLOG_ELASTICSEARCH', 'ELASTICSEARCH_HOST'):
+        _pids.clear()
+
+
+def get_timeout(operation):
+    """
+    Returns the request timeout in seconds for an operation, ``'bulk'`` or ``'search'``.
+
+    :rtype: float
+    """
+    return get_config()['%s_TIMEOUT' % operation.upper()]
@@ -0,0 +1,75 @@
+import contextlib
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+auditlog_context = ContextVar('auditlog_context', default=None)
+
+_user_model = None
+
+
+@contextlib.contextmanager
+def set_actor(actor, remote_addr=None):
+    """
+    Context manager that sets the actor and remote address of all log entries created within it. Log entries that
+    already have an actor keep it. The context is kept in a :py:class:`contextvars.ContextVar`, so it is local to the
+    current thread or asyncio task.
+
+    :param actor: The user that makes the changes, may be lazy (e.g. ``request.user``). Anonymous users are ignored.
+    :param remote_addr: The address the changes are made from.
+    :type remote_addr: str
+    """
+    token = auditlog_context.set({'actor': actor, 'remote_addr': remote_addr})
+    try:
+        yield
+    finally:
+        auditlog_context.reset(token)
+
+
+def get_user_model():
+    """
+    Returns the user model, resolved once from the ``AUTH_USER_MODEL`` setting.
+
+    :rtype: type
+    """
+    global _user_model
+    if _user_model is None:
+        try:
+            app_label, model_name = settings.AUTH_USER_MODEL.split('.')
+            _user_model = apps.get_model(app_label, model_name)
+        except ValueError:
+            _user_model = apps.get_model('auth', 'user')
+    return _user_model
+
+
+@receiver(setting_changed)
+def _reset_user_model(setting, **kwargs):
+    global _user_model
+    if setting == 'AUTH_USER_MODEL':
+        _user_model = None
+
+
+def get_context_fields():
+    """
+    Returns the log entry fields set by the current audit context (see :py:func:`set_actor`).
+
+    :return: The actor and remote address fields, empty when there is no audit context.
+    :rtype: dict
+    """
+    context = auditlog_context.get()
+    if context is None:
+        return {}
+
+    fields = {'remote_addr': context['remote_addr']}
+    user = context['actor']
+    if getattr(user, 'is_authenticated', False) and isinstance(user, get_user_model()):
+        fields.update(
+            actor_id=user._meta.pk.get_prep_value(user.pk),
+            actor_email=user.email,
+            actor_first_name=user.first_name,
+            actor_last_name=user.last_name,
+        )
+    return fields
@@ -1,9 +1,17 @@
+import datetime
+import uuid
+
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Model, NOT_PROVIDED, DateTimeField
+from django.db.models import Model, NOT_PROVIDED, DateTimeField, IntegerField
 from django.utils import timezone
 from django.utils.encoding import smart_str
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def track_field(field):
     """
@@ -43,6 +51,46 @@ def get_fields_in_model(instance):
     return [f for f in instance._meta.get_fields() if track_field(f)]
 
 
+def get_tracked_fields(model):
+    """
+    Returns the concrete fields of a registered model that are compared when one of its instances is updated, taking
+    the ``include_fields`` and ``exclude_fields`` the model was registered with into account.
+
+    :param model: The registered model.
+    :type model: ModelBase
+    :return: The fields to compare.
+    :rtype: tuple
+    """
+    from auditlog.registry import auditlog
+
+    return auditlog.get_diff_plan(model).tracked_fields
+
+
+def get_datetime_value(obj, field):
+    """
+    Gets the value of a :py:class:`DateTimeField` of a model instance as a naive datetime in UTC, so values in different
+    timezones can be compared.
+    """
+    try:
+        value = field.to_python(getattr(obj, field.name, None))
+        if value is not None and settings.USE_TZ and not timezone.is_naive(value):
+            value = timezone.make_naive(value, timezone=timezone.utc)
+    except ObjectDoesNotExist:
+        value = field.default if field.default is not NOT_PROVIDED else None
+    return value
+
+
+def get_str_value(obj, field):
+    """
+    Gets the value of a field of a model instance as a string.
+    """
+    try:
+        value = smart_str(getattr(obj, field.name, None))
+    except ObjectDoesNotExist:
+        value = field.default if field.default is not NOT_PROVIDED else None
+    return value
+
+
 def get_field_value(obj, field):
     """
     Gets the value of a given model instance field.
@@ -57,22 +105,41 @@ def get_field_value(obj, field):
     if isinstance(field, DateTimeField):
         # DateTimeFields are timezone-aware, so we need to convert the field
         # to its naive form before we can accurately compare them for changes.
-        try:
-            value = field.to_python(getattr(obj, field.name, None))
-            if value is not None and settings.USE_TZ and not timezone.is_naive(value):
-                value = timezone.make_naive(value, timezone=timezone.utc)
-        except ObjectDoesNotExist:
-            value = field.default if field.default is not NOT_PROVIDED else None
-    else:
-        try:
-            value = smart_str(getattr(obj, field.name, None))
-        except ObjectDoesNotExist:
-            value = field.default if field.default is not NOT_PROVIDED else None
+        return get_datetime_value(obj, field)
+    return get_str_value(obj, field)
 
-    return value
 
+class DiffPlan(object):
+    """
+    The fields of a model that are compared by :py:func:`model_instance_diff`, in model order, each paired with the
+    function that extracts its value. A plan is compiled once per registered model by the registry.
 
-def model_instance_diff(old, new):
+    :py:attr:`tracked_fields` are compared when an instance is updated, :py:attr:`instance_fields` when an instance is
+    created or deleted.
+    """
+    __slots__ = ('model', 'tracked_fields', 'instance_fields', 'update_plan', 'instance_plan')
+
+    def __init__(self, model, include_fields=(), exclude_fields=()):
+        include_fields = frozenset(include_fields)
+        exclude_fields = frozenset(exclude_fields)
+
+        def included(field):
+            return ((not include_fields or field.name in include_fields)
+                    and field.name not in exclude_fields)
+
+        self.model = model
+        self.tracked_fields = tuple(f for f in model._meta.fields if included(f))
+        self.instance_fields = tuple(f for f in model._meta.get_fields() if track_field(f) and included(f))
+        self.update_plan = tuple(self._compile(f) for f in self.tracked_fields)
+        self.instance_plan = tuple(self._compile(f) for f in self.instance_fields)
+
+    @staticmethod
+    def _compile(field):
+        get_value = get_datetime_value if isinstance(field, DateTimeField) else get_str_value
+        return field.name, field, get_value
+
+
+def model_instance_diff(old, new, field_names=None):
     """
     Calculates the differences between two model instances. One of the instances may be ``None`` (i.e., a newly
     created model or deleted model). This will cause all fields with a value to have changed (from ``None``).
@@ -81,6 +148,8 @@ def model_instance_diff(old, new):
     :type old: Model
     :param new: The new state of the model instance.
     :type new: Model
+    :param field_names: If given, only the fields with these names are compared.
+    :type field_names: collection
     :return: A dictionary with the names of the changed fields as keys and a two tuple of the old and new field values
              as value.
     :rtype: dict
@@ -92,40 +161,26 @@ def model_instance_diff(old, new):
     if not (new is None or isinstance(new, Model)):
         raise TypeError("The supplied new instance is not a valid model instance.")
 
-    diff = []
-
     if old is not None and new is not None:
-        fields = set(old._meta.fields + new._meta.fields)
-        model_fields = auditlog.get_model_fields(new._meta.model)
+        plan = auditlog.get_diff_plan(new._meta.model).update_plan
     elif old is not None:
-        fields = set(get_fields_in_model(old))
-        model_fields = auditlog.get_model_fields(old._meta.model)
+        plan = auditlog.get_diff_plan(old._meta.model).instance_plan
     elif new is not None:
-        fields = set(get_fields_in_model(new))
-        model_fields = auditlog.get_model_fields(new._meta.model)
+        plan = auditlog.get_diff_plan(new._meta.model).instance_plan
     else:
-        fields = set()
-        model_fields = None
-
-    # Check if fields must be filtered
-    if model_fields and (model_fields['include_fields'] or model_fields['exclude_fields']) and fields:
-        if model_fields['include_fields']:
-            filtered_fields = [field for field in fields
-                               if field.name in model_fields['include_fields']]
-        else:
-            filtered_fields = fields
-        if model_fields['exclude_fields']:
-            filtered_fields = [field for field in filtered_fields
-                               if field.name not in model_fields['exclude_fields']]
-        fields = filtered_fields
-
-    for field in fields:
-        old_value = get_field_value(old, field)
-        new_value = get_field_value(new, field)
+        plan = ()
+
+    diff = []
+    for name, field, get_value in plan:
+        if field_names is not None and name not in field_names:
+            continue
+
+        old_value = get_value(old, field)
+        new_value = get_value(new, field)
 
         if old_value != new_value:
             diff.append({
-                'field': field.name,
+                'field': name,
                 'old': old_value,
                 'new': new_value
             })
@@ -134,3 +189,93 @@ def model_instance_diff(old, new):
         diff = None
 
     return diff
+
+
+# Types for which equal values always have equal string representations, so rows whose raw values are equal can be
+# skipped without converting them.
+EXACT_TYPES = frozenset((type(None), int, str, bool, datetime.datetime, datetime.date, datetime.time, uuid.UUID))
+
+# Integer columns of at least this many rows are compared with NumPy, when it is installed.
+NUMPY_MIN_ROWS = 64
+
+
+def _raw_value(obj, field):
+    if obj is None:
+        return None
+    try:
+        return getattr(obj, field.attname, None)
+    except ObjectDoesNotExist:
+        return field.default if field.default is not NOT_PROVIDED else None
+
+
+def _changed_rows(field, old_values, new_values):
+    """
+    Returns the indices of the rows whose raw values may differ. Integer columns are compared with NumPy when it is
+    installed.
+    """
+    if np is not None and len(old_values) >= NUMPY_MIN_ROWS and isinstance(field, IntegerField):
+        old_array = np.array(old_values)
+        new_array = np.array(new_values)
+        if old_array.dtype.kind == 'i' and new_array.dtype.kind == 'i' and old_array.ndim == new_array.ndim == 1:
+            return np.flatnonzero(old_array != new_array).tolist()
+
+    return [
+        i for i, (old_value, new_value) in enumerate(zip(old_values, new_values))
+        if not (type(old_value) is type(new_value) and type(old_value) in EXACT_TYPES and old_value == new_value)
+    ]
+
+
+def model_instances_diff(pairs, field_names=None):
+    """
+    Calculates the differences for many pairs of model instances at once. The result is the same as calling
+    :py:func:`model_instance_diff` for every pair, but the instances are compared column by column: the raw value of a
+    field is extracted for all rows at once, and only rows whose raw values differ are converted and compared like
+    :py:func:`model_instance_diff` does. This also means related objects are only fetched for rows whose foreign key
+    changed.
+
+    :param pairs: The ``(old, new)`` pairs of model instances, either may be ``None``.
+    :type pairs: iterable
+    :param field_names: If given, only the fields with these names are compared.
+    :type field_names: collection
+    :return: The changes of every pair in the same order as the pairs, ``None`` for pairs without changes.
+    :rtype: list
+    """
+    from auditlog.registry import auditlog
+
+    pairs = list(pairs)
+    diffs = [[] for _ in pairs]
+
+    groups = {}
+    for i, (old, new) in enumerate(pairs):
+        if not (old is None or isinstance(old, Model)):
+            raise TypeError("The supplied old instance is not a valid model instance.")
+        if not (new is None or isinstance(new, Model)):
+            raise TypeError("The supplied new instance is not a valid model instance.")
+        if old is None and new is None:
+            continue
+        model = (new if new is not None else old)._meta.model
+        groups.setdefault((model, old is not None and new is not None), []).append(i)
+
+    for (model, update), rows in groups.items():
+        plan = auditlog.get_diff_plan(model)
+        olds = [pairs[i][0] for i in rows]
+        news = [pairs[i][1] for i in rows]
+        for name, field, get_value in (plan.update_plan if update else plan.instance_plan):
+            if field_names is not None and name not in field_names:
+                continue
+            if hasattr(field, 'attname'):
+                candidates = _changed_rows(field, [_raw_value(obj, field) for obj in olds],
+                                           [_raw_value(obj, field) for obj in news])
+            else:
+                candidates = range(len(rows))
+            for j in candidates:
+                old_value = get_value(olds[j], field)
+                new_value = get_value(news[j], field)
+                if old_value != new_value:
+                    diffs[rows[j]].append({
+                        'field': name,
+                        'old': old_value,
+                        'new': new_value
+                    })
+
+    return [diff or None for diff in diffs]
@@ -1,4 +1,5 @@
 import logging
+import uuid
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
@@ -6,20 +7,41 @@ from django.db import models
 from django.dispatch import Signal
 from django.utils import timezone
 from django.utils.encoding import smart_str
-from elasticsearch.helpers import bulk
-from elasticsearch_dsl import Document, connections, Keyword, Date, Nested, InnerDoc, Text
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import bulk, streaming_bulk
+from elasticsearch_dsl import Document, Keyword, Date, Nested, InnerDoc, MultiSearch, Text
+from elasticsearch_dsl.field import Field
+from elasticsearch_dsl.utils import DOC_META_FIELDS, META_FIELDS
 
-# Define a default Elasticsearch client
-connections.create_connection(hosts=[settings.ELASTICSEARCH_HOST])
+from auditlog.connection import get_client, get_timeout
+from auditlog.context import get_context_fields
+from auditlog.query import LogEntryManager
+from auditlog import lifecycle
 
 
 MAX = 75
 
 
+class Wildcard(Field):
+    """
+    A ``wildcard`` field, indexed for fast wildcard and substring queries, also with a leading wildcard.
+    """
+    name = 'wildcard'
+
+
+# The fields searched by substring in the admin, through their wildcard subfield (see auditlog.filters.contains).
+SUBSTRING_FIELDS = ('object_repr', 'actor_email', 'actor_first_name', 'actor_last_name')
+
+
+# Values of changes up to this length are also indexed as keywords, for exact and prefix searches (see
+# auditlog.query.changes_query). Longer values, e.g. texts, are only indexed for full text search.
+CHANGE_KEYWORD_LENGTH = 256
+
+
 class Change(InnerDoc):
     field = Keyword(required=True)
-    old = Text()
-    new = Text()
+    old = Text(fields={'keyword': Keyword(ignore_above=CHANGE_KEYWORD_LENGTH)})
+    new = Text(fields={'keyword': Keyword(ignore_above=CHANGE_KEYWORD_LENGTH)})
 
 
 log_created = Signal()
@@ -46,12 +68,12 @@ class LogEntry(Document):
 
     object_id = Keyword()
     object_pk = Keyword()
-    object_repr = Text()
+    object_repr = Text(fields={'wildcard': Wildcard()})
 
     actor_id = Keyword()
-    actor_email = Keyword()
-    actor_first_name = Text()
-    actor_last_name = Text()
+    actor_email = Keyword(fields={'wildcard': Wildcard()})
+    actor_first_name = Text(fields={'wildcard': Wildcard()})
+    actor_last_name = Text(fields={'wildcard': Wildcard()})
 
     remote_addr = Text()
 
@@ -59,9 +81,87 @@ class LogEntry(Document):
 
     changes = Nested(Change)
 
+    objects = LogEntryManager()
+
     class Index:
         name = settings.AUDITLOG_INDEX_NAME
 
+    @classmethod
+    def _get_using(cls, using=None):
+        # Resolve the client lazily instead of through a connection alias registered on import.
+        return using or get_client()
+
+    @classmethod
+    def init(cls, index=None, using=None):
+        """
+        Create the index, or when the index lifecycle is enabled the index template, the first generation and the
+        aliases (see :py:func:`auditlog.lifecycle.setup`).
+        """
+        if index is None and lifecycle.get_config()['ENABLED']:
+            return lifecycle.setup(cls._get_using(using))
+        return super().init(index=index, using=cls._get_using(using))
+
+    @classmethod
+    def _default_index(cls, index=None):
+        # Searches and lookups go through the read alias, see auditlog.lifecycle.
+        return index or lifecycle.get_read_index()
+
+    def _get_index(self, index=None, required=True):
+        # New log entries are written through the write alias or data stream, see auditlog.lifecycle.
+        if index is None and getattr(self.meta, 'index', None) is None:
+            index = lifecycle.get_write_index()
+        return super()._get_index(index, required)
+
+    @classmethod
+    def search(cls, using=None, index=None):
+        s = super().search(using=using, index=index).params(request_timeout=get_timeout('search'))
+        if lifecycle.is_data_stream():
+            s = s.params(ignore_unavailable=True)
+        return s
+
+    @classmethod
+    def msearch(cls, searches, using=None):
+        """
+        Run searches in a single ``_msearch`` request, so they cost one round trip instead of one each.
+
+        :param searches: The searches, e.g. from :py:meth:`search`.
+        :type searches: list
+        :param using: The client, defaults to the client of the first search.
+        :return: The responses, in the order of the searches.
+        :rtype: list
+        """
+        if using is None and searches:
+            using = searches[0]._using
+        ms = MultiSearch(using=cls._get_using(using)).params(request_timeout=get_timeout('search'))
+        for search in searches:
+            # Request parameters belong to the _msearch request, only the index options to the header of a search.
+            search = search._clone()
+            search._params.pop('request_timeout', None)
+            ms = ms.add(search)
+        return ms.execute()
+
+    @classmethod
+    def get(cls, id, using=None, index=None, **kwargs):
+        """
+        Get a log entry by its id. The read alias may cover many indices, so the entry is looked up with a search.
+
+        :raises elasticsearch.exceptions.NotFoundError: When there is no log entry with the given id.
+        """
+        hits = cls.search(using=using, index=index).filter('ids', values=[id])[:1].execute()
+        if not hits:
+            raise NotFoundError(404, 'not_found', {'_id': id})
+        return hits[0]
+
+    def to_dict(self, include_meta=False, skip_empty=True):
+        d = super().to_dict(include_meta=include_meta, skip_empty=skip_empty)
+        if lifecycle.is_data_stream():
+            # Data streams require a @timestamp field and only accept new documents.
+            source = d['_source'] if include_meta else d
+            source['@timestamp'] = source.get('timestamp')
+            if include_meta:
+                d['_op_type'] = 'create'
+        return d
+
     @property
     def actor(self):
         if self.actor_email:
@@ -83,9 +183,28 @@ class LogEntry(Document):
         return '%d change%s: %s' % (len(changes), s, fields)
 
     @staticmethod
-    def bulk(client, documents):
+    def bulk(client, documents, **kwargs):
         actions = (i.to_dict(True) for i in documents)
-        return bulk(client, actions)
+        return bulk(client, actions, **kwargs)
+
+    @staticmethod
+    def streaming_bulk(client, documents, **kwargs):
+        """
+        Index the given documents in chunks, yielding an ``(ok, result)`` tuple per document in the order they were
+        given.
+        """
+        actions = (i.to_dict(True) for i in documents)
+        return streaming_bulk(client, actions, **kwargs)
+
+    @staticmethod
+    def async_streaming_bulk(client, documents, **kwargs):
+        """
+        Async version of :py:meth:`streaming_bulk`, for an ``AsyncElasticsearch`` client.
+        """
+        from elasticsearch.helpers import async_streaming_bulk
+
+        actions = (i.to_dict(True) for i in documents)
+        return async_streaming_bulk(client, actions, **kwargs)
 
     def __str__(self):
         if self.action == self.Action.CREATE:
@@ -126,17 +245,77 @@ class LogEntry(Document):
             id_ = instance._meta.pk.get_prep_value(pk)
             if isinstance(id_, int):
                 kwargs.setdefault('object_id', id_)
+            # Assign the document id up front, so sending an entry again never creates a duplicate.
+            kwargs.setdefault('meta', {'id': uuid.uuid4().hex})
             log_entry = cls(**kwargs)
+            log_entry.apply_context()
             return log_entry
         return None
 
+    @classmethod
+    def search_for_object(cls, instance):
+        """
+        Returns a search for the log entries of a model instance, oldest first. Building the search does not query the
+        database, so it can be used from async code as well (see :py:func:`auditlog.aio.asearch`).
+
+        :param instance: The model instance to search the log entries for.
+        :type instance: Model
+        :rtype: Search
+        """
+        return cls.objects.for_object(instance).order_by('timestamp').search
+
+    def apply_context(self):
+        """
+        Set the actor and remote address from the current audit context (see :py:func:`auditlog.context.set_actor`).
+        Values that were already set are kept.
+        """
+        fields = get_context_fields()
+        if self.actor_id is not None:
+            fields.pop('actor_id', None)
+            fields.pop('actor_email', None)
+            fields.pop('actor_first_name', None)
+            fields.pop('actor_last_name', None)
+        for name, value in fields.items():
+            if getattr(self, name) is None:
+                setattr(self, name, value)
+
     def save(self, using=None, index=None, validate=True, skip_empty=True, **kwargs):
+        if lifecycle.is_data_stream():
+            kwargs.setdefault('op_type', 'create')
         try:
+            self.apply_context()
             log_created.send(self.__class__, instance=self)
             return super().save(using, index, validate, skip_empty, **kwargs)
         except Exception:
             logging.exception("Error when saving log to elasticsearch", extra={'log_entry': self.to_dict()})
 
+    async def asave(self, client=None, index=None, validate=True, skip_empty=True, **kwargs):
+        """
+        Async version of :py:meth:`save`, indexes the entry with the ``AsyncElasticsearch`` client of the running event
+        loop (see :py:func:`auditlog.aio.get_async_client`).
+        """
+        from auditlog.aio import get_async_client
+
+        try:
+            self.apply_context()
+            log_created.send(self.__class__, instance=self)
+            if validate:
+                self.full_clean()
+
+            client = client or get_async_client()
+            doc_meta = {k: self.meta[k] for k in DOC_META_FIELDS if k in self.meta}
+            if lifecycle.is_data_stream():
+                doc_meta['op_type'] = 'create'
+            doc_meta.update(kwargs)
+            meta = await client.index(index=self._get_index(index), body=self.to_dict(skip_empty=skip_empty),
+                                      **doc_meta)
+            for k in META_FIELDS:
+                if '_' + k in meta:
+                    setattr(self.meta, k, meta['_' + k])
+            return meta['result']
+        except Exception:
+            logging.exception("Error when saving log to elasticsearch", extra={'log_entry': self.to_dict()})
+
     @classmethod
     def _get_pk_value(cls, instance):
         """
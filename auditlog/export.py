@@ -0,0 +1,209 @@
+import gzip
+import json
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils.dateparse import parse_datetime
+from elasticsearch.helpers import scan
+from elasticsearch_dsl import Q
+
+from auditlog import lifecycle
+from auditlog.connection import get_timeout
+
+PAGE_SIZE = 1000
+KEEP_ALIVE = '5m'
+
+ACTIONS = ['create', 'update', 'delete']
+
+
+def get_query(content_types=(), actors=(), since=None, until=None):
+    """
+    Returns the query for the log entries to export. Every filter is optional.
+
+    :param content_types: Only log entries of these content types, as ``'app_label.model'`` strings.
+    :type content_types: list
+    :param actors: Only log entries of these actors, by primary key.
+    :type actors: list
+    :param since: Only log entries from this time on.
+    :type since: datetime
+    :param until: Only log entries before this time.
+    :type until: datetime
+    :rtype: Q
+    """
+    filters = []
+    if content_types:
+        should = []
+        for content_type in content_types:
+            try:
+                app_label, model = content_type.lower().split('.')
+            except ValueError:
+                raise ValueError("Content types look like 'app_label.model', not %r." % content_type)
+            should.append(Q('bool', filter=[Q('term', content_type_app_label=app_label),
+                                            Q('term', content_type_model=model)]))
+        filters.append(Q('bool', should=should, minimum_should_match=1))
+    if actors:
+        filters.append(Q('terms', actor_id=[str(actor) for actor in actors]))
+    if since or until:
+        timestamp = {}
+        if since:
+            timestamp['gte'] = since.isoformat()
+        if until:
+            timestamp['lt'] = until.isoformat()
+        filters.append(Q('range', timestamp=timestamp))
+    return Q('bool', filter=filters) if filters else Q('match_all')
+
+
+def iter_hits(client, query, page_size=PAGE_SIZE, keep_alive=KEEP_ALIVE):
+    """
+    Yield the hits that match the query, oldest first. The log entries are paged through with a point in time and
+    ``search_after``, so the result is a consistent snapshot and deep pages cost as much as the first one.
+
+    :param client: The Elasticsearch client.
+    :param query: The query, e.g. from :py:func:`get_query`.
+    :type query: Q
+    :rtype: generator
+    """
+    pit = client.open_point_in_time(index=lifecycle.get_read_index(), keep_alive=keep_alive)['id']
+    body = {
+        'size': page_size,
+        'query': query.to_dict(),
+        'sort': [{'timestamp': 'asc'}, {'_shard_doc': 'asc'}],
+        'track_total_hits': False,
+    }
+    try:
+        while True:
+            body['pit'] = {'id': pit, 'keep_alive': keep_alive}
+            response = client.search(body=body, request_timeout=get_timeout('search'))
+            # Every response may carry a new id for the point in time.
+            pit = response.get('pit_id', pit)
+            hits = response['hits']['hits']
+            yield from hits
+            if len(hits) < page_size:
+                return
+            body['search_after'] = hits[-1]['sort']
+    finally:
+        client.close_point_in_time(body={'id': pit})
+
+
+def iter_slice(client, query, slice_id, max_slices, page_size=PAGE_SIZE, keep_alive=KEEP_ALIVE):
+    """
+    Yield the hits of one slice of a sliced scroll over the log entries that match the query. The slices together
+    cover every hit once and can be read in parallel.
+
+    :rtype: generator
+    """
+    body = {'query': query.to_dict(), 'slice': {'id': slice_id, 'max': max_slices}}
+    return scan(client, query=body, index=lifecycle.get_read_index(), scroll=keep_alive, size=page_size,
+                request_timeout=get_timeout('search'))
+
+
+class NDJSONWriter(object):
+    """
+    Writes hits to a gzip compressed file, one log entry per line. Every line is the document with its id in ``_id``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.count = 0
+
+    def write(self, hit):
+        self.file.write(json.dumps(dict(hit['_source'], _id=hit['_id']), separators=(',', ':')))
+        self.file.write('\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class SQLWriter(object):
+    """
+    Writes hits to the database table of older versions (:py:class:`auditlog.models.LogEntry`) in batches. Log entries
+    of content types that do not exist in the database are skipped; actors that do not exist are left out.
+    """
+
+    def __init__(self, batch_size=PAGE_SIZE):
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+        self.skipped = 0
+
+    def write(self, hit):
+        self.batch.append(hit['_source'])
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        from auditlog.models import LogEntry as LogEntry_db
+
+        user_model = get_user_model()
+        actor_ids = {}
+        for source in self.batch:
+            if source.get('actor_id'):
+                try:
+                    actor_ids[source['actor_id']] = user_model._meta.pk.to_python(source['actor_id'])
+                except ValidationError:
+                    pass
+        existing = set(user_model._default_manager.filter(pk__in=actor_ids.values()).values_list('pk', flat=True))
+
+        entries = []
+        for source in self.batch:
+            try:
+                content_type = ContentType.objects.get_by_natural_key(source['content_type_app_label'],
+                                                                      source['content_type_model'])
+            except ContentType.DoesNotExist:
+                self.skipped += 1
+                continue
+            actor_id = actor_ids.get(source.get('actor_id'))
+            entries.append(LogEntry_db(
+                content_type=content_type,
+                object_pk=source.get('object_pk') or '',
+                object_id=source.get('object_id'),
+                object_repr=source.get('object_repr') or '',
+                action=ACTIONS.index(source['action']),
+                changes={change['field']: [change.get('old'), change.get('new')]
+                         for change in source.get('changes') or []},
+                actor_id=actor_id if actor_id in existing else None,
+                remote_addr=source.get('remote_addr'),
+                timestamp=parse_datetime(source['timestamp']),
+            ))
+        self.create(entries)
+        self.count += len(entries)
+        self.batch = []
+
+    def create(self, entries):
+        """
+        Insert log entries with their exported timestamps, which ``bulk_create`` replaces with the current time (the
+        timestamp field has ``auto_now_add``). When the database returns the primary keys of a bulk insert, the
+        timestamps are restored with a single update; otherwise the log entries are saved one by one as raw saves,
+        like fixtures, which keep the timestamps.
+        """
+        from auditlog.models import LogEntry as LogEntry_db
+
+        if not entries:
+            return
+        using = router.db_for_write(LogEntry_db)
+        timestamps = [entry.timestamp for entry in entries]
+        with transaction.atomic(using=using):
+            if not connections[using].features.can_return_rows_from_bulk_insert:
+                for entry in entries:
+                    entry.save_base(using=using, raw=True)
+                return
+            LogEntry_db.objects.using(using).bulk_create(entries, batch_size=self.batch_size)
+            LogEntry_db.objects.using(using).filter(pk__in=[entry.pk for entry in entries]).update(timestamp=Case(
+                *[When(pk=entry.pk, then=Value(timestamp)) for entry, timestamp in zip(entries, timestamps)],
+                output_field=DateTimeField(),
+            ))
+        for entry, timestamp in zip(entries, timestamps):
+            entry.timestamp = timestamp
+
+    def close(self):
+        if self.batch:
+            self.flush()
+        if self.skipped:
+            logging.warning("Skipped %d log entries of content types that do not exist in the database.",
+                            self.skipped)
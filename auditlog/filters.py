@@ -1,14 +1,28 @@
+import re
 from collections import OrderedDict
-from functools import reduce
 
 from django.contrib.admin import SimpleListFilter
 from django.contrib.admin.widgets import AdminSplitDateTime, AdminTextInputWidget
-from django.contrib.contenttypes.models import ContentType
 from django.forms import forms, SplitDateTimeField, CharField, ChoiceField
 from django.forms.utils import pretty_name
 from elasticsearch_dsl import Q
 
-from auditlog.documents import LogEntry
+from auditlog.documents import SUBSTRING_FIELDS
+from auditlog.query import changes_query
+
+
+def contains(field, term):
+    """
+    Returns a query for the log entries whose field contains the term, ignoring case. Fields with a wildcard subfield
+    (see :py:data:`auditlog.documents.SUBSTRING_FIELDS`) are searched through it, which unlike a leading wildcard on a
+    text or keyword field does not scan every term of the index. Other fields are searched with a match query.
+
+    :rtype: Q
+    """
+    if field not in SUBSTRING_FIELDS:
+        return Q('match', **{field: term})
+    value = '*%s*' % re.sub(r'([\\*?])', r'\\\1', term)
+    return Q('wildcard', **{'%s.wildcard' % field: {'value': value, 'case_insensitive': True}})
 
 
 class SimpleInputFilter(SimpleListFilter):
@@ -29,7 +43,17 @@ class SimpleInputFilter(SimpleListFilter):
         term = self.value()
         if term is None:
             return
-        return queryset.query('query_string', query=f'*{term}*', fields=[self.parameter_name])
+        return queryset.filter(contains(self.parameter_name, term))
+
+    def facet_search(self, changelist):
+        """
+        Returns a search with the aggregations this filter needs, or ``None``. The changelist runs it together with the
+        search for the page and passes the response to :py:meth:`facet_results`.
+        """
+        return None
+
+    def facet_results(self, response):
+        pass
 
     def choices(self, changelist):
         # Grab only the "all" option.
@@ -71,9 +95,9 @@ class ActorInputFilter(SimpleInputFilter):
             term = self.value()
             if term is None:
                 return
-            return queryset.query(
-                Q('match', actor_id=term) |
-                Q('query_string', query=f'*{term}*', fields=['actor_first_name', 'actor_last_name', 'actor_email'])
+            return queryset.filter(
+                Q('term', actor_id=term) |
+                contains('actor_first_name', term) | contains('actor_last_name', term) | contains('actor_email', term)
             )
 
 
@@ -137,16 +161,66 @@ class BaseChoiceFilter(SimpleInputFilter):
         )
 
 
-class ActionChoiceFilter(BaseChoiceFilter):
+class FacetChoiceFilter(BaseChoiceFilter):
+    """
+    A choice filter whose choices are the most common values of a field among the log entries that match the other
+    filters, with their number of log entries. The values are aggregated from Elasticsearch, the label of a value can
+    come from another field of the same log entries.
+    """
+    facet_field = None
+    label_field = None
+    facet_size = 50
+
+    @property
+    def field_choices(self):
+        # The choices are set by facet_results, until then only the selected value is known and valid.
+        value = self.value()
+        return [(value, value)] if value else []
+
+    def queryset(self, request, queryset):
+        if self.form.is_valid():
+            term = self.value()
+            if term:
+                return queryset.filter('term', **{self.facet_field or self.parameter_name: term})
+        return None
+
+    def facet_search(self, changelist):
+        s = changelist.get_facet_queryset(exclude=self)
+        terms = s.aggs.bucket('facet', 'terms', field=self.facet_field or self.parameter_name, size=self.facet_size)
+        if self.label_field:
+            terms.bucket('label', 'terms', field=self.label_field, size=1)
+        return s
+
+    def facet_results(self, response):
+        choices = []
+        for bucket in response.aggregations.facet.buckets:
+            label = bucket.key
+            if self.label_field and bucket.label.buckets:
+                label = bucket.label.buckets[0].key
+            choices.append((bucket.key, '%s (%d)' % (label, bucket.doc_count)))
+        value = self.value()
+        if value and value not in [key for key, label in choices]:
+            choices.append((value, value))
+        self.form.fields[self.parameter_name].choices = choices
+
+
+class ActionChoiceFilter(FacetChoiceFilter):
     parameter_name = 'action'
     title = 'Action'
-    field_choices = LogEntry.Action.choices
 
 
-class ContentTypeChoiceFilter(BaseChoiceFilter):
+class ContentTypeChoiceFilter(FacetChoiceFilter):
     parameter_name = 'content_type_id'
     title = 'Content type'
-    field_choices = ContentType.objects.values_list('id', 'model')
+    label_field = 'content_type_model'
+    facet_size = 1000
+
+
+class ActorChoiceFilter(FacetChoiceFilter):
+    parameter_name = 'actor_id'
+    title = 'Top actors'
+    label_field = 'actor_email'
+    facet_size = 20
 
 
 class ChangesFilter(SimpleInputFilter):
@@ -182,26 +256,11 @@ class ChangesFilter(SimpleInputFilter):
 
     def queryset(self, request, queryset):
         if self.form.is_valid():
-            validated_data = dict(self.form.cleaned_data.items())
-            if validated_data:
-                query_params = self._make_query_filter(validated_data)
-                if query_params:
-                    return queryset.filter(
-                        'nested',
-                        path='changes',
-                        query=reduce(lambda a, b: a & b, query_params)
-                    )
+            validated_data = self.form.cleaned_data
+            if any(validated_data.values()):
+                return queryset.filter(changes_query(
+                    field=validated_data.get(self.lookup_kwarg_field),
+                    old=validated_data.get(self.lookup_kwarg_old),
+                    new=validated_data.get(self.lookup_kwarg_new),
+                ))
         return None
-
-    def _make_query_filter(self, validated_data):
-        changes_field = validated_data.get(self.lookup_kwarg_field, None)
-        changes_new = validated_data.get(self.lookup_kwarg_new, None)
-        changes_old = validated_data.get(self.lookup_kwarg_old, None)
-        query_params = []
-        if changes_field:
-            query_params.append(Q('term', **{f'{self.parameter_name}__{self.lookup_kwarg_field}': changes_field}))
-        if changes_new:
-            query_params.append(Q('term', **{f'{self.parameter_name}__{self.lookup_kwarg_new}': changes_new}))
-        if changes_old:
-            query_params.append(Q('term', **{f'{self.parameter_name}__{self.lookup_kwarg_old}': changes_old}))
-        return query_params
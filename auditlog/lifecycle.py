@@ -0,0 +1,280 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from elasticsearch.exceptions import NotFoundError
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+PERIODS = {
+    DAILY: ('{now/d{yyyy.MM.dd}}', '1d'),
+    WEEKLY: ('{now/w{yyyy.MM.dd}}', '7d'),
+    MONTHLY: ('{now/M{yyyy.MM}}', '30d'),
+}
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DATA_STREAM': False,
+    'PERIOD': DAILY,
+    'MAX_SIZE': '50gb',
+    'MAX_DOCS': None,
+    'MAX_AGE': None,
+    'SHARDS': 1,
+    'REPLICAS': 1,
+}
+
+
+def get_config():
+    """
+    Returns the index lifecycle configuration, the ``AUDITLOG_LIFECYCLE`` setting merged with the defaults.
+
+    :rtype: dict
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AUDITLOG_LIFECYCLE', {}))
+    if config['PERIOD'] not in PERIODS:
+        raise ImproperlyConfigured("Unknown AUDITLOG_LIFECYCLE['PERIOD']: %r" % config['PERIOD'])
+    return config
+
+
+def get_base_name():
+    return settings.AUDITLOG_INDEX_NAME
+
+
+def get_write_index():
+    """
+    Returns the name log entries are written to: the ``AUDITLOG_INDEX_NAME`` index when the lifecycle is disabled,
+    otherwise the write alias (``<name>-write``) or the data stream (``<name>-stream``).
+
+    :rtype: str
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return get_base_name()
+    if config['DATA_STREAM']:
+        return get_base_name() + '-stream'
+    return get_base_name() + '-write'
+
+
+def get_read_index():
+    """
+    Returns the name log entries are searched in: the ``AUDITLOG_INDEX_NAME`` index when the lifecycle is disabled,
+    otherwise the read alias (``<name>-read``) that covers all generations, or the data stream. A data stream is
+    searched together with the ``AUDITLOG_INDEX_NAME`` index, so entries indexed before it was set up are found as
+    well.
+
+    :rtype: str
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return get_base_name()
+    if config['DATA_STREAM']:
+        return '%s,%s' % (get_write_index(), get_base_name())
+    return get_base_name() + '-read'
+
+
+def is_data_stream():
+    config = get_config()
+    return config['ENABLED'] and config['DATA_STREAM']
+
+
+def get_rollover_conditions(max_size=None, max_docs=None, max_age=None):
+    """
+    Returns the rollover conditions, the given values or else the configured ones. The maximum age defaults to the
+    length of the period.
+
+    :rtype: dict
+    """
+    config = get_config()
+    conditions = {
+        'max_size': max_size or config['MAX_SIZE'],
+        'max_docs': max_docs or config['MAX_DOCS'],
+        'max_age': max_age or config['MAX_AGE'] or PERIODS[config['PERIOD']][1],
+    }
+    return {key: value for key, value in conditions.items() if value}
+
+
+def get_index_template():
+    """
+    Returns the composable index template every generation is created from.
+
+    :rtype: dict
+    """
+    from auditlog.documents import LogEntry
+
+    config = get_config()
+    mappings = LogEntry._doc_type.mapping.to_dict()
+    template = {
+        'settings': {
+            'number_of_shards': config['SHARDS'],
+            'number_of_replicas': config['REPLICAS'],
+        },
+        'mappings': mappings,
+    }
+    body = {'index_patterns': [get_base_name() + '-*'], 'template': template, 'priority': 100}
+    if config['DATA_STREAM']:
+        mappings.setdefault('properties', {})['@timestamp'] = {'type': 'date'}
+        body['data_stream'] = {}
+    else:
+        template['aliases'] = {get_read_index(): {}}
+    return body
+
+
+def setup(client):
+    """
+    Install the index template and create the first generation with its aliases, or the data stream. An existing
+    ``AUDITLOG_INDEX_NAME`` index is added to the read alias, so entries indexed before are still found. Does nothing
+    for parts that already exist.
+
+    :param client: The Elasticsearch client.
+    :return: The names of what was created.
+    :rtype: list
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        raise ImproperlyConfigured("AUDITLOG_LIFECYCLE['ENABLED'] must be set to manage the index lifecycle.")
+
+    created = []
+    client.indices.put_index_template(name=get_base_name(), body=get_index_template())
+    created.append('index template %s' % get_base_name())
+
+    write_index = get_write_index()
+    if config['DATA_STREAM']:
+        try:
+            client.indices.get_data_stream(name=write_index)
+        except NotFoundError:
+            client.indices.create_data_stream(name=write_index)
+            created.append('data stream %s' % write_index)
+        return created
+
+    if not client.indices.exists_alias(name=write_index):
+        name = '<%s-%s-000001>' % (get_base_name(), PERIODS[config['PERIOD']][0])
+        client.indices.create(index=name, body={'aliases': {write_index: {'is_write_index': True}}})
+        created.append('index %s' % name)
+    legacy = get_base_name()
+    if client.indices.exists(index=legacy) and not client.indices.exists_alias(name=get_read_index(), index=legacy):
+        client.indices.put_alias(index=legacy, name=get_read_index())
+        created.append('alias %s for %s' % (get_read_index(), legacy))
+    return created
+
+
+def update_mapping(client, slices='auto'):
+    """
+    Add the fields the :py:class:`~auditlog.documents.LogEntry` mapping gained to the existing indices or data stream
+    (and the index template, so new generations have them too), then start an update-by-query task that indexes the
+    log entries that are already there again, which fills the new fields. Searches keep working meanwhile; log entries
+    that have not been updated yet are just not found through the new fields.
+
+    :param client: The Elasticsearch client.
+    :return: The id of the update-by-query task.
+    :rtype: str
+    """
+    from auditlog.documents import LogEntry
+
+    if get_config()['ENABLED']:
+        client.indices.put_index_template(name=get_base_name(), body=get_index_template())
+    client.indices.put_mapping(index=get_read_index(), body=LogEntry._doc_type.mapping.to_dict(),
+                               ignore_unavailable=True)
+    response = client.update_by_query(index=get_read_index(), body={'query': {'match_all': {}}}, slices=slices,
+                                      conflicts='proceed', wait_for_completion=False, ignore_unavailable=True)
+    return response['task']
+
+
+def rollover(client, dry_run=False, **conditions):
+    """
+    Roll the write alias or data stream over to a new generation when one of the conditions is met (see
+    :py:func:`get_rollover_conditions`).
+
+    :param client: The Elasticsearch client.
+    :param dry_run: Only check the conditions.
+    :type dry_run: bool
+    :return: The response of the rollover API.
+    :rtype: dict
+    """
+    body = {'conditions': get_rollover_conditions(**conditions)}
+    return client.indices.rollover(alias=get_write_index(), body=body, dry_run=dry_run)
+
+
+def get_generations(client):
+    """
+    Returns the generations behind the read alias or data stream with the time of their newest log entry, oldest
+    first. The generation that is currently written to is marked as such.
+
+    :param client: The Elasticsearch client.
+    :return: A list of dicts with ``index``, ``newest``, ``docs`` and ``write`` keys.
+    :rtype: list
+    """
+    if is_data_stream():
+        stream = client.indices.get_data_stream(name=get_write_index())['data_streams'][0]
+        names = [index['index_name'] for index in stream['indices']]
+        write = names[-1]
+    else:
+        names = sorted(client.indices.get_alias(name=get_read_index()))
+        write_alias = get_write_index()
+        write = next((name for name, info in client.indices.get_alias(name=write_alias).items()
+                      if info['aliases'][write_alias].get('is_write_index')), None)
+
+    response = client.search(index=','.join(names), body={
+        'size': 0,
+        'aggs': {'generations': {
+            'terms': {'field': '_index', 'size': max(len(names), 1)},
+            'aggs': {'newest': {'max': {'field': 'timestamp'}}},
+        }},
+    })
+    generations = {name: {'index': name, 'newest': None, 'docs': 0, 'write': name == write} for name in names}
+    for bucket in response['aggregations']['generations']['buckets']:
+        value = bucket['newest'].get('value')
+        generation = generations[bucket['key']]
+        generation['docs'] = bucket['doc_count']
+        if value is not None:
+            generation['newest'] = datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+    return [generations[name] for name in names]
+
+
+def get_expired_generations(client, older_than):
+    """
+    Returns the generations that only hold log entries older than ``older_than``. The generation that is currently
+    written to never expires.
+
+    :param client: The Elasticsearch client.
+    :param older_than: The maximum age of log entries.
+    :type older_than: timedelta
+    :rtype: list
+    """
+    cutoff = timezone.now() - older_than
+    return [
+        generation for generation in get_generations(client)
+        if not generation['write'] and (generation['newest'] is None or generation['newest'] < cutoff)
+    ]
+
+
+def delete_generations(client, generations):
+    """
+    Delete whole generations, which is much cheaper than deleting their log entries one by one.
+
+    :param client: The Elasticsearch client.
+    :param generations: The generations to delete, as returned by :py:func:`get_expired_generations`.
+    :type generations: list
+    """
+    for generation in generations:
+        client.indices.delete(index=generation['index'])
+
+
+DURATION_RE = re.compile(r'^(\d+)([smhdw])$')
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_duration(value):
+    """
+    Parse a duration like ``'90d'`` or ``'12h'``.
+
+    :rtype: timedelta
+    """
+    match = DURATION_RE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid duration: %r, expected a number followed by s, m, h, d or w" % value)
+    return datetime.timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
@@ -0,0 +1,114 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from auditlog import export, lifecycle
+from auditlog.connection import get_client
+
+SUFFIX = '.ndjson.gz'
+
+
+def parse_time(value):
+    """
+    Parse a point in time: an ISO 8601 date or date and time, or a duration like ``'30d'`` that counts back from now.
+    """
+    try:
+        return timezone.now() - lifecycle.parse_duration(value)
+    except ValueError:
+        pass
+    moment = parse_datetime(value)
+    if moment is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError("Invalid time: %r, expected an ISO 8601 date or a duration like '30d'." % value)
+        moment = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Exports log entries from Elasticsearch to gzip compressed NDJSON files or the database table of older " \
+           "versions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output',
+                            help="The file to write, e.g. 'auditlog.ndjson.gz'. With several slices every slice is "
+                                 "written to its own file, numbered before the extension.")
+        parser.add_argument('--sql', action='store_true',
+                            help="Write the log entries to the database table of older versions instead of a file.")
+        parser.add_argument('--content-type', action='append', default=[], dest='content_types',
+                            help="Only export log entries of this content type, e.g. 'auth.user'. Can be repeated.")
+        parser.add_argument('--actor', action='append', default=[], dest='actors',
+                            help="Only export log entries of the actor with this primary key. Can be repeated.")
+        parser.add_argument('--since', help="Only export log entries from this time on, a date or e.g. '30d'.")
+        parser.add_argument('--until', help="Only export log entries before this time, a date or e.g. '30d'.")
+        parser.add_argument('--slices', type=int, default=1,
+                            help="Read this many slices of a sliced scroll in parallel instead of a single point in "
+                                 "time.")
+        parser.add_argument('--page-size', type=int, default=export.PAGE_SIZE,
+                            help="Number of log entries per search request and per database insert.")
+
+    def handle(self, *args, **options):
+        if bool(options['output']) == options['sql']:
+            raise CommandError("Give either an output file or --sql.")
+        try:
+            query = export.get_query(
+                content_types=options['content_types'],
+                actors=options['actors'],
+                since=parse_time(options['since']) if options['since'] else None,
+                until=parse_time(options['until']) if options['until'] else None,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        client = get_client()
+        slices = max(1, options['slices'])
+        if slices == 1:
+            jobs = [(export.iter_hits(client, query, page_size=options['page_size']), self.get_writer(options))]
+        else:
+            jobs = [
+                (export.iter_slice(client, query, i, slices, page_size=options['page_size']),
+                 self.get_writer(options, i))
+                for i in range(slices)
+            ]
+
+        writers = self.run(jobs)
+
+        for writer in writers:
+            if options['sql']:
+                self.stdout.write("Wrote %d log entries to the database." % writer.count)
+            else:
+                self.stdout.write("Wrote %d log entries to %s." % (writer.count, writer.path))
+
+    def get_writer(self, options, slice_id=None):
+        if options['sql']:
+            return export.SQLWriter(batch_size=options['page_size'])
+        path = options['output']
+        if slice_id is not None:
+            stem, suffix = (path[:-len(SUFFIX)], SUFFIX) if path.endswith(SUFFIX) else (path, '')
+            path = '%s-%d%s' % (stem, slice_id, suffix)
+        return export.NDJSONWriter(path)
+
+    def run(self, jobs):
+        if len(jobs) == 1:
+            self.drain(*jobs[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                for future in [executor.submit(self.drain, hits, writer, True) for hits, writer in jobs]:
+                    future.result()
+        return [writer for hits, writer in jobs]
+
+    def drain(self, hits, writer, threaded=False):
+        try:
+            for hit in hits:
+                writer.write(hit)
+        finally:
+            writer.close()
+            if threaded:
+                # Every thread has its own database connection.
+                connection.close()
@@ -1,25 +1,115 @@
-from django.core.management.base import BaseCommand
+import datetime
+import time
 
+from django.core.management.base import BaseCommand, CommandError
+
+from auditlog import lifecycle, retention
+from auditlog.connection import get_client
 from auditlog.models import LogEntry
 
 
 class Command(BaseCommand):
-    help = "Deletes all log entries from the database."
+    help = "Deletes expired log entries from Elasticsearch, according to the AUDITLOG_RETENTION setting."
 
     def add_arguments(self, parser):
         parser.add_argument('-y, --yes', action='store_true', default=None,
                             help="Continue without asking confirmation.", dest='yes')
+        parser.add_argument('--older-than',
+                            help="Delete the log entries older than this, e.g. '90d', instead of the configured "
+                                 "default maximum age.")
+        parser.add_argument('--all', action='store_true',
+                            help="Delete all log entries that no retention policy matches, whatever their age.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many log entries and bytes would be deleted.")
+        parser.add_argument('--slices', help="Number of slices per delete request, defaults to 'auto'.")
+        parser.add_argument('--requests-per-second', type=float,
+                            help="Throttle the delete requests to this many documents per second.")
+        parser.add_argument('--poll-interval', type=float, default=10.0,
+                            help="Seconds between progress reports of the delete requests.")
+        parser.add_argument('--no-wait', action='store_true',
+                            help="Start the delete requests and exit, run the command again to follow them.")
+        parser.add_argument('--sql', action='store_true',
+                            help="Also delete all log entries from the database table of older versions.")
 
     def handle(self, *args, **options):
-        answer = options['yes']
+        client = get_client()
+        state = retention.RetentionState.from_settings()
+        if state.tasks and not options['dry_run']:
+            self.stdout.write("Resuming %d delete requests." % len(state.tasks))
+            return self.follow(client, state, options)
+
+        if options['all'] and options['older_than']:
+            raise CommandError("--all and --older-than cannot be combined.")
+        try:
+            older_than = lifecycle.parse_duration(options['older_than']) if options['older_than'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['all']:
+            older_than = datetime.timedelta(0)
+        policies = retention.get_policies(max_age=older_than)
+        if not policies:
+            raise CommandError("No retention is configured. Set the MAX_AGE or POLICIES of AUDITLOG_RETENTION, or pass "
+                               "--older-than or --all.")
+        deletes = retention.get_deletes(policies)
+        generations = retention.get_droppable_generations(client, policies)
+
+        if options['dry_run']:
+            for name, reclaimed in retention.estimate(client, deletes, generations).items():
+                self.stdout.write("%s: %d log entries, %d bytes." % (name, reclaimed['docs'], reclaimed['bytes']))
+            return
+
+        if not self.confirm(options, policies):
+            self.stdout.write("Aborted.")
+            return
 
-        if answer is None:
-            self.stdout.write("This action will clear all log entries from the database.")
-            response = input("Are you sure you want to continue? [y/N]: ").lower().strip()
-            answer = response == 'y'
+        lifecycle.delete_generations(client, generations)
+        for generation in generations:
+            self.stdout.write("Deleted index %s (%d log entries)." % (generation['index'], generation['docs']))
 
-        if answer:
+        for delete in deletes:
+            task_id = retention.start_delete(client, delete, slices=options['slices'],
+                                             requests_per_second=options['requests_per_second'])
+            state.tasks[delete['name']] = dict(delete, task=task_id)
+            state.save()
+            self.stdout.write("Started deleting %s log entries older than %s (task %s)."
+                              % (delete['name'], delete['cutoff'], task_id))
+
+        if options['sql']:
             count, _ = LogEntry.objects.all().delete()
-            self.stdout.write("Deleted %d objects." % count)
+            self.stdout.write("Deleted %d objects from the database." % count)
+
+        self.follow(client, state, options)
+
+    def confirm(self, options, policies):
+        if options['yes'] is not None:
+            return options['yes']
+        if len(policies) == 1 and not policies[0]['max_age']:
+            self.stdout.write("This action will clear all log entries.")
         else:
-            self.stdout.write("Aborted.")
+            self.stdout.write("This action will delete the log entries older than their retention period.")
+        response = input("Are you sure you want to continue? [y/N]: ").lower().strip()
+        return response == 'y'
+
+    def follow(self, client, state, options):
+        """
+        Report the progress of the delete requests until they are done. Requests whose task was lost are started again,
+        they delete the same log entries because their cutoff times are fixed.
+        """
+        while state.tasks and not options['no_wait']:
+            for name, delete in list(state.tasks.items()):
+                progress = retention.get_progress(client, delete['task'])
+                if progress is None:
+                    delete['task'] = retention.start_delete(client, delete, slices=options['slices'],
+                                                            requests_per_second=options['requests_per_second'])
+                    self.stdout.write("Restarted deleting %s log entries (task %s)." % (name, delete['task']))
+                elif progress['completed']:
+                    del state.tasks[name]
+                    self.stdout.write("Deleted %d %s log entries%s." % (
+                        progress['deleted'], name,
+                        ' with %d failures' % len(progress['failures']) if progress['failures'] else ''))
+                else:
+                    self.stdout.write("Deleting %s log entries: %d of %d." % (name, progress['deleted'],
+                                                                             progress['total']))
+                state.save()
+            if state.tasks:
+                time.sleep(options['poll_interval'])
@@ -1,43 +1,277 @@
-from django.core.management import BaseCommand
-from elasticsearch_dsl import connections
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+from collections import deque
 
+from django.core.management import BaseCommand, CommandError
+from django.db import connections as db_connections
+from django.db.models import Max, Min
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
+
+from auditlog.connection import get_client, get_timeout
 from auditlog.documents import LogEntry, Change
 from auditlog.models import LogEntry as LogEntry_db
 
+ACTIONS = ['create', 'update', 'delete']
+
+FIELDS = (
+    'pk', 'action', 'content_type_id', 'content_type__app_label', 'content_type__model', 'object_id', 'object_pk',
+    'object_repr', 'timestamp', 'remote_addr', 'changes', 'actor_id', 'actor__email', 'actor__first_name',
+    'actor__last_name',
+)
+
+
+def iter_rows(start, end, batch_size):
+    """
+    Yield the legacy log entries with a primary key in ``(start, end]`` in primary key order, as dicts. Pages are
+    fetched by primary key (keyset pagination) with the content type and actor joined in, so every page takes a single
+    query no matter how far into the table it is.
+    """
+    last = start
+    while True:
+        rows = list(LogEntry_db.objects.filter(pk__gt=last, pk__lte=end).order_by('pk').values(*FIELDS)[:batch_size])
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]['pk']
+
+
+def iter_pks(pks, batch_size):
+    """
+    Yield the legacy log entries with the given primary keys, in primary key order, ``batch_size`` per query.
+    """
+    pks = sorted(pks)
+    for i in range(0, len(pks), batch_size):
+        yield from LogEntry_db.objects.filter(pk__in=pks[i:i + batch_size]).order_by('pk').values(*FIELDS)
+
+
+def to_document(row):
+    entry = LogEntry(
+        meta={'id': row['pk']},
+        action=ACTIONS[row['action']],
+        content_type_id=row['content_type_id'],
+        content_type_app_label=row['content_type__app_label'],
+        content_type_model=row['content_type__model'],
+        object_id=row['object_id'],
+        object_pk=row['object_pk'],
+        object_repr=row['object_repr'],
+        timestamp=row['timestamp'],
+    )
+    if row['actor_id'] is not None:
+        entry.actor_id = str(row['actor_id'])
+        entry.actor_email = row['actor__email']
+        entry.actor_first_name = row['actor__first_name']
+        entry.actor_last_name = row['actor__last_name']
+    if row['remote_addr']:
+        entry.remote_addr = row['remote_addr']
+    changes = row['changes']
+    if isinstance(changes, str):
+        changes = json.loads(changes) if changes else None
+    if changes:
+        entry.changes = [Change(field=key, old=val[0], new=val[1]) for key, val in changes.items()]
+    return entry
+
+
+def migrate_range(key, start, end, options, progress=None, retry=()):
+    """
+    Index the legacy log entries with a primary key in ``(start, end]``, after the log entries of ``retry``, the
+    primary keys that failed before. Progress is reported every chunk as ``(key, last primary key done, entries
+    indexed, primary keys failed, entries of retry done)`` tuples, on the ``progress`` queue when given.
+
+    :return: The reports.
+    :rtype: list
+    """
+    pks = deque()
+
+    def actions():
+        for row in iter_pks(retry, options['batch_size']):
+            pks.append((row['pk'], True))
+            yield to_document(row).to_dict(include_meta=True)
+        for row in iter_rows(start, end, options['batch_size']):
+            pks.append((row['pk'], False))
+            yield to_document(row).to_dict(include_meta=True)
+
+    kwargs = {
+        'chunk_size': options['chunk_size'],
+        'raise_on_error': False,
+        'raise_on_exception': False,
+        'request_timeout': get_timeout('bulk'),
+    }
+    client = get_client()
+    if options['threads'] > 1:
+        results = parallel_bulk(client, actions(), thread_count=options['threads'], **kwargs)
+    else:
+        results = streaming_bulk(client, actions(), max_retries=3, **kwargs)
+
+    reports = []
+
+    def report(done):
+        reports.append((key, done, indexed, failed, retried))
+        if progress is not None:
+            progress.put(reports[-1])
+
+    done = start
+    indexed = retried = 0
+    failed = []
+    remaining = len(retry)
+    # Results come back in the order of the actions, so the oldest pending key is the one this result is for.
+    for ok, item in results:
+        pk, is_retry = pks.popleft()
+        if is_retry:
+            retried += 1
+            remaining -= 1
+        else:
+            done = pk
+        if ok:
+            indexed += 1
+        else:
+            failed.append(pk)
+            logging.error("Error when migrating log entry %s to elasticsearch: %s", pk, item)
+        if indexed + len(failed) >= options['chunk_size']:
+            report(done)
+            indexed = retried = 0
+            failed = []
+    # Failed log entries that no longer exist are done as well.
+    retried += remaining
+    report(end)
+    return reports
+
+
+def _worker(key, start, end, options, progress, retry):
+    try:
+        migrate_range(key, start, end, options, progress, retry)
+    except Exception:
+        logging.exception("Error when migrating log entries %d to %d to elasticsearch", start, end)
+    finally:
+        # The last message of every worker, whether its range is done or not.
+        progress.put((key, None, 0, [], 0))
+
 
 class Command(BaseCommand):
+    help = "Copies the log entries of the database table of older versions to Elasticsearch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Number of log entries per database query.")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of log entries per bulk request.")
+        parser.add_argument('--threads', type=int, default=1,
+                            help="Number of concurrent bulk requests per worker.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of worker processes, each migrates its own range of primary keys.")
+        parser.add_argument('--checkpoint',
+                            help="File to record the progress in, an interrupted migration resumes from it. Defaults "
+                                 "to a file in the temp directory.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the progress of a previous run.")
+
     def handle(self, *args, **options):
-        LogEntry.init()
-        count = LogEntry_db.objects.count()
-        step = 10000
-        last = 0
-        for i in range(0, count, step):
-            entries = []
-            for entry_db in LogEntry_db.objects.all()[i:last+step]:
-                last += step
-                entry = LogEntry(
-                    meta={'id': entry_db.pk},
-                    action=['create', 'update', 'delete'][entry_db.action],
-                    content_type_id=entry_db.content_type.pk,
-                    content_type_app_label=entry_db.content_type.app_label,
-                    content_type_model=entry_db.content_type.model,
-                    object_id=entry_db.object_id,
-                    object_pk=entry_db.object_pk,
-                    object_repr=entry_db.object_repr,
-                    timestamp=entry_db.timestamp
-                )
-                if entry_db.actor:
-                    entry.actor_id = str(entry_db.actor.pk)
-                    entry.actor_email = entry_db.actor.email
-                    entry.actor_first_name = entry_db.actor.first_name
-                    entry.actor_last_name = entry_db.actor.last_name
-                if entry_db.remote_addr:
-                    entry.remote_addr = entry_db.remote_addr
-                if entry_db.changes:
-                    entry.changes = [
-                        Change(field=key, old=val[0], new=val[1]) for key, val in entry_db.changes.items()
-                    ]
-                entries.append(entry)
-
-            LogEntry.bulk(connections.get_connection(), entries)
-            print(f'Uploaded {i} logs')
\ No newline at end of file
+        path = options['checkpoint'] or os.path.join(tempfile.gettempdir(), 'auditlog-migrate-logs.json')
+        ranges = None if options['restart'] else self.load_checkpoint(path)
+        if ranges is None:
+            LogEntry.init()
+            ranges = self.split(options['workers'])
+        elif ranges:
+            self.stdout.write("Resuming from %s." % path)
+
+        self.path = path
+        self.ranges = {r['start']: r for r in ranges}
+        for r in ranges:
+            # The log entries that failed in a previous run are retried first, until then they stay in the checkpoint.
+            r['retry'] = sorted(r.get('retry', []) + r.get('failed', []))
+            r['failed'] = []
+        self.indexed = self.failed = 0
+        self.started = self.last_report = time.monotonic()
+        self.save_checkpoint()
+
+        pending = [r for r in ranges if r['done'] < r['end'] or r['retry']]
+        if len(pending) > 1:
+            self.run_workers(pending, options)
+        else:
+            for r in pending:
+                for report in migrate_range(r['start'], r['done'], r['end'], options, retry=r['retry']):
+                    self.update(*report)
+
+        self.report(final=True)
+        if self.failed:
+            raise CommandError("%d log entries could not be migrated, run the command again to retry them."
+                               % self.failed)
+        if all(r['done'] >= r['end'] and not r['retry'] and not r['failed'] for r in self.ranges.values()):
+            os.remove(path)
+        else:
+            raise CommandError("Not all log entries were migrated, run the command again to resume.")
+
+    def split(self, workers):
+        """
+        Split the primary keys of the table in ranges of about equal size, one per worker.
+        """
+        bounds = LogEntry_db.objects.aggregate(min=Min('pk'), max=Max('pk'))
+        if bounds['min'] is None:
+            return []
+        start, end = bounds['min'] - 1, bounds['max']
+        step = max(1, -(-(end - start) // max(1, workers)))
+        return [{'start': s, 'end': min(s + step, end), 'done': s} for s in range(start, end, step)]
+
+    def run_workers(self, pending, options):
+        context = multiprocessing.get_context('fork')
+        progress = context.Queue()
+        # Connections must not be shared with the worker processes.
+        db_connections.close_all()
+        processes = [
+            context.Process(target=_worker, args=(r['start'], r['done'], r['end'], options, progress, r['retry']),
+                            daemon=True)
+            for r in pending
+        ]
+        for process in processes:
+            process.start()
+
+        finished = 0
+        while finished < len(processes):
+            try:
+                key, done, indexed, failed, retried = progress.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if done is None:
+                finished += 1
+                continue
+            self.update(key, done, indexed, failed, retried)
+
+        for process in processes:
+            process.join()
+
+    def update(self, key, done, indexed, failed, retried):
+        r = self.ranges[key]
+        r['done'] = max(r['done'], done)
+        r['retry'] = r['retry'][retried:]
+        r['failed'] += failed
+        self.indexed += indexed
+        self.failed += len(failed)
+        self.save_checkpoint()
+        if time.monotonic() - self.last_report >= 10:
+            self.report()
+
+    def report(self, final=False):
+        self.last_report = time.monotonic()
+        elapsed = max(self.last_report - self.started, 0.001)
+        rate = self.indexed / elapsed
+        # An upper bound, primary keys may have gaps.
+        remaining = sum(r['end'] - r['done'] for r in self.ranges.values())
+        eta = ', about %d minutes left' % (remaining / rate / 60) if rate and not final else ''
+        self.stdout.write("%s %d log entries in %d seconds (%d per second, %d failed%s)." % (
+            'Migrated' if final else 'Migrating:', self.indexed, elapsed, rate, self.failed, eta))
+
+    def load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)['ranges']
+
+    def save_checkpoint(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'ranges': list(self.ranges.values())}, f)
+        os.replace(self.path + '.tmp', self.path)
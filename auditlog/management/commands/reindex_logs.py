@@ -0,0 +1,156 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from auditlog import lifecycle, reindex
+from auditlog.connection import get_client
+from auditlog.spool import get_config
+
+
+class Command(BaseCommand):
+    help = "Copies the log entries to a new index with the current mapping and swaps the alias to it, without " \
+           "downtime."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slices', default='auto', help="Number of slices of the reindex requests.")
+        parser.add_argument('--requests-per-second', type=float,
+                            help="Throttle the reindex requests to this many documents per second.")
+        parser.add_argument('--script',
+                            help="A painless script that transforms the log entries while copying. It must not drop "
+                                 "log entries, the copies are checked by counting them.")
+        parser.add_argument('--catch-up-margin', default='10m',
+                            help="Copy the log entries from this long before the previous copy started again, for "
+                                 "log entries that were indexed late, e.g. '10m'.")
+        parser.add_argument('--catch-up-passes', type=int, default=3,
+                            help="Maximum number of copies of the log entries written during the previous copy, "
+                                 "before the alias is swapped.")
+        parser.add_argument('--delete-old', action='store_true',
+                            help="Delete the old indices once the alias is swapped. Required when the alias is "
+                                 "still an index.")
+        parser.add_argument('--poll-interval', type=float, default=10.0,
+                            help="Seconds between progress reports of the reindex requests.")
+
+    def handle(self, *args, **options):
+        try:
+            self.margin = lifecycle.parse_duration(options['catch_up_margin'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        client = get_client()
+        try:
+            source = reindex.get_source(client)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        if source['concrete'] and not options['delete_old']:
+            raise CommandError("The index %s is replaced by an alias of the same name, run the command with "
+                               "--delete-old to delete it once it is copied." % source['alias'])
+        if source['concrete'] and not get_config()['ENABLED']:
+            raise CommandError("Writes to the index %s are blocked while it is replaced, enable the spool "
+                               "(AUDITLOG_SPOOL['ENABLED']) so the log entries written meanwhile are not lost."
+                               % source['alias'])
+
+        targets = reindex.get_targets(client, source)
+        # The number of log entries copied to every target and when the last copy started.
+        copied = {}
+        for target, indices in targets.items():
+            copied[target] = self.copy_all(client, indices, target, options)
+
+        if source['concrete']:
+            # The swap deletes the index, so the log entries written to it until then are copied while it is blocked.
+            # Log entries indexed late are copied before, so only the recent ones are copied while writes are blocked.
+            for target, indices in targets.items():
+                copied[target] = self.copy_missing(client, indices, target, *copied[target], options)
+            reindex.block_writes(client, source['indices'])
+            try:
+                for target, indices in targets.items():
+                    self.reconcile(client, indices, target, *copied[target], options, full=False)
+                reindex.swap(client, source, targets)
+            except BaseException:
+                reindex.unblock_writes(client, source['indices'])
+                raise
+        else:
+            reindex.swap(client, source, targets)
+            # Copy the log entries written to the old indices until the swap.
+            for target, indices in targets.items():
+                self.reconcile(client, indices, target, *copied[target], options)
+            if options['delete_old']:
+                reindex.delete_indices(client, source['indices'])
+        self.stdout.write("Swapped %s to %s." % (source['alias'], ', '.join(targets)))
+        if options['delete_old']:
+            self.stdout.write("Deleted %s." % ', '.join(source['indices']))
+
+    def copy_all(self, client, indices, target, options):
+        """
+        Create the target and copy the log entries of the indices to it, then catch up with the log entries written
+        meanwhile until the counts match.
+
+        :return: The number of log entries copied and when the last copy started.
+        :rtype: tuple
+        """
+        replicas = reindex.create_target(client, target, indices[0])
+        self.stdout.write("Created %s, copying the log entries of %s." % (target, ', '.join(indices)))
+        started = timezone.now()
+        self.copy(client, indices, target, options)
+        for i in range(options['catch_up_passes']):
+            if reindex.count(client, indices) <= reindex.count(client, [target]):
+                break
+            since, started = started - self.margin, timezone.now()
+            if not self.copy(client, indices, target, options, since=since, op_type='create')['created']:
+                # Indexed late with an older timestamp, left to reconcile.
+                break
+        reindex.finish_target(client, target, replicas)
+        # Only the copies write to the target until the alias is swapped.
+        return reindex.count(client, [target]), started
+
+    def copy_missing(self, client, indices, target, copied, started, options):
+        """
+        Copy all log entries of the indices that are not in the target yet, when the counts differ, e.g. for log
+        entries indexed late with an older timestamp.
+
+        :return: The number of log entries copied and when the last copy started.
+        :rtype: tuple
+        """
+        if reindex.count(client, indices) <= copied:
+            return copied, started
+        started = timezone.now()
+        copied += self.copy(client, indices, target, options, op_type='create')['created']
+        return copied, started
+
+    def reconcile(self, client, indices, target, copied, started, options, full=True):
+        """
+        Copy the log entries that are in the indices but not in the target yet, found by comparing the counts: first
+        the recent ones, then, for log entries indexed late with an older timestamp and unless ``full`` is false, all
+        of them.
+        """
+        for since in (started - self.margin, None) if full else (started - self.margin,):
+            missing = reindex.count(client, indices) - copied
+            if missing <= 0:
+                return
+            copied += self.copy(client, indices, target, options, since=since, op_type='create')['created']
+        missing = reindex.count(client, indices) - copied
+        if missing > 0:
+            raise CommandError("%d log entries of %s are missing from %s, the old indices are kept." % (
+                missing, ', '.join(indices), target))
+
+    def copy(self, client, indices, target, options, since=None, op_type='index'):
+        """
+        Run a reindex request and report its progress until it is done.
+        """
+        task_id = reindex.start_reindex(client, indices, target, since=since, op_type=op_type,
+                                        slices=options['slices'], requests_per_second=options['requests_per_second'],
+                                        script=options['script'])
+        what = 'log entries since %s' % since.isoformat() if since else 'log entries'
+        while True:
+            progress = reindex.get_progress(client, task_id)
+            if progress is None:
+                raise CommandError("The task %s was lost, delete %s and run the command again." % (task_id, target))
+            if progress['completed']:
+                if progress['failures']:
+                    raise CommandError("Copying failed for %d log entries, delete %s and run the command again."
+                                       % (len(progress['failures']), target))
+                self.stdout.write("Copied %d %s, %d new." % (progress['total'], what, progress['created']))
+                return progress
+            self.stdout.write("Copying %s: %d of %d." % (what, progress['created'] + progress['updated'],
+                                                         progress['total']))
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand, CommandError
+
+from auditlog.spool import get_spool, get_config
+
+
+class Command(BaseCommand):
+    help = "Indexes the log entries that were spooled to disk while Elasticsearch was unavailable."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=get_config()['REPLAY_BATCH_SIZE'],
+                            help="Number of log entries per bulk request.")
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError("The spool is disabled, set AUDITLOG_SPOOL['ENABLED'] to use it.")
+
+        indexed, complete = spool.replay(batch_size=options['batch_size'])
+        self.stdout.write("Indexed %d log entries." % indexed)
+        if not complete:
+            raise CommandError("Not all spooled log entries could be indexed, try again later.")
@@ -0,0 +1,54 @@
+from django.core.management import BaseCommand, CommandError
+
+from auditlog import lifecycle
+from auditlog.connection import get_client
+
+
+class Command(BaseCommand):
+    help = "Rolls the audit log over to a new index when the current one is too large or too old."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setup', action='store_true',
+                            help="Install the index template and create the first index and the aliases, or the data "
+                                 "stream, before rolling over.")
+        parser.add_argument('--max-size', help="Roll over when the index is larger than this, e.g. '50gb'.")
+        parser.add_argument('--max-docs', type=int, help="Roll over when the index holds more log entries than this.")
+        parser.add_argument('--max-age', help="Roll over when the index is older than this, e.g. '7d'.")
+        parser.add_argument('--delete-older-than',
+                            help="Afterwards delete the indices that only hold log entries older than this, e.g. "
+                                 "'90d'.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report whether a condition is met and which indices would be deleted.")
+
+    def handle(self, *args, **options):
+        if not lifecycle.get_config()['ENABLED']:
+            raise CommandError("The index lifecycle is disabled, set AUDITLOG_LIFECYCLE['ENABLED'] to use it.")
+
+        client = get_client()
+        if options['setup']:
+            for created in lifecycle.setup(client):
+                self.stdout.write("Installed %s." % created)
+
+        response = lifecycle.rollover(client, dry_run=options['dry_run'], max_size=options['max_size'],
+                                      max_docs=options['max_docs'], max_age=options['max_age'])
+        met = [condition for condition, result in response.get('conditions', {}).items() if result]
+        if response.get('rolled_over'):
+            self.stdout.write("Rolled over from %s to %s (%s)." % (response['old_index'], response['new_index'],
+                                                                  ', '.join(met)))
+        elif options['dry_run'] and met:
+            self.stdout.write("Would roll over from %s to %s (%s)." % (response['old_index'], response['new_index'],
+                                                                      ', '.join(met)))
+        else:
+            self.stdout.write("No rollover needed for %s." % response['old_index'])
+
+        if options['delete_older_than']:
+            try:
+                older_than = lifecycle.parse_duration(options['delete_older_than'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            expired = lifecycle.get_expired_generations(client, older_than)
+            if not options['dry_run']:
+                lifecycle.delete_generations(client, expired)
+            for generation in expired:
+                self.stdout.write("%s %s (%d log entries)." % ('Would delete' if options['dry_run'] else 'Deleted',
+                                                              generation['index'], generation['docs']))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from auditlog import lifecycle, retention
+from auditlog.connection import get_client
+
+
+class Command(BaseCommand):
+    help = "Adds new fields of the log entry mapping to the existing indices and fills them for existing log entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slices', default='auto', help="Number of slices of the update request.")
+        parser.add_argument('--poll-interval', type=float, default=10.0,
+                            help="Seconds between progress reports of the update request.")
+        parser.add_argument('--no-wait', action='store_true',
+                            help="Start the update request and exit instead of reporting its progress.")
+
+    def handle(self, *args, **options):
+        client = get_client()
+        task_id = lifecycle.update_mapping(client, slices=options['slices'])
+        self.stdout.write("Updated the mapping, started updating the log entries (task %s)." % task_id)
+
+        while not options['no_wait']:
+            progress = retention.get_progress(client, task_id)
+            if progress is None:
+                raise CommandError("The task %s was lost, run the command again." % task_id)
+            if progress['completed']:
+                self.stdout.write("Updated %d log entries%s." % (
+                    progress['updated'],
+                    ' with %d failures' % len(progress['failures']) if progress['failures'] else ''))
+                return
+            self.stdout.write("Updating log entries: %d of %d." % (progress['updated'], progress['total']))
+            time.sleep(options['poll_interval'])
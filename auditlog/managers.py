@@ -0,0 +1,128 @@
+from django.db import models, transaction
+from django.db.models import DEFERRED
+
+from auditlog.buffer import enqueue
+from auditlog.diff import get_tracked_fields, model_instances_diff
+from auditlog.documents import LogEntry
+from auditlog.registry import auditlog
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class AuditlogQuerySetMixin(object):
+    """
+    QuerySet mixin that logs the changes made by ``bulk_create``, ``bulk_update`` and ``update``, which do not send the
+    model signals Auditlog relies on. Changes are computed per chunk of ``audit_chunk_size`` objects with a single query
+    for the old values of the tracked fields, and all entries of one operation are indexed with a single bulk request.
+    ``update`` reads the primary keys of the matching rows first and then updates them chunk by chunk.
+
+    ``delete`` needs no special handling, Django sends ``post_delete`` for every deleted instance of a registered model.
+    """
+
+    audit_chunk_size = 1000
+    _audit = True
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._audit = self._audit
+        return clone
+
+    def _is_audited(self):
+        return self._audit and auditlog.contains(self.model)
+
+    def _unaudited(self):
+        clone = self._chain()
+        clone._audit = False
+        return clone
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not self._is_audited():
+            return super().bulk_create(objs, *args, **kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            # Not every database backend returns the primary keys of created objects.
+            created = [obj for obj in objs if obj.pk is not None]
+            for obj, changes in zip(created, model_instances_diff((None, obj) for obj in created)):
+                self._log(obj, LogEntry.Action.CREATE, changes)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self._is_audited():
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        objs = list(objs)
+        field_names = {self.model._meta.get_field(name).name for name in fields}
+        with transaction.atomic(using=self.db, savepoint=False):
+            old = {}
+            for pks in _chunks([obj.pk for obj in objs], self.audit_chunk_size):
+                queryset = self.model._base_manager.using(self.db).filter(pk__in=pks).only(*field_names)
+                old.update((obj.pk, obj) for obj in queryset)
+            # bulk_update() is implemented with update(), which must not log the changes a second time.
+            result = super(AuditlogQuerySetMixin, self._unaudited()).bulk_update(objs, fields, *args, **kwargs)
+            self._log_updates([(old[obj.pk], obj) for obj in objs if obj.pk in old], field_names)
+        return result
+
+    def update(self, **kwargs):
+        if not self._is_audited():
+            return super().update(**kwargs)
+
+        opts = self.model._meta
+        fields = {name: opts.get_field(name) for name in kwargs}
+        field_names = {field.name for field in fields.values()}
+        # The tracked fields, for the object representation of the log entries.
+        only = field_names | {field.name for field in get_tracked_fields(self.model)}
+        computed = any(hasattr(value, 'resolve_expression') for value in kwargs.values())
+        base = self.model._base_manager.using(self.db)
+        result = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            for chunk in _chunks(pks, self.audit_chunk_size):
+                old = {obj.pk: obj for obj in base.filter(pk__in=chunk).only(*only)}
+                result += base.filter(pk__in=chunk).update(**kwargs)
+                if computed:
+                    # The new values are computed by the database, fetch them.
+                    new = {obj.pk: obj for obj in base.filter(pk__in=chunk).only(*only)}
+                else:
+                    new = {pk: self._apply(obj, fields, kwargs) for pk, obj in old.items()}
+                self._log_updates([(obj, new[pk]) for pk, obj in old.items() if pk in new], field_names)
+        return result
+
+    def _apply(self, obj, fields, values):
+        """
+        Returns a copy of ``obj`` with the given values assigned, without querying the database.
+        """
+        data = dict(obj.__dict__)
+        for name, field in fields.items():
+            value = values[name]
+            if field.is_relation and isinstance(value, models.Model):
+                value = getattr(value, field.target_field.attname)
+            data[field.attname] = value
+        field_names = [field.attname for field in self.model._meta.concrete_fields]
+        return self.model.from_db(self.db, field_names, [data.get(name, DEFERRED) for name in field_names])
+
+    def _log_updates(self, pairs, field_names):
+        for (old, new), changes in zip(pairs, model_instances_diff(pairs, field_names=field_names)):
+            if changes:
+                self._log(new, LogEntry.Action.UPDATE, changes)
+
+    def _log(self, instance, action, changes):
+        log_entry = LogEntry.log_create(instance, action=action, changes=changes)
+        if log_entry is not None:
+            enqueue(log_entry, using=self.db)
+
+
+class AuditlogQuerySet(AuditlogQuerySetMixin, models.QuerySet):
+    """
+    QuerySet that logs the changes made by bulk operations, see :py:class:`AuditlogQuerySetMixin`.
+    """
+
+
+class AuditlogManager(models.Manager.from_queryset(AuditlogQuerySet)):
+    """
+    Manager for registered models that logs the changes made by bulk operations, see
+    :py:class:`AuditlogQuerySetMixin`.
+    """
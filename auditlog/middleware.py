@@ -1,79 +1,55 @@
-import threading
-import time
-from functools import partial
+import asyncio
 
-from django.apps import apps
-from django.conf import settings
-from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 
-from auditlog.documents import LogEntry, log_created
+from auditlog.context import set_actor
 
-threadlocal = threading.local()
 
-
-class AuditlogMiddleware(MiddlewareMixin):
+class AuditlogMiddleware(object):
     """
-    Middleware to couple the request's user to log items. This is accomplished by currying the signal receiver with the
-    user from the request (or None if the user is not authenticated).
+    Middleware to couple the request's user to log items. This is accomplished by setting the audit context (see
+    :py:func:`auditlog.context.set_actor`) for the duration of the request, which every log entry created while handling
+    the request reads its actor and remote address from.
+
+    The middleware supports both sync and async requests. For async requests it also starts the asyncio shipper, when
+    it is enabled (see :py:func:`auditlog.aio.start_async_shipper`).
     """
 
-    def process_request(self, request):
-        """
-        Gets the current user from the request and prepares and connects a signal receiver with the user already
-        attached to it.
-        """
-        # Initialize thread local storage
-        threadlocal.auditlog = {
-            'signal_duid': (self.__class__, time.time()),
-            'remote_addr': request.META.get('REMOTE_ADDR'),
-        }
+    sync_capable = True
+    async_capable = True
 
-        # In case of proxy, set 'original' address
-        if request.META.get('HTTP_X_FORWARDED_FOR'):
-            threadlocal.auditlog['remote_addr'] = request.META.get('HTTP_X_FORWARDED_FOR').split(',')[0]
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the middleware as a coroutine function, like Django's MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
 
-        # Connect signal for automatic logging
-        set_actor = partial(self.set_actor, request=request, signal_duid=threadlocal.auditlog['signal_duid'])
-        log_created.connect(set_actor, sender=LogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'], weak=False)
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with set_actor(self.get_actor(request), remote_addr=self.get_remote_addr(request)):
+            return self.get_response(request)
 
-    def process_response(self, request, response):
-        """
-        Disconnects the signal receiver to prevent it from staying active.
-        """
-        if hasattr(threadlocal, 'auditlog'):
-            log_created.disconnect(sender=LogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'])
+    async def __acall__(self, request):
+        from auditlog.aio import start_async_shipper
 
-        return response
+        start_async_shipper()
+        with set_actor(self.get_actor(request), remote_addr=self.get_remote_addr(request)):
+            return await self.get_response(request)
 
-    def process_exception(self, request, exception):
+    @staticmethod
+    def get_actor(request):
         """
-        Disconnects the signal receiver to prevent it from staying active in case of an exception.
+        Returns the user of the request. The user is looked up lazily, when the first log entry is created, so requests
+        that do not change anything do not load it.
         """
-        if hasattr(threadlocal, 'auditlog'):
-            log_created.disconnect(sender=LogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'])
-
-        return None
+        return SimpleLazyObject(lambda: getattr(request, 'user', None))
 
     @staticmethod
-    def set_actor(request, sender, instance, signal_duid, **kwargs):
+    def get_remote_addr(request):
         """
-        Signal receiver with an extra, required 'request' kwarg. This method becomes a real (valid) signal receiver when
-        it is curried with the actor.
+        Returns the remote address of the request, or the original address in case of a proxy.
         """
-        if hasattr(request, 'user') and getattr(request.user, 'is_authenticated', False):
-            user = request.user
-            if hasattr(threadlocal, 'auditlog'):
-                if signal_duid != threadlocal.auditlog['signal_duid']:
-                    return
-                try:
-                    app_label, model_name = settings.AUTH_USER_MODEL.split('.')
-                    auth_user_model = apps.get_model(app_label, model_name)
-                except ValueError:
-                    auth_user_model = apps.get_model('auth', 'user')
-                if sender == LogEntry and isinstance(user, auth_user_model) and instance.actor_id is None:
-                    instance.actor_id = user._meta.pk.get_prep_value(user.pk)
-                    instance.actor_email = user.email
-                    instance.actor_first_name = user.first_name
-                    instance.actor_last_name = user.last_name
-
-                instance.remote_addr = threadlocal.auditlog['remote_addr']
+        if request.META.get('HTTP_X_FORWARDED_FOR'):
+            return request.META.get('HTTP_X_FORWARDED_FOR').split(',')[0]
+        return request.META.get('REMOTE_ADDR')
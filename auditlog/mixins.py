@@ -1,14 +1,16 @@
 from django import urls as urlresolvers
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
 from django.shortcuts import render
 from django.urls import path, reverse
 from django.urls.exceptions import NoReverseMatch
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from elasticsearch_dsl import Q
 
 from auditlog.documents import LogEntry
+from auditlog.utils.admin import AFTER_VAR, BEFORE_VAR, CursorPaginator, decode_cursor
 
 
 class LogEntryAdminMixin(object):
@@ -55,6 +57,9 @@ class LogEntryAdminMixin(object):
 
 
 class AuditlogAdminHistoryMixin(LogEntryAdminMixin):
+    # Log entries per page of the history, which is paged through newest first.
+    history_list_per_page = 100
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.list_display = list(self.list_display) + ['history']
@@ -64,22 +69,28 @@ class AuditlogAdminHistoryMixin(LogEntryAdminMixin):
         urls = super().get_urls()
         info = self.model._meta.app_label, self.model._meta.model_name
         new_urls = [
-            path('<object_id>/auditlog-history/', self.auditlog_history, name='%s_%s_auditlog-history' % info)
+            path('<object_id>/auditlog-history/', self.admin_site.admin_view(self.auditlog_history),
+                 name='%s_%s_auditlog-history' % info)
         ]
         return new_urls + urls
 
     def auditlog_history(self, request, *args, **kwargs):
-        pk = self.model._meta.pk.to_python(kwargs['object_id'])
-        id_ = self.model._meta.pk.get_prep_value(kwargs['object_id'])
-        instance = self.model.objects.get(pk=pk)
-        content_type = ContentType.objects.get_for_model(instance)
-        s = LogEntry.search().query(
-            Q('bool', must=[Q('bool', should=[Q('match', object_pk=str(instance.pk)),
-                                              Q('match', object_id=id_)]),
-                            Q('match', content_type_id=content_type.pk)])
-        ).sort('timestamp')
-
-        for entry in s:
+        instance = self.get_object(request, kwargs['object_id'])
+        if instance is None:
+            raise Http404()
+        if not self.has_view_or_change_permission(request, instance):
+            raise PermissionDenied
+
+        paginator = CursorPaginator(LogEntry.objects.for_object(instance).search, self.history_list_per_page)
+        try:
+            after = decode_cursor(request.GET[AFTER_VAR]) if request.GET.get(AFTER_VAR) else None
+            before = decode_cursor(request.GET[BEFORE_VAR]) if request.GET.get(BEFORE_VAR) else None
+        except IncorrectLookupParameters:
+            after = before = None
+        page = paginator.page(after=after, before=before)
+        entries = page.object_list
+
+        for entry in entries:
             entry.user_link = self.user(entry)
             link = reverse('admin:auditlog_logmodel_change', kwargs={'object_id': entry.meta.id})
             entry.log_link = format_html(u'<a href="{}">Log entry</a>', link)
@@ -87,7 +98,9 @@ class AuditlogAdminHistoryMixin(LogEntryAdminMixin):
         context = {
             'title': f'Change history: {instance}',
             'opts': self.model._meta,
-            'log_entry_list': s
+            'log_entry_list': entries,
+            'previous_url': '?%s=%s' % (BEFORE_VAR, page.previous_cursor) if page.has_previous else None,
+            'next_url': '?%s=%s' % (AFTER_VAR, page.next_cursor) if page.has_next else None,
         }
         return render(request, 'admin/auditlog_history.html', context)
 
@@ -346,3 +346,27 @@ try:
     raise DeprecationWarning("South support will be dropped in django-auditlog 0.4.0 or later.")
 except ImportError:
     pass
+
+
+class AuditlogSnapshotMixin(models.Model):
+    """
+    Keeps the snapshot of a model registered with ``snapshot=True`` (see :py:func:`auditlog.registry.register`) up to
+    date when an instance is reloaded with :py:meth:`~django.db.models.Model.refresh_from_db`, which is also how
+    deferred fields are loaded. Without it the snapshot would hold the values from before the reload.
+    """
+
+    class Meta:
+        abstract = True
+
+    def refresh_from_db(self, using=None, fields=None):
+        from auditlog.receivers import take_snapshot
+
+        super().refresh_from_db(using=using, fields=fields)
+        snapshot = getattr(self, '_auditlog_snapshot', None)
+        if snapshot is None:
+            return
+        if fields is None or snapshot[0] == self.pk:
+            take_snapshot(self.__class__, self, update_fields=fields)
+        else:
+            # The rest of the snapshot belongs to another object, fetch the old instance from the database instead.
+            del self._auditlog_snapshot
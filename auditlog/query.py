@@ -0,0 +1,342 @@
+import datetime
+
+from django.db import models
+from django.db.models import QuerySet
+from elasticsearch_dsl import Q
+
+ITERATOR_CHUNK_SIZE = 1000
+# Primary keys per terms query, well below the index.max_terms_count limit of Elasticsearch.
+TERMS_CHUNK_SIZE = 10000
+# Terms queries per search of for_objects, beyond that every chunk is searched on its own, see iter_for_objects.
+MAX_TERMS_CHUNKS = 10
+# Searches per _msearch request.
+MSEARCH_BATCH_SIZE = 200
+
+
+def _change_value_query(name, value):
+    from auditlog.documents import CHANGE_KEYWORD_LENGTH
+
+    if len(value) > CHANGE_KEYWORD_LENGTH:
+        # Not in the keyword subfield, see auditlog.documents.Change.
+        return Q('match_phrase', **{'changes.%s' % name: value.rstrip('*')})
+    if value.endswith('*') and not value.endswith('\\*'):
+        return Q('prefix', **{'changes.%s.keyword' % name: {'value': value[:-1], 'case_insensitive': True}})
+    return Q('term', **{'changes.%s.keyword' % name: {'value': value.replace('\\*', '*'), 'case_insensitive': True}})
+
+
+def changes_query(field=None, old=None, new=None):
+    """
+    Returns a query for the log entries with a change that matches all of the given conditions, as a single nested
+    query in filter context. Values are matched exactly, ignoring case, through the keyword subfields of the values;
+    a value ending in ``*`` is matched as a prefix (``\\*`` matches a literal ``*``).
+
+    :param field: The name of the changed field.
+    :type field: str
+    :param old: The value before the change.
+    :type old: str
+    :param new: The value after the change.
+    :type new: str
+    :rtype: Q
+    """
+    filters = []
+    if field:
+        filters.append(Q('term', changes__field=field))
+    if old:
+        filters.append(_change_value_query('old', old))
+    if new:
+        filters.append(_change_value_query('new', new))
+    return Q('nested', path='changes', query=Q('bool', filter=filters))
+
+
+class LogEntryQuerySet(object):
+    """
+    A lazy, chainable search for log entries in the style of a Django queryset, available as
+    ``LogEntry.objects``::
+
+        LogEntry.objects.for_object(obj).by_actor(user).since(timestamp).actions('update')
+
+    Every method returns a new queryset; Elasticsearch is only queried when the queryset is iterated, sliced with an
+    integer index, counted or executed. All conditions are added in filter context, so they are not scored and
+    Elasticsearch can cache them.
+    """
+
+    def __init__(self, document, search=None):
+        self.document = document
+        self._search = search
+        self._result_cache = None
+
+    @property
+    def search(self):
+        """
+        The :py:class:`~elasticsearch_dsl.Search` the queryset compiles to.
+        """
+        if self._search is None:
+            self._search = self.document.search()
+        return self._search
+
+    def _clone(self, search):
+        return self.__class__(self.document, search)
+
+    def all(self):
+        return self._clone(self.search)
+
+    def filter(self, *args, **kwargs):
+        """
+        Add a condition in filter context, with the arguments of :py:meth:`elasticsearch_dsl.Search.filter`.
+        """
+        return self._clone(self.search.filter(*args, **kwargs))
+
+    def exclude(self, *args, **kwargs):
+        """
+        Exclude the log entries matching a condition, with the arguments of :py:meth:`elasticsearch_dsl.Search.exclude`.
+        """
+        return self._clone(self.search.exclude(*args, **kwargs))
+
+    def for_model(self, model):
+        """
+        The log entries of a model, or of the model of an instance. Log entries refer to the content type of the
+        concrete model, see :py:meth:`ContentType.objects.get_for_model`.
+        """
+        opts = model._meta.concrete_model._meta
+        return self.filter('term', content_type_app_label=opts.app_label) \
+            .filter('term', content_type_model=opts.model_name)
+
+    def for_object(self, instance):
+        """
+        The log entries of a model instance. Does not query the database, so it can be used from async code as well.
+        """
+        pk = self.document._get_pk_value(instance)
+        id_ = instance._meta.pk.get_prep_value(pk)
+        object_query = Q('term', object_pk=str(pk))
+        if isinstance(id_, int):
+            object_query |= Q('term', object_id=id_)
+        return self.for_model(instance).filter(object_query)
+
+    def for_objects(self, objects, chunk_size=TERMS_CHUNK_SIZE, max_chunks=MAX_TERMS_CHUNKS):
+        """
+        The log entries of several instances of a model. ``objects`` is a queryset or a list of instances; a queryset
+        is read once, only its primary keys, in chunks. The primary keys are matched with one terms query per chunk,
+        in a single search of at most ``max_chunks`` chunks; use :py:meth:`iter_for_objects` for more instances.
+
+        :param objects: The instances to get the log entries for.
+        :type objects: QuerySet or list
+        :raises ValueError: When there are more than ``max_chunks * chunk_size`` instances.
+        """
+        model = None
+        should = []
+        for model, pks in self._iter_pk_chunks(objects, chunk_size):
+            if len(should) >= max_chunks:
+                raise ValueError("More than %d objects to search the log entries of at once, use iter_for_objects()."
+                                 % (max_chunks * chunk_size))
+            should.append(Q('terms', object_pk=pks))
+        if model is None:
+            return self.filter('match_none')
+        return self.for_model(model).filter('bool', should=should, minimum_should_match=1)
+
+    def iter_for_objects(self, objects, chunk_size=TERMS_CHUNK_SIZE):
+        """
+        Yield the log entries of any number of instances of a model, with one search per chunk of ``chunk_size``
+        instances (see :py:meth:`for_objects`) that is paged through with :py:meth:`iterator`. The log entries are in
+        the order of the queryset per chunk, not overall.
+
+        :param objects: The instances, a queryset or a list.
+        :type objects: QuerySet or list
+        :rtype: generator
+        """
+        for model, pks in self._iter_pk_chunks(objects, chunk_size):
+            yield from self.for_model(model).filter('terms', object_pk=pks).iterator()
+
+    def latest_for_objects(self, objects, n=1, batch_size=MSEARCH_BATCH_SIZE):
+        """
+        Returns the latest ``n`` log entries of each of several instances of a model, with the conditions of this
+        queryset. The searches for the instances are sent together in ``_msearch`` requests of ``batch_size``
+        searches.
+
+        :param objects: The instances, a queryset or a list.
+        :type objects: QuerySet or list
+        :return: The log entries, newest first, by the primary key of the instances (as a string).
+        :rtype: dict
+        """
+        latest = {}
+        batch = []
+
+        def run(batch):
+            responses = self.document.msearch([search for pk, search in batch])
+            for (pk, search), response in zip(batch, responses):
+                latest[pk] = list(response)
+
+        for model, pks in self._iter_pk_chunks(objects, batch_size):
+            base = self.for_model(model).order_by('-timestamp').search[:n]
+            for pk in pks:
+                batch.append((pk, base.filter('term', object_pk=pk)))
+            if len(batch) >= batch_size:
+                run(batch)
+                batch = []
+        if batch:
+            run(batch)
+        return latest
+
+    # The names of the legacy LogEntryManager, see auditlog.models.
+    get_for_object = for_object
+    get_for_objects = for_objects
+    get_for_model = for_model
+
+    def by_actor(self, actor):
+        """
+        The log entries of an actor, a user instance or its primary key.
+        """
+        if isinstance(actor, models.Model):
+            actor = actor.pk
+        return self.filter('term', actor_id=str(actor))
+
+    def actions(self, *actions):
+        """
+        The log entries of any of the actions, see :py:class:`LogEntry.Action`.
+        """
+        return self.filter('terms', action=list(actions))
+
+    def changed(self, field, old=None, new=None):
+        """
+        The log entries that changed a field, optionally from or to a value, see :py:func:`changes_query`.
+        """
+        return self.filter(changes_query(field, old=old, new=new))
+
+    def since(self, timestamp):
+        """
+        The log entries from a point in time on.
+
+        :type timestamp: datetime
+        """
+        return self.filter('range', timestamp={'gte': self._format(timestamp)})
+
+    def until(self, timestamp):
+        """
+        The log entries before a point in time.
+
+        :type timestamp: datetime
+        """
+        return self.filter('range', timestamp={'lt': self._format(timestamp)})
+
+    def order_by(self, *keys):
+        """
+        Sort the log entries, e.g. by ``'timestamp'`` or ``'-timestamp'``.
+        """
+        return self._clone(self.search.sort(*keys))
+
+    def search_after(self, *values):
+        """
+        Start after a position in the sort order of the queryset, the ``meta.sort`` of a log entry sorted the same way
+        (with the id as last key, see :py:meth:`iterator`).
+        """
+        return self._clone(self.search.extra(search_after=list(values)))
+
+    def count(self):
+        """
+        Returns the number of matching log entries, counted with the count API.
+
+        :rtype: int
+        """
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return self.search.count()
+
+    def exists(self):
+        """
+        Returns whether any log entry matches, without counting all of them.
+
+        :rtype: bool
+        """
+        response = self.search.extra(size=0, terminate_after=1, track_total_hits=1).execute()
+        return response.hits.total.value > 0
+
+    def first(self):
+        """
+        Returns the first log entry, or ``None``.
+        """
+        hits = list(self[:1])
+        return hits[0] if hits else None
+
+    def execute(self):
+        """
+        Run the search as it is, returning its :py:class:`~elasticsearch_dsl.response.Response`.
+        """
+        return self.search.execute()
+
+    def iterator(self, chunk_size=ITERATOR_CHUNK_SIZE):
+        """
+        Yield all matching log entries in the order of the queryset, paging through them with ``search_after``, so
+        there is no limit on how many there are. The results are not cached.
+        """
+        search = self.search
+        sort = list(search.to_dict().get('sort', [{'timestamp': 'desc'}]))
+        # The id breaks ties, so no log entry is skipped or repeated between pages.
+        search = search.sort(*(sort + [{'_id': 'asc'}]))[:chunk_size]
+        while True:
+            response = search.execute()
+            hits = list(response)
+            yield from hits
+            if len(hits) < chunk_size:
+                return
+            search = search.extra(search_after=list(hits[-1].meta.sort))
+
+    def __iter__(self):
+        if self._result_cache is None:
+            # A sliced queryset is a single search; otherwise all log entries are fetched.
+            if 'size' in self.search.to_dict():
+                self._result_cache = list(self.search.execute())
+            else:
+                self._result_cache = list(self.iterator())
+        return iter(self._result_cache)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __bool__(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return self.exists()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._clone(self.search[key])
+        hits = list(self.search[key:key + 1].execute())
+        if not hits:
+            raise IndexError("Log entry index out of range")
+        return hits[0]
+
+    def _iter_pk_chunks(self, objects, chunk_size):
+        """
+        Yield the model and chunks of the primary keys, as strings, of a queryset or list of instances.
+        """
+        if isinstance(objects, QuerySet):
+            model = objects.model
+            pks = objects.values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+        else:
+            objects = list(objects)
+            if not objects:
+                return
+            model = type(objects[0])
+            pks = (self.document._get_pk_value(instance) for instance in objects)
+        chunk = []
+        for pk in pks:
+            chunk.append(str(pk))
+            if len(chunk) >= chunk_size:
+                yield model, chunk
+                chunk = []
+        if chunk:
+            yield model, chunk
+
+    @staticmethod
+    def _format(timestamp):
+        if isinstance(timestamp, (datetime.date, datetime.datetime)):
+            return timestamp.isoformat()
+        return timestamp
+
+
+class LogEntryManager(object):
+    """
+    Gives every access to ``LogEntry.objects`` a new :py:class:`LogEntryQuerySet`.
+    """
+
+    def __get__(self, instance, owner):
+        return LogEntryQuerySet(owner)
@@ -1,8 +1,9 @@
-import json
+import copy
 
-from django.db import transaction
+from django.db.models import DEFERRED
 
-from auditlog.diff import model_instance_diff
+from auditlog.buffer import enqueue
+from auditlog.diff import EXACT_TYPES, model_instance_diff, get_tracked_fields
 from auditlog.documents import LogEntry
 
 
@@ -19,7 +20,7 @@ def log_create(sender, instance, created, **kwargs):
             action=LogEntry.Action.CREATE,
             changes=changes,
         )
-        transaction.on_commit(lambda: log_entry.save())
+        enqueue(log_entry, using=kwargs.get('using'))
         return log_entry
 
 
@@ -30,11 +31,8 @@ def log_update(sender, instance, **kwargs):
     Direct use is discouraged, connect your model through :py:func:`auditlog.registry.register` instead.
     """
     if instance.pk is not None:
-        try:
-            old = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
+        old = get_old_instance(sender, instance, using=kwargs.get('using'))
+        if old is not None:
             new = instance
 
             changes = model_instance_diff(old, new)
@@ -46,7 +44,7 @@ def log_update(sender, instance, **kwargs):
                     action=LogEntry.Action.UPDATE,
                     changes=changes,
                 )
-                transaction.on_commit(lambda: log_entry.save())
+                enqueue(log_entry, using=kwargs.get('using'))
                 return log_entry
 
 
@@ -63,5 +61,64 @@ def log_delete(sender, instance, **kwargs):
             action=LogEntry.Action.DELETE,
             changes=changes,
         )
-        transaction.on_commit(lambda: log_entry.save())
+        enqueue(log_entry, using=kwargs.get('using'))
         return log_entry
+
+
+def take_snapshot(sender, instance, update_fields=None, **kwargs):
+    """
+    Signal receiver that records the values of the tracked fields of a model instance when it is loaded from or saved to
+    the database, so :py:func:`log_update` can compute the changes without fetching the old instance.
+
+    Connected for models registered with ``snapshot=True``, see :py:func:`auditlog.registry.register`. Reloaded
+    instances are recorded again by :py:class:`auditlog.models.AuditlogSnapshotMixin`.
+    """
+    fields = get_tracked_fields(sender)
+    snapshot = getattr(instance, '_auditlog_snapshot', None)
+    if update_fields is not None and snapshot is not None:
+        values = tuple(
+            _snapshot_value(instance, field) if field.name in update_fields or field.attname in update_fields else value
+            for field, value in zip(fields, snapshot[1])
+        )
+    else:
+        values = tuple(_snapshot_value(instance, field) for field in fields)
+    instance._auditlog_snapshot = (instance.pk, values)
+
+
+def _snapshot_value(instance, field):
+    value = instance.__dict__.get(field.attname, DEFERRED)
+    if value is DEFERRED or type(value) in EXACT_TYPES:
+        return value
+    # Copy mutable values, e.g. the dict of a JSONField or the list of an ArrayField, which may be changed in place.
+    return copy.deepcopy(value)
+
+
+def get_old_instance(sender, instance, using=None):
+    """
+    Returns the model instance as it is currently stored in the database. When a snapshot was taken by
+    :py:func:`take_snapshot` the instance is rebuilt from the snapshot, otherwise only the tracked fields are fetched
+    from the database the instance is saved to.
+
+    :param sender: The model class.
+    :param instance: The model instance that is about to be saved.
+    :param using: The database alias the instance is saved to.
+    :return: The old model instance, or ``None`` if it does not exist.
+    :rtype: Model
+    """
+    db = using or instance._state.db
+    fields = get_tracked_fields(sender)
+    snapshot = getattr(instance, '_auditlog_snapshot', None)
+
+    if snapshot is not None and snapshot[0] == instance.pk and not instance._state.adding:
+        values = dict(zip((field.attname for field in fields), snapshot[1]))
+        values[sender._meta.pk.attname] = instance.pk
+        field_names = [field.attname for field in sender._meta.concrete_fields]
+        return sender.from_db(db, field_names, [values.get(name, DEFERRED) for name in field_names])
+
+    queryset = sender._base_manager.using(db)
+    if fields:
+        queryset = queryset.only(*(field.name for field in fields))
+    try:
+        return queryset.get(pk=instance.pk)
+    except sender.DoesNotExist:
+        return None
@@ -0,0 +1,184 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import Boolean, Date, Document, Integer, Keyword, Long, Object
+
+from auditlog.connection import get_client, get_timeout
+
+# Log entries replayed between two checkpoints of an object.
+CHECKPOINT_INTERVAL = 1000
+WORKERS = 4
+
+_initialized = set()
+
+
+class Checkpoint(Document):
+    """
+    The state of an object after a number of its log entries were replayed, so a later reconstruction only has to
+    replay the log entries after it. The state is stored as it is, without indexing it.
+    """
+    content_type_app_label = Keyword(required=True)
+    content_type_model = Keyword(required=True)
+    object_pk = Keyword(required=True)
+    # The timestamp of the last log entry replayed, and its position in the sort order of the replay.
+    timestamp = Date(required=True)
+    sort_timestamp = Long(index=False)
+    entry_id = Keyword(index=False)
+    entries = Integer()
+    # Whether the object existed, i.e. was not deleted, after the log entry.
+    exists = Boolean()
+    state = Object(enabled=False)
+
+    class Index:
+        # Not '<name>-checkpoints', which would match the index template of the log entries, see auditlog.lifecycle.
+        name = settings.AUDITLOG_INDEX_NAME + '_checkpoints'
+
+    @classmethod
+    def _get_using(cls, using=None):
+        return using or get_client()
+
+
+def search_checkpoints(model, pk=None, using=None):
+    """
+    Returns a search for the checkpoints of an object, or of all objects of a model. Searching before any checkpoint
+    was saved finds nothing.
+    """
+    opts = model._meta.concrete_model._meta
+    search = Checkpoint.search(using=using).params(request_timeout=get_timeout('search'), ignore_unavailable=True) \
+        .filter('term', content_type_app_label=opts.app_label) \
+        .filter('term', content_type_model=opts.model_name)
+    if pk is not None:
+        search = search.filter('term', object_pk=str(pk))
+    return search
+
+
+def get_checkpoint(model, pk, at):
+    """
+    Returns the latest checkpoint of an object at a point in time, or ``None``.
+    """
+    search = search_checkpoints(model, pk).filter('range', timestamp={'lte': at.isoformat()})
+    hits = search.sort('-timestamp', '-entries')[:1].execute()
+    return hits[0] if hits else None
+
+
+def apply(state, entry):
+    """
+    Returns the state of an object after a log entry: the new values of its changes applied to the state before it.
+    An object does not exist, its state is ``None``, before it was created and after it was deleted.
+
+    :param state: The field values before the log entry, by field name.
+    :type state: dict
+    :param entry: The log entry.
+    :type entry: LogEntry
+    :rtype: dict
+    """
+    from auditlog.documents import LogEntry
+
+    if entry.action == LogEntry.Action.DELETE:
+        return None
+    state = {} if entry.action == LogEntry.Action.CREATE or state is None else dict(state)
+    for change in entry.changes:
+        state[change['field']] = change['new']
+    return state
+
+
+def reconstruct(model, pk, at=None, checkpoint_interval=CHECKPOINT_INTERVAL, save_checkpoints=True):
+    """
+    Returns the state of an object at a point in time, rebuilt from its log entries. The log entries are replayed in
+    order of their timestamp from the latest checkpoint before that time on, and every ``checkpoint_interval`` log
+    entries a new checkpoint is saved, so the cost of a reconstruction is bounded by the interval rather than by the
+    length of the history.
+
+    The values are the strings that were logged (see :py:func:`auditlog.diff.get_field_value`), e.g. the string
+    representation of a related object, not the values of the model fields. Checkpoints assume log entries are indexed
+    in order; after indexing older log entries of an object, e.g. with ``migrate_logs``, remove its checkpoints with
+    :py:func:`delete_checkpoints`.
+
+    :param model: The model of the object.
+    :type model: type
+    :param pk: The primary key of the object, which may no longer exist.
+    :param at: The point in time, including log entries with exactly this timestamp, defaults to now.
+    :type at: datetime
+    :param checkpoint_interval: Save a checkpoint after every this many log entries of the object.
+    :type checkpoint_interval: int
+    :param save_checkpoints: Whether to save the checkpoints passed while replaying.
+    :type save_checkpoints: bool
+    :return: The field values by field name, or ``None`` when the object did not exist at the time.
+    :rtype: dict
+    """
+    from auditlog.documents import LogEntry
+
+    at = at or timezone.now()
+    opts = model._meta.concrete_model._meta
+    queryset = LogEntry.objects.for_object(model(pk=pk)).filter('range', timestamp={'lte': at.isoformat()}) \
+        .order_by('timestamp')
+
+    state, entries = None, 0
+    checkpoint = get_checkpoint(model, pk, at)
+    if checkpoint is not None:
+        state = checkpoint.state.to_dict() if checkpoint.exists else None
+        entries = checkpoint.entries
+        queryset = queryset.search_after(checkpoint.sort_timestamp, checkpoint.entry_id)
+
+    checkpoints = []
+    for entry in queryset.iterator():
+        state = apply(state, entry)
+        entries += 1
+        if save_checkpoints and entries % checkpoint_interval == 0:
+            sort_timestamp, entry_id = entry.meta.sort
+            checkpoints.append(Checkpoint(
+                meta={'id': '%s.%s:%s:%d' % (opts.app_label, opts.model_name, pk, entries)},
+                content_type_app_label=opts.app_label,
+                content_type_model=opts.model_name,
+                object_pk=str(pk),
+                timestamp=entry.timestamp,
+                sort_timestamp=sort_timestamp,
+                entry_id=entry_id,
+                entries=entries,
+                exists=state is not None,
+                state=state,
+            ))
+    if checkpoints:
+        write_checkpoints(checkpoints)
+    return state
+
+
+def reconstruct_many(model, pks, at=None, workers=WORKERS, **kwargs):
+    """
+    Reconstruct the state of several objects at a point in time, ``workers`` at once. Takes the arguments of
+    :py:func:`reconstruct`.
+
+    :return: The states by primary key (as a string).
+    :rtype: dict
+    """
+    at = at or timezone.now()
+    pks = [str(pk) for pk in pks]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        states = executor.map(lambda pk: reconstruct(model, pk, at, **kwargs), pks)
+        return dict(zip(pks, states))
+
+
+def write_checkpoints(checkpoints, client=None):
+    """
+    Index checkpoints, creating their index first when needed. Failures are logged, a reconstruction does not depend on
+    its checkpoints being saved.
+    """
+    client = client or get_client()
+    try:
+        index = Checkpoint._index._name
+        if index not in _initialized:
+            Checkpoint.init(using=client)
+            _initialized.add(index)
+        bulk(client, (checkpoint.to_dict(True) for checkpoint in checkpoints))
+    except Exception:
+        logging.exception("Error when saving reconstruction checkpoints to elasticsearch")
+
+
+def delete_checkpoints(model, pk=None, client=None):
+    """
+    Delete the checkpoints of an object, or of all objects of a model.
+    """
+    search_checkpoints(model, pk, using=client).delete()
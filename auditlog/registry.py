@@ -1,10 +1,12 @@
-from typing import Dict, Callable, Optional, List, Tuple
+from typing import Dict, Callable, Optional, List, Tuple, Union
 
 from django.db.models import Model
 from django.db.models.base import ModelBase
-from django.db.models.signals import pre_save, post_save, post_delete, ModelSignal
+from django.db.models.signals import pre_save, post_save, post_delete, post_init, ModelSignal
 
-DispatchUID = Tuple[int, str, int]
+from auditlog.diff import DiffPlan
+
+DispatchUID = Union[Tuple[int, str, int], Tuple[int, str, int, str]]
 
 
 class AuditlogModelRegistry(object):
@@ -14,10 +16,12 @@ class AuditlogModelRegistry(object):
 
     def __init__(self, create: bool = True, update: bool = True, delete: bool = True,
                  custom: Optional[Dict[ModelSignal, Callable]] = None):
-        from auditlog.receivers import log_create, log_update, log_delete
+        from auditlog.receivers import log_create, log_update, log_delete, take_snapshot
 
         self._registry = {}
+        self._plans = {}
         self._signals = {}
+        self._snapshot_signals = {post_init: take_snapshot, post_save: take_snapshot} if update else {}
 
         if create:
             self._signals[post_save] = log_create
@@ -30,7 +34,8 @@ class AuditlogModelRegistry(object):
             self._signals.update(custom)
 
     def register(self, model: ModelBase = None, include_fields: Optional[List[str]] = None,
-                 exclude_fields: Optional[List[str]] = None, mapping_fields: Optional[Dict[str, str]] = None):
+                 exclude_fields: Optional[List[str]] = None, mapping_fields: Optional[Dict[str, str]] = None,
+                 snapshot: bool = False):
         """
         Register a model with auditlog. Auditlog will then track mutations on this model's instances.
 
@@ -38,6 +43,8 @@ class AuditlogModelRegistry(object):
         :param include_fields: The fields to include. Implicitly excludes all other fields.
         :param exclude_fields: The fields to exclude. Overrides the fields to include.
         :param mapping_fields: Mapping from field names to strings in diff.
+        :param snapshot: Record the tracked field values when instances are loaded, so updates can be diffed without
+            fetching the old instance from the database.
 
         """
 
@@ -53,10 +60,12 @@ class AuditlogModelRegistry(object):
             if not issubclass(cls, Model):
                 raise TypeError("Supplied model is not a valid model.")
 
+            self._plans.pop(cls, None)
             self._registry[cls] = {
                 'include_fields': include_fields,
                 'exclude_fields': exclude_fields,
                 'mapping_fields': mapping_fields,
+                'snapshot': snapshot,
             }
             self._connect_signals(cls)
 
@@ -89,6 +98,7 @@ class AuditlogModelRegistry(object):
 
         :param model: The model to unregister.
         """
+        self._plans.pop(model, None)
         try:
             del self._registry[model]
         except KeyError:
@@ -106,6 +116,24 @@ class AuditlogModelRegistry(object):
             'mapping_fields': dict(self._registry[model]['mapping_fields']),
         }
 
+    def get_diff_plan(self, model: ModelBase) -> DiffPlan:
+        """
+        Returns the compiled :py:class:`auditlog.diff.DiffPlan` of a model. Plans are compiled on first use, or for all
+        registered models when the app is ready, and are discarded when the model is registered again or unregistered.
+
+        :param model: The model to get the plan for.
+        :return: The diff plan of the model.
+        """
+        try:
+            return self._plans[model]
+        except KeyError:
+            pass
+        options = self._registry.get(model, {})
+        plan = DiffPlan(model, options.get('include_fields', ()), options.get('exclude_fields', ()))
+        if model in self._registry:
+            self._plans[model] = plan
+        return plan
+
     def _connect_signals(self, model):
         """
         Connect signals for the model.
@@ -113,6 +141,9 @@ class AuditlogModelRegistry(object):
         for signal in self._signals:
             receiver = self._signals[signal]
             signal.connect(receiver, sender=model, dispatch_uid=self._dispatch_uid(signal, model))
+        if self._registry[model]['snapshot']:
+            for signal, receiver in self._snapshot_signals.items():
+                signal.connect(receiver, sender=model, dispatch_uid=self._dispatch_uid(signal, model, receiver))
 
     def _disconnect_signals(self, model):
         """
@@ -120,11 +151,15 @@ class AuditlogModelRegistry(object):
         """
         for signal, receiver in self._signals.items():
             signal.disconnect(sender=model, dispatch_uid=self._dispatch_uid(signal, model))
+        for signal, receiver in self._snapshot_signals.items():
+            signal.disconnect(sender=model, dispatch_uid=self._dispatch_uid(signal, model, receiver))
 
-    def _dispatch_uid(self, signal, model) -> DispatchUID:
+    def _dispatch_uid(self, signal, model, receiver=None) -> DispatchUID:
         """
         Generate a dispatch_uid.
         """
+        if receiver is not None:
+            return self.__hash__(), model.__qualname__, signal.__hash__(), receiver.__name__
         return self.__hash__(), model.__qualname__, signal.__hash__()
 
 
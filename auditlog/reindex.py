@@ -0,0 +1,192 @@
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+
+from auditlog import lifecycle, retention
+
+# Versioned indices are named '<name>_v<N>'. Not '<name>-v<N>', which would match the index template of the
+# lifecycle, see auditlog.lifecycle.get_index_template.
+VERSION_SEPARATOR = '_v'
+
+
+def get_source(client):
+    """
+    Returns what a reindex copies the log entries from and which alias it swaps at the end. Without the index lifecycle
+    that is the ``AUDITLOG_INDEX_NAME`` alias, or the index of that name when it was never reindexed before. With the
+    lifecycle it is the read alias, after rolling the write alias over so the generations it covers are no longer
+    written to.
+
+    :param client: The Elasticsearch client.
+    :return: A dict with the ``alias``, its ``indices`` and whether the alias is still a concrete index (``concrete``)
+        or the generations of the lifecycle (``lifecycle``).
+    :rtype: dict
+    """
+    from auditlog.documents import LogEntry
+
+    config = lifecycle.get_config()
+    if config['ENABLED']:
+        if config['DATA_STREAM']:
+            raise ImproperlyConfigured("Data streams pick up mapping changes when they roll over, reindexing them is "
+                                       "not supported.")
+        # New generations are created with the current mapping, older ones are reindexed.
+        client.indices.put_index_template(name=lifecycle.get_base_name(), body=lifecycle.get_index_template())
+        new_index = client.indices.rollover(alias=lifecycle.get_write_index())['new_index']
+        read = lifecycle.get_read_index()
+        indices = [name for name in sorted(client.indices.get_alias(name=read)) if name != new_index]
+        return {'alias': read, 'indices': indices, 'concrete': False, 'lifecycle': True}
+
+    name = LogEntry._index._name
+    if client.indices.exists_alias(name=name):
+        return {'alias': name, 'indices': sorted(client.indices.get_alias(name=name)), 'concrete': False,
+                'lifecycle': False}
+    if client.indices.exists(index=name):
+        return {'alias': name, 'indices': [name], 'concrete': True, 'lifecycle': False}
+    raise ImproperlyConfigured("There is no index or alias %s to reindex." % name)
+
+
+def get_targets(client, source):
+    """
+    Returns the indices to copy the log entries to, each with the source indices it is copied from. Without the index
+    lifecycle that is a single ``<AUDITLOG_INDEX_NAME>_v<N>`` index. With the lifecycle every generation is copied to
+    an index of its own, ``<AUDITLOG_INDEX_NAME>_v<N>`` followed by the date and number of the generation, so retention
+    can still drop generations as a whole (see :py:func:`auditlog.lifecycle.get_expired_generations`).
+
+    :param source: The source, as returned by :py:func:`get_source`.
+    :type source: dict
+    :return: The source indices by target index.
+    :rtype: dict
+    """
+    base = lifecycle.get_base_name()
+    prefix = base + VERSION_SEPARATOR
+    pattern = re.compile(r'^%s(\d+)(?:-.*)?$' % re.escape(prefix))
+    versions = [int(match.group(1)) for match in map(pattern.match, client.indices.get(index=prefix + '*')) if match]
+    name = '%s%d' % (prefix, max(versions, default=0) + 1)
+    if not source['lifecycle']:
+        return {name: list(source['indices'])}
+
+    # The part after the base name and version, e.g. '-2021.01.01-000001'.
+    suffix = re.compile(r'^%s(?:%s\d+)?(-.*)?$' % (re.escape(base), re.escape(VERSION_SEPARATOR)))
+    targets = {}
+    for index in source['indices']:
+        match = suffix.match(index)
+        targets[name + ((match.group(1) or '') if match else '-' + index)] = [index]
+    return targets
+
+
+def create_target(client, target, index):
+    """
+    Create an index to copy log entries to, with the current mapping and the number of shards of the index they are
+    copied from. It has no replicas and is not refreshed until :py:func:`finish_target`, which speeds up the copy.
+
+    :return: The number of replicas to restore.
+    :rtype: int
+    """
+    from auditlog.documents import LogEntry
+
+    settings = client.indices.get_settings(index=index)[index]['settings']['index']
+    client.indices.create(index=target, body={
+        'settings': {
+            'number_of_shards': settings['number_of_shards'],
+            'number_of_replicas': 0,
+            'refresh_interval': '-1',
+        },
+        'mappings': LogEntry._doc_type.mapping.to_dict(),
+    })
+    return int(settings['number_of_replicas'])
+
+
+def start_reindex(client, indices, target, since=None, op_type='index', slices='auto', requests_per_second=None,
+                  script=None):
+    """
+    Start a reindex request from the indices to the target as a background task. Log entries keep their id, so
+    copying a log entry again does not duplicate it.
+
+    :param since: Only copy the log entries from this point in time on, to catch up with the writes during the copy.
+    :type since: datetime
+    :param op_type: ``'create'`` to only copy the log entries that are not in the target yet, the others count as
+        version conflicts.
+    :type op_type: str
+    :param script: A painless script that transforms the log entries, e.g. for a renamed field.
+    :type script: str
+    :return: The id of the task.
+    :rtype: str
+    """
+    body = {
+        'source': {'index': list(indices)},
+        'dest': {'index': target, 'op_type': op_type},
+        'conflicts': 'proceed',
+    }
+    if since is not None:
+        body['source']['query'] = {'range': {'timestamp': {'gte': since.isoformat()}}}
+    if script:
+        body['script'] = {'source': script, 'lang': 'painless'}
+    params = {'slices': slices, 'wait_for_completion': False}
+    if requests_per_second:
+        params['requests_per_second'] = requests_per_second
+    return client.reindex(body=body, **params)['task']
+
+
+def get_progress(client, task_id):
+    """
+    Returns the progress of a reindex task, see :py:func:`auditlog.retention.get_progress`.
+    """
+    return retention.get_progress(client, task_id)
+
+
+def count(client, indices):
+    """
+    Returns the number of log entries in the indices, after refreshing them so recent writes are counted.
+
+    :rtype: int
+    """
+    index = ','.join(indices)
+    client.indices.refresh(index=index)
+    return client.count(index=index)['count']
+
+
+def finish_target(client, target, replicas):
+    """
+    Restore the replicas and the refresh interval of the target and refresh it.
+    """
+    client.indices.put_settings(index=target, body={'index': {
+        'number_of_replicas': replicas,
+        'refresh_interval': None,
+    }})
+    client.indices.refresh(index=target)
+
+
+def block_writes(client, indices):
+    """
+    Block writes to the indices. Only needed for an index that the alias replaces, which is deleted by the swap; log
+    entries rejected meanwhile are spooled (see :py:func:`auditlog.spool.is_retryable`).
+    """
+    client.indices.put_settings(index=','.join(indices), body={'index.blocks.write': True})
+
+
+def unblock_writes(client, indices):
+    client.indices.put_settings(index=','.join(indices), body={'index.blocks.write': None})
+
+
+def swap(client, source, targets):
+    """
+    Point the alias at the targets instead of the source indices in a single atomic request, so searches and writes
+    move over at once. An index with the name of the alias is deleted in the same request, other source indices are
+    kept so the log entries written to them until the swap can still be copied.
+
+    :param targets: The target indices, see :py:func:`get_targets`.
+    :type targets: dict
+    """
+    alias = source['alias']
+    if source['concrete']:
+        actions = [{'remove_index': {'index': alias}}]
+    else:
+        actions = [{'remove': {'index': index, 'alias': alias}} for index in source['indices']]
+    actions += [{'add': {'index': target, 'alias': alias}} for target in targets]
+    client.indices.update_aliases(body={'actions': actions})
+
+
+def delete_indices(client, indices):
+    """
+    Delete the source indices once their log entries are copied and the alias is swapped.
+    """
+    client.indices.delete(index=','.join(indices))
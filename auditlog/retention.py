@@ -0,0 +1,219 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl import Q
+
+from auditlog import lifecycle
+
+DEFAULTS = {
+    'MAX_AGE': None,
+    'POLICIES': [],
+    'SLICES': 'auto',
+    'REQUESTS_PER_SECOND': None,
+    'STATE_PATH': None,
+}
+
+
+def get_config():
+    """
+    Returns the retention configuration, the ``AUDITLOG_RETENTION`` setting merged with the defaults.
+
+    :rtype: dict
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AUDITLOG_RETENTION', {}))
+    return config
+
+
+def get_policies(max_age=None):
+    """
+    Returns the retention policies, most specific first. Every policy is a dict with a ``name``, the ``query`` that
+    matches its log entries and the ``max_age`` of those entries. A log entry falls under the first policy that matches
+    it; the last policy, for all remaining entries, has the ``MAX_AGE`` of the configuration (or ``max_age`` when
+    given). Without either, log entries that no policy matches are kept.
+
+    :param max_age: Overrides the ``MAX_AGE`` of the configuration.
+    :type max_age: timedelta
+    :rtype: list
+    """
+    config = get_config()
+    policies = []
+    for policy in config['POLICIES']:
+        filters = []
+        if policy.get('content_type'):
+            try:
+                app_label, model = policy['content_type'].lower().split('.')
+            except ValueError:
+                raise ImproperlyConfigured("Retention policy content types look like 'app_label.model', not %r."
+                                           % policy['content_type'])
+            filters += [Q('term', content_type_app_label=app_label), Q('term', content_type_model=model)]
+        if policy.get('action'):
+            actions = policy['action'] if isinstance(policy['action'], (list, tuple)) else [policy['action']]
+            filters.append(Q('terms', action=list(actions)))
+        if not filters or not policy.get('max_age'):
+            raise ImproperlyConfigured("Retention policies need a max_age and a content_type and/or action: %r"
+                                       % policy)
+        policies.append({
+            'name': ' '.join(str(policy[key]) for key in ('content_type', 'action') if policy.get(key)),
+            'query': Q('bool', filter=filters),
+            'max_age': lifecycle.parse_duration(policy['max_age']),
+        })
+
+    if max_age is None and config['MAX_AGE']:
+        max_age = lifecycle.parse_duration(config['MAX_AGE'])
+    if max_age is not None:
+        policies.append({'name': 'default', 'query': Q('match_all'), 'max_age': max_age})
+    return policies
+
+
+def get_deletes(policies, now=None):
+    """
+    Returns the delete-by-query requests that expire log entries according to the policies. The cutoff times are
+    absolute, so a request gives the same result when it is sent again later.
+
+    :param policies: The policies, as returned by :py:func:`get_policies`.
+    :type policies: list
+    :rtype: list
+    """
+    now = now or timezone.now()
+    deletes = []
+    for i, policy in enumerate(policies):
+        cutoff = now - policy['max_age']
+        query = Q('bool', filter=[policy['query'], Q('range', timestamp={'lt': cutoff.isoformat()})],
+                  must_not=[other['query'] for other in policies[:i]])
+        deletes.append({'name': policy['name'], 'cutoff': cutoff.isoformat(), 'query': query.to_dict()})
+    return deletes
+
+
+def get_droppable_generations(client, policies):
+    """
+    Returns the generations of the index lifecycle (see :py:mod:`auditlog.lifecycle`) that can be dropped as a whole,
+    because every log entry in them has expired under every policy. Only possible when all log entries fall under a
+    policy, i.e. when there is a default maximum age.
+
+    :rtype: list
+    """
+    if not lifecycle.get_config()['ENABLED'] or not policies or policies[-1]['name'] != 'default':
+        return []
+    return lifecycle.get_expired_generations(client, max(policy['max_age'] for policy in policies))
+
+
+class RetentionState(object):
+    """
+    The delete-by-query tasks of a retention run, persisted to a JSON file so an interrupted run can pick up the
+    running tasks instead of starting new ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tasks = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.tasks = json.load(f)
+
+    @classmethod
+    def from_settings(cls):
+        path = get_config()['STATE_PATH'] or os.path.join(
+            tempfile.gettempdir(), 'auditlog-retention-%s.json' % lifecycle.get_base_name())
+        return cls(path)
+
+    def save(self):
+        if not self.tasks:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.tasks, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def start_delete(client, delete, slices=None, requests_per_second=None):
+    """
+    Start a delete-by-query request as a background task.
+
+    :return: The id of the task.
+    :rtype: str
+    """
+    config = get_config()
+    params = {
+        'slices': slices or config['SLICES'],
+        'conflicts': 'proceed',
+        'wait_for_completion': False,
+        'ignore_unavailable': True,
+    }
+    requests_per_second = requests_per_second or config['REQUESTS_PER_SECOND']
+    if requests_per_second:
+        params['requests_per_second'] = requests_per_second
+    response = client.delete_by_query(index=lifecycle.get_read_index(), body={'query': delete['query']}, **params)
+    return response['task']
+
+
+def get_progress(client, task_id):
+    """
+    Returns the progress of a delete-by-query (or update-by-query or reindex) task, or ``None`` when the task is unknown
+    (e.g. because the node it ran on restarted before the task result was stored).
+
+    :return: A dict with ``completed``, ``total``, ``created``, ``deleted``, ``updated`` and ``failures`` keys.
+    :rtype: dict
+    """
+    try:
+        response = client.tasks.get(task_id=task_id)
+    except NotFoundError:
+        return None
+    status = response.get('response') or response.get('task', {}).get('status', {})
+    return {
+        'completed': response.get('completed', False),
+        'total': status.get('total', 0),
+        'created': status.get('created', 0),
+        'deleted': status.get('deleted', 0),
+        'updated': status.get('updated', 0),
+        'failures': status.get('failures', []),
+    }
+
+
+def estimate(client, deletes, generations):
+    """
+    Estimate what a retention run would reclaim.
+
+    :return: A dict with the number of ``docs`` and the number of ``bytes`` per delete request name, and for the
+        generations that would be dropped.
+    :rtype: dict
+    """
+    read_index = lifecycle.get_read_index()
+    dropped = [generation['index'] for generation in generations]
+    stats = client.indices.stats(index=read_index, metric='docs,store', ignore_unavailable=True)['indices']
+
+    result = {}
+    if dropped:
+        result['dropped indices'] = {
+            'docs': sum(stats.get(name, {}).get('primaries', {}).get('docs', {}).get('count', 0) for name in dropped),
+            'bytes': sum(stats.get(name, {}).get('primaries', {}).get('store', {}).get('size_in_bytes', 0)
+                         for name in dropped),
+        }
+
+    # Estimate the bytes of individual documents from the average document size of their index.
+    average = {}
+    for name, index_stats in stats.items():
+        primaries = index_stats.get('primaries', {})
+        count = primaries.get('docs', {}).get('count', 0)
+        average[name] = primaries.get('store', {}).get('size_in_bytes', 0) / count if count else 0
+
+    for delete in deletes:
+        query = {'bool': {'filter': [delete['query']], 'must_not': [{'terms': {'_index': dropped}}]}}
+        response = client.search(index=read_index, ignore_unavailable=True, body={
+            'size': 0,
+            'track_total_hits': True,
+            'query': query,
+            'aggs': {'indices': {'terms': {'field': '_index', 'size': max(len(stats), 1)}}},
+        })
+        buckets = response['aggregations']['indices']['buckets']
+        result[delete['name']] = {
+            'docs': sum(bucket['doc_count'] for bucket in buckets),
+            'bytes': int(sum(bucket['doc_count'] * average.get(bucket['key'], 0) for bucket in buckets)),
+        }
+    return result
@@ -0,0 +1,260 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from auditlog.buffer import index_entries
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+
+DEFAULTS = {
+    'ENABLED': False,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'OVERFLOW': BLOCK,
+    'MIN_WORKERS': 1,
+    'MAX_WORKERS': 4,
+    'IDLE_TIMEOUT': 30.0,
+    'SHUTDOWN_TIMEOUT': 10.0,
+    'RETRIES': 3,
+    'RETRY_BACKOFF': 1.0,
+    'ASYNC': False,
+}
+
+
+def get_config():
+    """
+    Returns the shipper configuration, the ``AUDITLOG_SHIPPER`` setting merged with the defaults.
+
+    :rtype: dict
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AUDITLOG_SHIPPER', {}))
+    return config
+
+
+class LogShipper(object):
+    """
+    Indexes log entries on a pool of background threads, taking Elasticsearch latency off the threads that create them.
+
+    Entries are put on a bounded queue. Each worker collects up to ``batch_size`` entries, or whatever arrived within
+    ``flush_interval`` seconds, and indexes them with a single bulk request. When the queue grows beyond what the
+    current workers keep up with, workers are added up to ``max_workers``; workers above ``min_workers`` stop again
+    after ``idle_timeout`` seconds without work.
+
+    When the queue is full, ``overflow`` decides what happens to new entries:
+
+    - ``'block'``: the caller waits until there is room in the queue.
+    - ``'drop_oldest'``: the oldest queued entry is discarded to make room.
+    - ``'spill'``: the entries that do not fit are indexed on the calling thread.
+
+    Entries a worker fails to index because Elasticsearch is unavailable are retried ``retries`` times, after
+    ``retry_backoff`` seconds and twice as long for every next attempt (see :py:func:`auditlog.spool.is_retryable`).
+    Entries that were rejected, or still fail, are counted in :py:attr:`failed`.
+    """
+
+    def __init__(self, queue_size=DEFAULTS['QUEUE_SIZE'], batch_size=DEFAULTS['BATCH_SIZE'],
+                 flush_interval=DEFAULTS['FLUSH_INTERVAL'], overflow=DEFAULTS['OVERFLOW'],
+                 min_workers=DEFAULTS['MIN_WORKERS'], max_workers=DEFAULTS['MAX_WORKERS'],
+                 idle_timeout=DEFAULTS['IDLE_TIMEOUT'], retries=DEFAULTS['RETRIES'],
+                 retry_backoff=DEFAULTS['RETRY_BACKOFF']):
+        if overflow not in (BLOCK, DROP_OLDEST, SPILL):
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.dropped = 0
+        self.failed = 0
+        self.pid = os.getpid()
+
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    @classmethod
+    def from_settings(cls):
+        config = get_config()
+        return cls(
+            queue_size=config['QUEUE_SIZE'],
+            batch_size=config['BATCH_SIZE'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            overflow=config['OVERFLOW'],
+            min_workers=config['MIN_WORKERS'],
+            max_workers=config['MAX_WORKERS'],
+            idle_timeout=config['IDLE_TIMEOUT'],
+            retries=config['RETRIES'],
+            retry_backoff=config['RETRY_BACKOFF'],
+        )
+
+    def start(self):
+        """
+        Start the minimum number of workers.
+        """
+        with self._lock:
+            while len(self._workers) < self.min_workers:
+                self._start_worker()
+
+    @property
+    def num_workers(self):
+        return len(self._workers)
+
+    def put(self, entries):
+        """
+        Queue log entries for indexing.
+
+        :param entries: The log entries to index.
+        :type entries: list
+        :return: The log entries that could not be indexed, only ever non-empty for the ``'spill'`` policy.
+        :rtype: list
+        """
+        spilled = []
+        for entry in entries:
+            self._scale()
+            if self.overflow == BLOCK:
+                self.queue.put(entry)
+                continue
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                if self.overflow == SPILL:
+                    spilled.append(entry)
+                    continue
+                self._put_dropping_oldest(entry)
+        if spilled:
+            return index_entries(spilled)
+        return []
+
+    def stop(self, timeout=DEFAULTS['SHUTDOWN_TIMEOUT']):
+        """
+        Stop the workers after the queue has been drained. Entries still queued after ``timeout`` seconds are lost.
+        """
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        remaining = self.queue.qsize()
+        if remaining:
+            logging.error("Audit log shipper stopped with %d log entries left in the queue", remaining)
+
+    def _put_dropping_oldest(self, entry):
+        # Other threads may fill the queue up again between dropping an entry and putting this one.
+        while True:
+            self._drop_oldest()
+            try:
+                self.queue.put_nowait(entry)
+                return
+            except queue.Full:
+                continue
+
+    def _drop_oldest(self):
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            return
+        self.dropped += 1
+        logging.warning("Audit log shipper queue is full, dropped the oldest log entry (%d in total)", self.dropped)
+
+    def _scale(self):
+        if not self._workers or len(self._workers) >= self.max_workers or self._stopping.is_set():
+            return
+        if self.queue.qsize() > self.batch_size * len(self._workers):
+            with self._lock:
+                if len(self._workers) < self.max_workers:
+                    self._start_worker()
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._run, name='auditlog-shipper', daemon=True)
+        self._workers.add(worker)
+        worker.start()
+
+    def _run(self):
+        worker = threading.current_thread()
+        idle_since = time.monotonic()
+        try:
+            while True:
+                batch = self._collect()
+                if batch:
+                    self._index(batch)
+                    idle_since = time.monotonic()
+                elif self._stopping.is_set():
+                    return
+                elif time.monotonic() - idle_since > self.idle_timeout:
+                    with self._lock:
+                        if len(self._workers) > self.min_workers:
+                            self._workers.discard(worker)
+                            return
+        finally:
+            with self._lock:
+                self._workers.discard(worker)
+
+    def _index(self, batch):
+        delay = self.retry_backoff
+        failed = 0
+        for attempt in range(self.retries + 1):
+            # Only entries that failed because Elasticsearch was unavailable are sent again, rejected ones fail at once.
+            resend = [] if attempt < self.retries else None
+            failed += len(index_entries(batch, resend=resend))
+            batch = resend
+            if not batch:
+                break
+            time.sleep(delay)
+            delay *= 2
+        if failed:
+            with self._lock:
+                self.failed += failed
+            logging.error("Audit log shipper could not index %d log entries (%d in total)", failed, self.failed)
+
+    def _collect(self):
+        """
+        Collect a batch of entries, waiting at most ``flush_interval`` seconds for the batch to fill up.
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0 or self._stopping.is_set():
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+
+_shipper = None
+_shipper_lock = threading.Lock()
+
+
+def get_shipper():
+    """
+    Returns the process-wide shipper, or ``None`` when background delivery is disabled. The shipper is started on first
+    use, and started anew in a forked child process.
+
+    :rtype: LogShipper
+    """
+    global _shipper
+    if not get_config()['ENABLED']:
+        return None
+    if _shipper is None or _shipper.pid != os.getpid():
+        with _shipper_lock:
+            if _shipper is None or _shipper.pid != os.getpid():
+                _shipper = LogShipper.from_settings()
+                _shipper.start()
+                atexit.register(_shipper.stop, get_config()['SHUTDOWN_TIMEOUT'])
+    return _shipper
@@ -0,0 +1,376 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from elasticsearch.helpers import streaming_bulk
+
+from auditlog.connection import get_client, get_timeout
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': None,
+    'SEGMENT_SIZE': 64 * 1024 * 1024,
+    'SEGMENT_MAX_AGE': 60.0,
+    'MAX_SIZE': 1024 * 1024 * 1024,
+    'FSYNC': FSYNC_INTERVAL,
+    'FSYNC_INTERVAL': 1.0,
+    'RETRY_AFTER': 30.0,
+    'REPLAY_INTERVAL': None,
+    'REPLAY_BATCH_SIZE': 500,
+}
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+OFFSET_SUFFIX = '.offset'
+LOCK_NAME = 'replay.lock'
+
+
+def get_config():
+    """
+    Returns the spool configuration, the ``AUDITLOG_SPOOL`` setting merged with the defaults.
+
+    :rtype: dict
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AUDITLOG_SPOOL', {}))
+    return config
+
+
+def is_retryable(item):
+    """
+    Returns whether a failed bulk item may succeed when sent again later, i.e. it failed because the cluster was
+    unreachable, overloaded or the index was blocked for writes (e.g. by ``reindex_logs`` or a full disk) rather than
+    because the document was rejected.
+
+    :param item: The result of a bulk action as returned by :py:func:`elasticsearch.helpers.streaming_bulk`.
+    :type item: dict
+    :rtype: bool
+    """
+    result = next(iter(item.values()), {}) if item else {}
+    status = result.get('status')
+    error = result.get('error')
+    if isinstance(error, dict) and error.get('type') == 'cluster_block_exception':
+        return True
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+
+class Spool(object):
+    """
+    A durable, append-only log of bulk actions on local disk that could not be sent to Elasticsearch.
+
+    Actions are written as JSON lines to segment files in ``path``. Every process writes its own segment, which is
+    sealed once it grows beyond ``segment_size`` bytes or is older than ``segment_max_age`` seconds. Segments that were
+    not written to for ``segment_max_age`` seconds are taken over by a replay. :py:meth:`replay` sends sealed segments
+    to Elasticsearch in order and removes them once they are fully indexed; the number of lines already indexed is kept
+    next to the segment so an interrupted replay picks up where it left off. Because every action carries its document
+    id, sending a document twice does not create duplicates.
+
+    ``fsync`` controls durability: ``'always'`` syncs every write to disk, ``'interval'`` at most once per
+    ``fsync_interval`` seconds and ``'never'`` leaves it to the operating system. Once the segments take up ``max_size``
+    bytes, new actions are discarded.
+    """
+
+    def __init__(self, path, segment_size=DEFAULTS['SEGMENT_SIZE'], max_size=DEFAULTS['MAX_SIZE'],
+                 fsync=DEFAULTS['FSYNC'], fsync_interval=DEFAULTS['FSYNC_INTERVAL'],
+                 segment_max_age=DEFAULTS['SEGMENT_MAX_AGE']):
+        if not path:
+            raise ImproperlyConfigured("AUDITLOG_SPOOL['PATH'] must be set to use the spool.")
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ImproperlyConfigured("Unknown fsync policy: %r" % fsync)
+        self.path = path
+        self.segment_size = segment_size
+        self.segment_max_age = segment_max_age
+        self.max_size = max_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.pid = os.getpid()
+
+        self._lock = threading.RLock()
+        self._file = None
+        self._opened = 0
+        self._last_sync = 0
+        self._sequence = 0
+        self._size = None
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls):
+        config = get_config()
+        return cls(
+            config['PATH'],
+            segment_size=config['SEGMENT_SIZE'],
+            segment_max_age=config['SEGMENT_MAX_AGE'],
+            max_size=config['MAX_SIZE'],
+            fsync=config['FSYNC'],
+            fsync_interval=config['FSYNC_INTERVAL'],
+        )
+
+    def append(self, entries):
+        """
+        Write log entries to the spool.
+
+        :param entries: The log entries to write.
+        :type entries: list
+        :return: The number of entries written.
+        :rtype: int
+        """
+        lines = ''.join(json.dumps(entry.to_dict(include_meta=True), cls=DjangoJSONEncoder) + '\n'
+                        for entry in entries)
+        with self._lock:
+            if self._file is not None and not self._lock_segment():
+                self._file = None
+            if self._file is None:
+                self._size = self.size()
+            if self._size + len(lines) > self.max_size:
+                if self._file is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+                logging.error("Audit log spool is full, discarded %d log entries", len(entries))
+                return 0
+            if self._file is None:
+                self._open_segment()
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._file.write(lines)
+                self._file.flush()
+                self._size += len(lines)
+                if self.fsync == FSYNC_ALWAYS or (
+                        self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_sync >= self.fsync_interval):
+                    os.fsync(self._file.fileno())
+                    self._last_sync = time.monotonic()
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            if self._file.tell() >= self.segment_size or time.monotonic() - self._opened >= self.segment_max_age:
+                self.seal()
+        return len(entries)
+
+    def _lock_segment(self):
+        """
+        Lock the current segment for writing. Returns ``False``, after closing it, when a replay took the segment over
+        while it was idle (see :py:meth:`_take_over`), so a new segment has to be started.
+        """
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        if os.path.exists(self._file.name):
+            return True
+        self._file.close()
+        return False
+
+    def seal(self):
+        """
+        Close the current segment of this process, making it available for replay.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            if self._lock_segment():
+                if self.fsync != FSYNC_NEVER:
+                    os.fsync(self._file.fileno())
+                name = self._file.name
+                os.rename(name, name[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+                self._file.close()
+            self._file = None
+
+    def size(self):
+        """
+        Returns the total size of all segments in bytes.
+        """
+        return sum(os.path.getsize(name) for name in self._segment_files(OPEN_SUFFIX) + self._segment_files())
+
+    def segments(self):
+        """
+        Returns the paths of the segments that can be replayed, oldest first. This includes the segments that processes
+        which no longer run left open, and takes over the segments of running processes that were idle for
+        ``segment_max_age`` seconds.
+        """
+        abandoned = []
+        for name in self._segment_files(OPEN_SUFFIX):
+            if not _pid_alive(_segment_pid(name)):
+                abandoned.append(name)
+            elif time.time() - os.path.getmtime(name) >= self.segment_max_age:
+                self._take_over(name)
+        return sorted(self._segment_files() + abandoned, key=os.path.basename)
+
+    def _take_over(self, name):
+        """
+        Seal the idle segment of another process, or of another thread of this one. The segment is renamed while its
+        lock is held, so the owner notices it on its next write and starts a new segment (see :py:meth:`append`).
+        """
+        try:
+            with open(name) as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+                if os.path.exists(name):
+                    os.rename(name, name[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def replay(self, client=None, batch_size=DEFAULTS['REPLAY_BATCH_SIZE']):
+        """
+        Send the spooled actions to Elasticsearch, oldest first. Stops at the first action that fails in a way that may
+        succeed later, so the order of the actions is preserved. Only one process replays a spool at a time, the call
+        returns right away when another process is already replaying.
+
+        :param client: The Elasticsearch client, defaults to the default connection.
+        :param batch_size: The number of actions per bulk request.
+        :return: The number of actions indexed and whether the spool was drained completely.
+        :rtype: tuple
+        """
+        client = client or get_client()
+        self.seal()
+        with open(os.path.join(self.path, LOCK_NAME), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0, False
+            indexed = 0
+            for name in self.segments():
+                count, complete = self._replay_segment(client, name, batch_size)
+                indexed += count
+                if not complete:
+                    return indexed, False
+            return indexed, True
+
+    def _replay_segment(self, client, name, batch_size):
+        offset_name = name + OFFSET_SUFFIX
+        offset = 0
+        if os.path.exists(offset_name):
+            with open(offset_name) as f:
+                offset = int(f.read().strip() or 0)
+
+        indexed = 0
+        with open(name) as f:
+            actions = (json.loads(line) for i, line in enumerate(f) if i >= offset)
+            results = streaming_bulk(client, actions, chunk_size=batch_size, raise_on_error=False,
+                                     raise_on_exception=False, request_timeout=get_timeout('bulk'))
+            for ok, item in results:
+                if not ok:
+                    if is_retryable(item):
+                        self._write_offset(offset_name, offset)
+                        return indexed, False
+                    logging.error("Discarded spooled log entry rejected by elasticsearch: %s", item)
+                else:
+                    indexed += 1
+                offset += 1
+
+        os.remove(name)
+        if os.path.exists(offset_name):
+            os.remove(offset_name)
+        return indexed, True
+
+    def _write_offset(self, offset_name, offset):
+        with open(offset_name + '.tmp', 'w') as f:
+            f.write(str(offset))
+        os.replace(offset_name + '.tmp', offset_name)
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = '%017d-%d-%d%s' % (time.time() * 1000000, self.pid, self._sequence, OPEN_SUFFIX)
+        self._file = open(os.path.join(self.path, name), 'a')
+        self._opened = time.monotonic()
+
+    def _segment_files(self, suffix=SEALED_SUFFIX):
+        return glob.glob(os.path.join(self.path, '*' + suffix))
+
+
+def _segment_pid(name):
+    try:
+        return int(os.path.basename(name).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SpoolReplayer(threading.Thread):
+    """
+    Background thread that periodically replays the spool.
+    """
+
+    def __init__(self, spool, interval, batch_size=DEFAULTS['REPLAY_BATCH_SIZE']):
+        super().__init__(name='auditlog-spool-replayer', daemon=True)
+        self.spool = spool
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                indexed, complete = self.spool.replay(batch_size=self.batch_size)
+                if indexed or complete:
+                    mark_available()
+            except Exception:
+                logging.exception("Error when replaying the audit log spool")
+
+
+_spool = None
+_spool_lock = threading.Lock()
+_unavailable_until = 0
+
+
+def get_spool():
+    """
+    Returns the process-wide spool, or ``None`` when the spool is disabled. The spool is created on first use, and anew
+    in a forked child process. When ``REPLAY_INTERVAL`` is set, a background replayer is started along with it.
+
+    :rtype: Spool
+    """
+    global _spool
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    if _spool is None or _spool.pid != os.getpid():
+        with _spool_lock:
+            if _spool is None or _spool.pid != os.getpid():
+                _spool = Spool.from_settings()
+                if config['REPLAY_INTERVAL']:
+                    SpoolReplayer(_spool, config['REPLAY_INTERVAL'], config['REPLAY_BATCH_SIZE']).start()
+    return _spool
+
+
+def mark_unavailable():
+    """
+    Remember that Elasticsearch could not be reached, so entries are spooled right away for ``RETRY_AFTER`` seconds
+    instead of waiting for a connection timeout on every write.
+    """
+    global _unavailable_until
+    _unavailable_until = time.monotonic() + get_config()['RETRY_AFTER']
+
+
+def mark_available():
+    """
+    Remember that Elasticsearch is reachable again.
+    """
+    global _unavailable_until
+    _unavailable_until = 0
+
+
+def is_unavailable():
+    """
+    Returns whether Elasticsearch was recently found to be unreachable.
+    """
+    return time.monotonic() < _unavailable_until
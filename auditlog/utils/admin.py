@@ -1,17 +1,26 @@
-from math import ceil
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from urllib.parse import urlencode
 
 from django.contrib.admin.options import IncorrectLookupParameters
-from django.contrib.admin.views.main import ALL_VAR, PAGE_VAR
-from django.core.paginator import InvalidPage, Paginator
+from django.core.cache import cache
 from django.forms.utils import pretty_name
 from django.urls import reverse
-from django.utils.functional import cached_property
 from django.utils.html import format_html
+from elasticsearch_dsl import Date
+from elasticsearch_dsl.response import Response
+from elasticsearch_dsl.utils import AttrDict
 
 from auditlog.filters import SimpleInputFilter
 
 
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+LAST_VAR = 'last'
+IGNORED_PARAMS = (AFTER_VAR, BEFORE_VAR, LAST_VAR)
+
+
 def get_headers(fields):
     for field in fields:
         yield {
@@ -49,17 +58,145 @@ def results(result_list, fields, opts):
         yield items_for_result(result, fields, opts)
 
 
-class CustomPaginator(Paginator):
-    @cached_property
-    def num_pages(self):
-        """Return the total number of pages."""
-        if self.count == 0 and not self.allow_empty_first_page:
-            return 0
-        hits = max(1, self.count - self.orphans)
-        # Elasticsearch has max offset 10000
-        if hits > 10000:
-            hits = 10000
-        return ceil(hits / self.per_page)
+def encode_cursor(sort_values):
+    return urlsafe_b64encode(json.dumps(list(sort_values), separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise IncorrectLookupParameters("Invalid cursor: %r" % cursor)
+    # The sort values of CursorPaginator.sort: the timestamp in milliseconds and the id of the log entry.
+    if not (isinstance(sort_values, list) and len(sort_values) == 2 and type(sort_values[0]) is int
+            and isinstance(sort_values[1], str)):
+        raise IncorrectLookupParameters("Invalid cursor: %r" % cursor)
+    return sort_values
+
+
+class HitRow(object):
+    """
+    A row of the changelist, built from a raw hit instead of a :py:class:`~auditlog.documents.LogEntry` document.
+    Fields are read from the source (which may hold only the displayed fields, see
+    ``DummyModelAdmin.list_source_fields``) and deserialized when they are accessed.
+    """
+
+    def __init__(self, hit):
+        self.meta = AttrDict({'id': hit['_id'], 'index': hit.get('_index'), 'sort': hit.get('sort')})
+        self.source = hit.get('_source', {})
+
+    def __getattr__(self, name):
+        from auditlog.documents import LogEntry
+
+        if name in ('meta', 'source'):
+            raise AttributeError(name)
+        value = self.source.get(name)
+        field = LogEntry._doc_type.mapping.resolve_field(name)
+        if value is None and field is not None and field._multi:
+            # Like a document, e.g. a log entry without changes.
+            return []
+        if value is not None and isinstance(field, Date):
+            value = field.deserialize(value)
+        return value
+
+    @property
+    def actor(self):
+        from auditlog.documents import LogEntry
+
+        return LogEntry.actor.fget(self)
+
+    @property
+    def changed_fields(self):
+        from auditlog.documents import LogEntry
+
+        # Computed from the names of the changed fields only, their old and new values are not fetched.
+        return LogEntry.changed_fields.fget(self)
+
+
+class CursorPage(object):
+    def __init__(self, object_list, has_next, has_previous, total, total_exact):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.total = total
+        self.total_exact = total_exact
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1].meta.sort) if self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0].meta.sort) if self.object_list else None
+
+
+class CursorPaginator(object):
+    """
+    Pages through the log entries with ``search_after`` on ``(timestamp, _id)``, newest first. Unlike offset paging,
+    every page costs the same, however deep it is, and is not limited by Elasticsearch's ``max_result_window``. Pages
+    are addressed by the sort values of the entry before (``after``) or after (``before``) them instead of by number.
+    """
+    sort = (('timestamp', 'desc'), ('_id', 'desc'))
+
+    def __init__(self, search, per_page, track_total_hits=10000, row_class=None):
+        self.search = search
+        self.per_page = per_page
+        self.track_total_hits = track_total_hits
+        self.row_class = row_class
+
+    def get_search(self, after=None, before=None, last=False):
+        """
+        Returns the search for the page after or before a cursor, the last page or else the first page.
+
+        :param after: The sort values of the entry before the page.
+        :type after: list
+        :param before: The sort values of the entry after the page.
+        :type before: list
+        :param last: Search the last page.
+        :type last: bool
+        :rtype: Search
+        """
+        backwards = before is not None or last
+        sort = [{field: 'asc' if (order == 'asc') != backwards else 'desc'} for field, order in self.sort]
+        # Fetch one extra entry to find out whether there is another page in the paging direction.
+        s = self.search.sort(*sort).extra(size=self.per_page + 1, track_total_hits=self.track_total_hits)
+        cursor = before if backwards else after
+        if cursor is not None:
+            s = s.extra(search_after=cursor)
+        return s
+
+    def get_page(self, response, after=None, before=None, last=False):
+        """
+        Returns the page from the response to the search of :py:meth:`get_search` with the same arguments. The entries
+        of the page are documents, or instances of ``row_class`` built from the raw hits when it is given.
+
+        :rtype: CursorPage
+        """
+        backwards = before is not None or last
+        raw = response.to_dict()['hits']
+        if self.row_class is not None:
+            hits = [self.row_class(hit) for hit in raw['hits'][:self.per_page]]
+        else:
+            hits = list(response)[:self.per_page]
+        more = len(raw['hits']) > self.per_page
+        if backwards:
+            hits.reverse()
+        return CursorPage(
+            hits,
+            has_next=more if not backwards else before is not None,
+            has_previous=more if backwards else after is not None,
+            total=raw['total']['value'],
+            total_exact=raw['total']['relation'] == 'eq',
+        )
+
+    def page(self, after=None, before=None, last=False):
+        """
+        Returns the page after or before a cursor, the last page or else the first page (see :py:meth:`get_search`).
+
+        :rtype: CursorPage
+        """
+        response = self.get_search(after=after, before=before, last=last).execute()
+        return self.get_page(response, after=after, before=before, last=last)
 
 
 class CustomChangeList:
@@ -76,6 +213,8 @@ class CustomChangeList:
         """
         params = params or self.params
         lookup_params = params.copy()  # a dictionary of the query string
+        for ignored in IGNORED_PARAMS:
+            lookup_params.pop(ignored, None)
         return lookup_params
 
     def get_filters(self):
@@ -123,61 +262,102 @@ class CustomChangeList:
             self.has_active_filters,
         ) = self.get_filters()
         # Then, we let every list filter modify the queryset to its liking.
+        return self.get_facet_queryset()
+
+    def get_facet_queryset(self, exclude=None):
+        """
+        Returns the queryset with all filters applied but ``exclude``, so the facets of a filter count the log entries
+        that its choices would select.
+        """
         qs = self.root_queryset
         for filter_spec in self.filter_specs:
+            if filter_spec is exclude:
+                continue
             new_qs = filter_spec.queryset(self.request, qs)
             if new_qs is not None:
                 qs = new_qs
-
         return qs
 
+    def get_facet_cache_key(self, search):
+        body = json.dumps({'index': search._index, 'body': search.to_dict()}, sort_keys=True, default=str)
+        return 'auditlog:facet:%s' % hashlib.sha1(body.encode()).hexdigest()
+
     def get_results(self):
+        from auditlog.documents import LogEntry
+
         queryset = self.get_queryset()
         paginator = self.model_admin.get_paginator(self.request, queryset, self.model_admin.list_per_page)
-        # Get the number of objects, with admin filters applied.
-        result_count = paginator.count
-
-        # Get the total number of objects, with no admin filters applied.
-        if self.model_admin.show_full_result_count:
-            full_result_count = self.root_queryset.count()
-        else:
-            full_result_count = None
-
-        can_show_all = result_count <= self.model_admin.list_max_show_all
-        multi_page = result_count > self.model_admin.list_per_page
+        after = self.params.get(AFTER_VAR)
+        before = self.params.get(BEFORE_VAR)
+        cursor = {
+            'after': decode_cursor(after) if after else None,
+            'before': decode_cursor(before) if before else None,
+            'last': LAST_VAR in self.params,
+        }
 
-        try:
-            page_num = int(self.request.GET.get(PAGE_VAR, 0))
-        except ValueError:
-            page_num = 0
+        # The page, the count without filters and the facets of the filters are fetched in a single _msearch request.
+        # Hits are counted up to the track_total_hits limit only, as counting is the expensive part of a search, and
+        # not at all for the facets. Facets are cached briefly, they are the same for every page of a result.
+        searches = [paginator.get_search(**cursor)]
+        count_full_result = self.model_admin.show_full_result_count and self.has_active_filters
+        if count_full_result:
+            searches.append(self.root_queryset.sort().extra(size=0, track_total_hits=paginator.track_total_hits))
+        timeout = self.model_admin.facet_cache_timeout
+        facets = []
+        for filter_spec in self.filter_specs:
+            facet_search = filter_spec.facet_search(self)
+            if facet_search is None:
+                continue
+            facet_search = facet_search.sort().extra(size=0, track_total_hits=False)
+            key = self.get_facet_cache_key(facet_search)
+            cached = cache.get(key) if timeout else None
+            if cached is not None:
+                filter_spec.facet_results(Response(facet_search, cached))
+            else:
+                facets.append((filter_spec, key))
+                searches.append(facet_search)
+        responses = LogEntry.msearch(searches)
 
-        show_all = ALL_VAR in self.request.GET
-        # Get the list of objects to display on this page.
-        if (show_all and can_show_all) or not multi_page:
-            result_list = queryset._clone()
-        else:
-            try:
-                result_list = paginator.page(page_num + 1).object_list
-            except InvalidPage:
-                raise IncorrectLookupParameters
+        page = paginator.get_page(responses[0], **cursor)
+        for (filter_spec, key), response in zip(facets, responses[1 + count_full_result:]):
+            filter_spec.facet_results(response)
+            if timeout:
+                cache.set(key, response.to_dict(), timeout)
 
-        self.result_count = result_count
-        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.result_count = page.total
+        self.result_count_exact = page.total_exact
+        self.show_full_result_count = count_full_result
         self.show_admin_actions = False
-        self.full_result_count = full_result_count
-        self.result_list = result_list
-        self.can_show_all = can_show_all
-        self.multi_page = multi_page
+        self.full_result_count = responses[1].hits.total.value if count_full_result else None
+        self.result_list = page.object_list
+        self.can_show_all = False
+        self.multi_page = page.has_next or page.has_previous
         self.paginator = paginator
-        self.page_num = page_num
-        self.show_all = show_all
+        self.page = page
+        self.show_all = False
+
+    @property
+    def first_url(self):
+        return self.get_query_string()
+
+    @property
+    def previous_url(self):
+        return self.get_query_string({BEFORE_VAR: self.page.previous_cursor})
+
+    @property
+    def next_url(self):
+        return self.get_query_string({AFTER_VAR: self.page.next_cursor})
+
+    @property
+    def last_url(self):
+        return self.get_query_string({LAST_VAR: 1})
 
     def get_query_string(self, new_params=None, remove=None):
         if new_params is None:
             new_params = {}
         if remove is None:
             remove = []
-        p = self.params.copy()
+        p = self.get_filters_params()
         for r in remove:
             for k in list(p):
                 if k.startswith(r):
@@ -4,7 +4,8 @@ from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from hashid_field import HashidAutoField
 
-from auditlog.models import AuditlogHistoryField
+from auditlog.managers import AuditlogManager
+from auditlog.models import AuditlogHistoryField, AuditlogSnapshotMixin
 from auditlog.registry import auditlog
 
 
@@ -219,6 +220,30 @@ class NoDeleteHistoryModel(models.Model):
     history = AuditlogHistoryField(delete_related=False)
 
 
+class SnapshotModel(AuditlogSnapshotMixin, models.Model):
+    """
+    A model registered with snapshots, so updates are diffed without fetching the old instance.
+    """
+
+    text = models.TextField(blank=True)
+    integer = models.IntegerField(blank=True, null=True)
+    related = models.ForeignKey(to=SimpleModel, on_delete=models.CASCADE, blank=True, null=True)
+    data = models.JSONField(blank=True, null=True)
+
+    history = AuditlogHistoryField()
+
+
+class BulkModel(models.Model):
+    """
+    A model with a manager that logs bulk operations.
+    """
+
+    text = models.TextField(blank=True)
+    integer = models.IntegerField(blank=True, null=True)
+
+    objects = AuditlogManager()
+
+
 auditlog.register(AltPrimaryKeyModel)
 auditlog.register(UUIDPrimaryKeyModel)
 auditlog.register(ProxyModel)
@@ -234,3 +259,5 @@ auditlog.register(CharfieldTextfieldModel)
 auditlog.register(PostgresArrayFieldModel)
 auditlog.register(NoDeleteHistoryModel)
 auditlog.register(HashIdModel)
+auditlog.register(SnapshotModel, snapshot=True)
+auditlog.register(BulkModel)
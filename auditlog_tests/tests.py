@@ -1,30 +1,63 @@
+import asyncio
 import datetime
+import glob
+import gzip
+import json
+import os
+import queue
+import tempfile
+import time
+from io import StringIO
 from unittest import mock
-from unittest.mock import MagicMock
-
-from django.contrib.auth.models import User
-from django.core.exceptions import ValidationError
-from django.http import HttpResponse
-from django.test import TestCase, RequestFactory, TransactionTestCase
+from urllib.parse import urlencode
+from unittest.mock import AsyncMock, MagicMock
+
+from asgiref.sync import sync_to_async
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import Client, TestCase, RequestFactory, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl import connections
+
+from auditlog import analytics, export, lifecycle, reconstruction, reindex, retention
+from auditlog.admin import LogModel
+from auditlog.aio import AsyncLogShipper, aget_history, async_index_entries
+from auditlog.buffer import index_entries, send_entries
+from auditlog.connection import get_client, get_client_kwargs
+from auditlog.context import auditlog_context, set_actor
+from auditlog.diff import model_instance_diff, model_instances_diff
 from auditlog.documents import LogEntry, log_created
+from auditlog.filters import ActionChoiceFilter, ActorInputFilter, ChangesFilter, ContentTypeChoiceFilter, contains
 from auditlog.middleware import AuditlogMiddleware
+from auditlog.models import LogEntry as LogEntry_db
 from auditlog.receivers import log_create, log_update, log_delete
 from auditlog.registry import auditlog
+from auditlog.shipper import LogShipper
+from auditlog.spool import Spool, mark_available
+from auditlog.utils.admin import CursorPaginator, CustomChangeList, HitRow, decode_cursor, encode_cursor
 from auditlog_tests.models import SimpleModel, AltPrimaryKeyModel, UUIDPrimaryKeyModel, \
     ProxyModel, SimpleIncludeModel, SimpleExcludeModel, SimpleMappingModel, ManyRelatedModel, \
-    DateTimeFieldModel, NoDeleteHistoryModel, HashIdModel
+    DateTimeFieldModel, NoDeleteHistoryModel, HashIdModel, SnapshotModel, BulkModel
 
 
 class BaseTest:
     def setUp(self):
-        self.mock_save = MagicMock()
-        self.mocked_save = mock.patch('auditlog.documents.LogEntry.save', side_effect=self.mock_save)
-        self.mocked_save.start()
+        self.mock_bulk = MagicMock()
+        self.mocked_bulk = mock.patch('auditlog.documents.LogEntry.streaming_bulk', side_effect=self.mock_bulk)
+        self.mocked_bulk.start()
 
     def tearDown(self):
-        self.mocked_save.stop()
+        self.mocked_bulk.stop()
 
 
 class BaseModelTest(BaseTest):
@@ -36,7 +69,7 @@ class BaseModelTest(BaseTest):
 
     def test_create(self):
         """Creation is logged correctly."""
-        self.assertEqual(self.mock_save.call_count, 1)
+        self.assertEqual(self.mock_bulk.call_count, 1)
 
         loge_entry = log_create(self.sender, self.obj, True)
         self.assertEqual(loge_entry.action, LogEntry.Action.CREATE, msg="Action is 'CREATE'")
@@ -55,7 +88,7 @@ class BaseModelTest(BaseTest):
 
         obj.save()
 
-        self.assertEqual(self.mock_save.call_count, 3)
+        self.assertEqual(self.mock_bulk.call_count, 3)
 
         # Check for log entries
         self.assertEqual(log_entry.action, LogEntry.Action.UPDATE, msg="There is one log entry for 'UPDATE'")
@@ -73,7 +106,7 @@ class BaseModelTest(BaseTest):
         # Delete the object
         obj.delete()
 
-        self.assertEqual(self.mock_save.call_count, 3)
+        self.assertEqual(self.mock_bulk.call_count, 3)
 
         # Check for log entries
         self.assertEqual(log_entry.action, LogEntry.Action.DELETE, msg="There is one log entry for 'DELETE'")
@@ -99,7 +132,7 @@ class HashIdModelTest(BaseModelTest, TransactionTestCase):
         self.obj = HashIdModel.objects.create(text='I am not difficult.')
 
     def test_create(self):
-        self.assertEqual(self.mock_save.call_count, 1)
+        self.assertEqual(self.mock_bulk.call_count, 1)
         log_entry = log_create(self.sender, self.obj, True)
         self.assertEqual(log_entry.object_pk, str(self.obj.pk))
         self.assertEqual(log_entry.object_id, self.obj.pk.id)
@@ -138,62 +171,79 @@ class ManyRelatedModelTest(BaseTest, TransactionTestCase):
         self.obj.related.add(self.rel_obj)
 
     def test_related(self):
-        self.assertEqual(self.mock_save.call_count, 2)
+        self.assertEqual(self.mock_bulk.call_count, 2)
 
 
 class MiddlewareTest(TestCase):
     """
-    Test the middleware responsible for connecting and disconnecting the signals used in automatic logging.
+    Test the middleware responsible for setting the audit context used in automatic logging.
     """
 
     def setUp(self):
-        self.middleware = AuditlogMiddleware()
         self.factory = RequestFactory()
         self.user = User.objects.create_user(username='test', email='test@example.com', password='top_secret')
 
+    def get_log_entry(self, request):
+        """Create a log entry while the middleware handles the request."""
+        def get_response(request):
+            return LogEntry.log_create(SimpleModel(id=1, text='I am not difficult.'), changes=[])
+
+        return AuditlogMiddleware(get_response)(request)
+
     def test_request(self):
         """The actor will be logged."""
         # Create a request
-        request = self.factory.get('/')
+        request = self.factory.get('/', REMOTE_ADDR='127.0.0.1')
         request.user = self.user
-        # Run middleware
-        self.middleware.process_request(request)
 
         # Validate result
-        self.assertTrue(log_created.has_listeners(LogEntry))
+        log_entry = self.get_log_entry(request)
+        self.assertEqual(log_entry.actor_id, self.user.pk)
+        self.assertEqual(log_entry.actor_email, 'test@example.com')
+        self.assertEqual(log_entry.remote_addr, '127.0.0.1')
+        self.assertFalse(log_created.has_listeners(LogEntry))
 
-        # Finalize transaction
-        self.middleware.process_exception(request, None)
+    def test_anonymous(self):
+        """Only the remote address is logged for an anonymous user."""
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='10.0.0.1, 127.0.0.1')
+        request.user = AnonymousUser()
+
+        log_entry = self.get_log_entry(request)
+        self.assertIsNone(log_entry.actor_id)
+        self.assertEqual(log_entry.remote_addr, '10.0.0.1')
 
     def test_response(self):
-        """The signal will be disconnected when the request is processed."""
-        # Create a request
+        """The context will be reset when the request is processed."""
         request = self.factory.get('/')
         request.user = self.user
-
-        # Run middleware
-        self.middleware.process_request(request)
-        self.assertTrue(
-            log_created.has_listeners(LogEntry))  # The signal should be present before trying to disconnect it.
-        self.middleware.process_response(request, HttpResponse())
+        self.get_log_entry(request)
 
         # Validate result
-        self.assertFalse(log_created.has_listeners(LogEntry))
+        log_entry = LogEntry.log_create(SimpleModel(id=1, text='I am not difficult.'), changes=[])
+        self.assertIsNone(log_entry.actor_id)
+        self.assertIsNone(log_entry.remote_addr)
 
     def test_exception(self):
-        """The signal will be disconnected when an exception is raised."""
-        # Create a request
+        """The context will be reset when an exception is raised."""
+        def get_response(request):
+            raise ValidationError("Test")
+
         request = self.factory.get('/')
         request.user = self.user
-
-        # Run middleware
-        self.middleware.process_request(request)
-        self.assertTrue(
-            log_created.has_listeners(LogEntry))  # The signal should be present before trying to disconnect it.
-        self.middleware.process_exception(request, ValidationError("Test"))
+        with self.assertRaises(ValidationError):
+            AuditlogMiddleware(get_response)(request)
 
         # Validate result
-        self.assertFalse(log_created.has_listeners(LogEntry))
+        self.assertIsNone(auditlog_context.get())
+
+    def test_explicit_actor(self):
+        """An actor that is set explicitly is kept."""
+        other = User.objects.create_user(username='other', email='other@example.com', password='top_secret')
+        with set_actor(self.user, remote_addr='127.0.0.1'):
+            log_entry = LogEntry.log_create(SimpleModel(id=1), changes=[], actor_id=other.pk)
+        self.assertEqual(log_entry.actor_id, other.pk)
+        self.assertIsNone(log_entry.actor_email)
+        self.assertEqual(log_entry.remote_addr, '127.0.0.1')
 
 
 class SimpeIncludeModelTest(BaseTest, TransactionTestCase):
@@ -202,17 +252,17 @@ class SimpeIncludeModelTest(BaseTest, TransactionTestCase):
     def test_register_include_fields(self):
         sim = SimpleIncludeModel(label='Include model', text='Looong text')
         sim.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change label, record
         sim.label = 'Changed label'
         sim.save()
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
         # Change text, ignore
         sim.text = 'Short text'
         sim.save()
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
 
 class SimpeExcludeModelTest(BaseTest, TransactionTestCase):
@@ -221,17 +271,17 @@ class SimpeExcludeModelTest(BaseTest, TransactionTestCase):
     def test_register_exclude_fields(self):
         sem = SimpleExcludeModel(label='Exclude model', text='Looong text')
         sem.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change label, ignore
         sem.label = 'Changed label'
         sem.save()
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
         # Change text, record
         sem.text = 'Short text'
         sem.save()
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
 
 class SimpleMappingModelTest(BaseTest, TransactionTestCase):
@@ -268,7 +318,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to same datetime and timezone
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -278,7 +328,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # Nothing should have changed
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
     def test_model_with_different_timezone(self):
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -287,7 +337,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to same datetime in another timezone
         timestamp = datetime.datetime(2017, 1, 10, 13, 0, tzinfo=self.utc_plus_one)
@@ -295,7 +345,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # Nothing should have changed
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
     def test_model_with_different_datetime(self):
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -304,7 +354,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to another datetime in the same timezone
         timestamp = datetime.datetime(2017, 1, 10, 13, 0, tzinfo=timezone.utc)
@@ -312,7 +362,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # The time should have changed.
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
     def test_model_with_different_date(self):
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -321,7 +371,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to another datetime in the same timezone
         date = datetime.datetime(2017, 1, 11)
@@ -329,7 +379,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # The time should have changed.
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
     def test_model_with_different_time(self):
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -338,7 +388,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to another datetime in the same timezone
         time = datetime.time(6, 0)
@@ -346,7 +396,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # The time should have changed.
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
     def test_model_with_different_time_and_timezone(self):
         timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
@@ -355,7 +405,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm = DateTimeFieldModel(label='DateTimeField model', timestamp=timestamp, date=date, time=time,
                                  naive_dt=self.now)
         dtm.save()
-        self.assertTrue(self.mock_save.call_count == 1, msg="There is one log entry")
+        self.assertTrue(self.mock_bulk.call_count == 1, msg="There is one log entry")
 
         # Change timestamp to another datetime and another timezone
         timestamp = datetime.datetime(2017, 1, 10, 14, 0, tzinfo=self.utc_plus_one)
@@ -363,7 +413,7 @@ class DateTimeFieldModelTest(BaseTest, TransactionTestCase):
         dtm.save()
 
         # The time should have changed.
-        self.assertTrue(self.mock_save.call_count == 2, msg="There are two log entries")
+        self.assertTrue(self.mock_bulk.call_count == 2, msg="There are two log entries")
 
     def test_update_naive_dt(self):
         timestamp = datetime.datetime(2017, 1, 10, 15, 0, tzinfo=timezone.utc)
@@ -418,11 +468,12 @@ class UnregisterTest(BaseTest, TransactionTestCase):
         obj.delete()
 
         # Check for log entries
-        self.assertTrue(self.mock_save.call_count == 0, msg="There are no log entries")
+        self.assertTrue(self.mock_bulk.call_count == 0, msg="There are no log entries")
 
 
 @mock.patch('auditlog.documents.LogEntry.get')
 @mock.patch('auditlog.documents.LogEntry.search')
+@mock.patch('auditlog.documents.LogEntry.msearch')
 class AdminPanelTest(BaseTest, TransactionTestCase):
 
     def setUp(self):
@@ -437,7 +488,7 @@ class AdminPanelTest(BaseTest, TransactionTestCase):
         self.user.save()
         self.obj = SimpleModel.objects.create(text='For admin logentry test')
 
-    def test_auditlog_admin(self, search_mock, get_mock):
+    def test_auditlog_admin(self, msearch_mock, search_mock, get_mock):
         get_mock.return_value = log_create(LogEntry, self.obj, True)
         self.client.login(username=self.username, password=self.password)
         res = self.client.get("/admin/auditlog/logmodel/")
@@ -445,24 +496,1512 @@ class AdminPanelTest(BaseTest, TransactionTestCase):
         res = self.client.get("/admin/auditlog/logmodel/{}/".format('123'), follow=True)
         self.assertEqual(res.status_code, 200)
 
+    def test_auditlog_history(self, msearch_mock, search_mock, get_mock):
+        """The history of an object is paged through, newest first, by staff only."""
+        es = MagicMock()
+        es.search.return_value = {'hits': {'total': {'value': 3, 'relation': 'eq'}, 'hits': [
+            {'_index': 'test-logs', '_id': str(i), 'sort': [1000 - i, str(i)], '_source': {
+                'action': 'update', 'timestamp': '2021-01-01T12:00:00+00:00', 'object_pk': str(self.obj.pk)}}
+            for i in range(3)
+        ]}}
+        search_mock.return_value = LogEntry._index.search(using=es)
+        url = '/admin/auditlog_tests/simplemodel/%d/auditlog-history/' % self.obj.pk
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.login(username=self.username, password=self.password)
+        with mock.patch('auditlog.mixins.AuditlogAdminHistoryMixin.history_list_per_page', 2):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(es.search.call_args[1]['body']['size'], 3)
+        self.assertEqual([entry.meta.id for entry in res.context['log_entry_list']], ['0', '1'])
+        self.assertEqual(res.context['next_url'], '?after=' + encode_cursor([999, '1']))
+        self.assertIsNone(res.context['previous_url'])
+
+
+class CursorPaginatorTest(TestCase):
+    """The admin pages through log entries with search_after instead of offsets"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.search.return_value = {'hits': {'total': {'value': 10000, 'relation': 'gte'}, 'hits': [
+            {'_index': 'test-logs', '_id': str(i), '_source': {'action': 'create'}, 'sort': [1000 - i, str(i)]}
+            for i in range(3)
+        ]}}
+        self.client.msearch.return_value = {'responses': [
+            self.client.search.return_value,
+            {'hits': {'total': {'value': 12, 'relation': 'eq'}, 'hits': []}},
+            {'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}, 'aggregations': {'facet': {'buckets': [
+                {'key': 'create', 'doc_count': 9}, {'key': 'update', 'doc_count': 3},
+            ]}}},
+            {'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}, 'aggregations': {'facet': {'buckets': [
+                {'key': '7', 'doc_count': 3, 'label': {'buckets': [{'key': 'user', 'doc_count': 3}]}},
+            ]}}},
+        ]}
+        self.paginator = CursorPaginator(LogEntry.search(using=self.client), 2)
+        cache.clear()
+
+    def test_first_page(self):
+        page = self.paginator.page()
+        body = self.client.search.call_args[1]['body']
+        self.assertEqual(body['sort'], [{'timestamp': 'desc'}, {'_id': 'desc'}])
+        self.assertEqual(body['size'], 3)
+        self.assertEqual(body['track_total_hits'], 10000)
+        self.assertNotIn('search_after', body)
+        self.assertEqual([hit.meta.id for hit in page.object_list], ['0', '1'])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertFalse(page.total_exact)
+        self.assertEqual(decode_cursor(page.next_cursor), [999, '1'])
+
+    def test_previous_page(self):
+        page = self.paginator.page(before=[990, '10'])
+        body = self.client.search.call_args[1]['body']
+        # The previous page is the next page in the opposite direction.
+        self.assertEqual(body['sort'], [{'timestamp': 'asc'}, {'_id': 'asc'}])
+        self.assertEqual(body['search_after'], [990, '10'])
+        self.assertEqual([hit.meta.id for hit in page.object_list], ['1', '0'])
+        self.assertTrue(page.has_next)
+        self.assertTrue(page.has_previous)
+
+    def get_changelist(self, params):
+        request = RequestFactory().get('/admin/auditlog/logmodel/', params)
+        with mock.patch('auditlog.documents.LogEntry.search', return_value=LogEntry.search(using=self.client)):
+            changelist = CustomChangeList(admin.site._registry[LogModel], request,
+                                          list_filter=[ActionChoiceFilter, ContentTypeChoiceFilter])
+            changelist.get_results()
+        return changelist
+
+    def test_changelist(self):
+        changelist = self.get_changelist({'action': 'create', 'after': encode_cursor([1, '1'])})
+        # The page, the count without filters and the facets take a single request.
+        self.client.search.assert_not_called()
+        body = self.client.msearch.call_args[1]['body']
+        self.assertEqual(len(body), 8)
+        self.assertEqual(body[1]['search_after'], [1, '1'])
+        self.assertEqual(body[1]['query'], {'bool': {'filter': [{'term': {'action': 'create'}}]}})
+        self.assertEqual(body[3], {'size': 0, 'track_total_hits': 10000})
+        self.assertEqual(changelist.full_result_count, 12)
+        # The facets of a filter count the log entries matching the other filters.
+        self.assertNotIn('query', body[5])
+        self.assertFalse(body[5]['track_total_hits'])
+        self.assertEqual(body[7]['query'], body[1]['query'])
+        self.assertEqual(changelist.filter_specs[0].form.fields['action'].choices,
+                         [('create', 'create (9)'), ('update', 'update (3)')])
+        self.assertEqual(changelist.filter_specs[1].form.fields['content_type_id'].choices, [('7', 'user (3)')])
+
+        self.assertEqual(changelist.next_url, '?' + urlencode({'action': 'create', 'after': encode_cursor([998, '2'])}))
+        self.assertEqual(changelist.first_url, '?action=create')
+        self.assertEqual(changelist.last_url, '?action=create&last=1')
+
+    def test_invalid_cursor(self):
+        for cursor in ('', 'x', encode_cursor([1]), encode_cursor(['1', '1']), encode_cursor([1, 1]),
+                       encode_cursor({'a': 1}), encode_cursor([True, '1'])):
+            with self.assertRaises(IncorrectLookupParameters):
+                decode_cursor(cursor)
+
+        # The changelist falls back to the first page with the same filters.
+        request = RequestFactory().get('/admin/auditlog/logmodel/', {'action': 'create', 'after': 'x'})
+        response = admin.site._registry[LogModel].list_view(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/admin/auditlog/logmodel/?action=create')
+        self.client.msearch.assert_not_called()
+
+    def test_lean_rows(self):
+        responses = self.client.msearch.return_value['responses']
+        # Without active filters there is no count without filters.
+        del responses[1]
+        responses[0] = {'hits': {'total': {'value': 1, 'relation': 'eq'}, 'hits': [
+            {'_index': 'test-logs', '_id': '1', 'sort': [1, '1'], '_source': {
+                'action': 'update', 'timestamp': '2021-01-01T12:00:00+00:00', 'actor_email': 'jane@example.com',
+                'changes': [{'field': 'text'}, {'field': 'integer'}],
+            }},
+        ]}}
+        with mock.patch('auditlog.documents.LogEntry.from_es') as from_es:
+            changelist = self.get_changelist({})
+        from_es.assert_not_called()
+        # Only the displayed fields are fetched.
+        self.assertIn('changes.field', self.client.msearch.call_args[1]['body'][1]['_source'])
+        row = changelist.result_list[0]
+        self.assertEqual(row.meta.id, '1')
+        self.assertEqual(row.timestamp, datetime.datetime(2021, 1, 1, 12, tzinfo=datetime.timezone.utc))
+        self.assertEqual(row.actor, 'jane@example.com')
+        self.assertEqual(row.changed_fields, '2 changes: text, integer')
+
+    def test_row_without_changes(self):
+        row = HitRow({'_id': '1', '_source': {'action': 'update'}})
+        self.assertEqual(row.changes, [])
+        self.assertEqual(row.changed_fields, '0 changes: ')
+
+    def test_facet_cache(self):
+        self.get_changelist({'action': 'create'})
+        self.client.msearch.return_value = {'responses': self.client.msearch.return_value['responses'][:2]}
+        changelist = self.get_changelist({'action': 'create', 'after': encode_cursor([1, '1'])})
+        # The facets come from the cache on the next page.
+        self.assertEqual(len(self.client.msearch.call_args[1]['body']), 4)
+        self.assertEqual(changelist.filter_specs[1].form.fields['content_type_id'].choices, [('7', 'user (3)')])
+
+
+class SubstringSearchTest(TestCase):
+    """The admin searches substrings through wildcard subfields instead of leading wildcard queries"""
+
+    def test_mapping(self):
+        properties = LogEntry._doc_type.mapping.to_dict()['properties']
+        for field in ('object_repr', 'actor_email', 'actor_first_name', 'actor_last_name'):
+            self.assertEqual(properties[field]['fields'], {'wildcard': {'type': 'wildcard'}})
+
+    def test_contains(self):
+        self.assertEqual(contains('object_repr', 'a*b').to_dict(),
+                         {'wildcard': {'object_repr.wildcard': {'value': '*a\\*b*', 'case_insensitive': True}}})
+        self.assertEqual(contains('action', 'create').to_dict(), {'match': {'action': 'create'}})
+
+    def test_filter(self):
+        request = RequestFactory().get('/admin/auditlog/logmodel/', {'actor': 'Jane'})
+        model_admin = admin.site._registry[LogModel]
+        query = ActorInputFilter(request, dict(request.GET.items()), LogModel, model_admin).queryset(
+            request, LogEntry.search()).to_dict()['query']
+        self.assertNotIn('query_string', str(query))
+        self.assertIn({'wildcard': {'actor_email.wildcard': {'value': '*Jane*', 'case_insensitive': True}}},
+                      query['bool']['filter'][0]['bool']['should'])
+
+    def test_changes_filter(self):
+        changes = LogEntry._doc_type.mapping.to_dict()['properties']['changes']['properties']
+        self.assertEqual(changes['new']['fields'], {'keyword': {'type': 'keyword', 'ignore_above': 256}})
+        request = RequestFactory().get('/admin/auditlog/logmodel/', {'field': 'name', 'old': 'Jane Doe', 'new': 'J*'})
+        model_admin = admin.site._registry[LogModel]
+        query = ChangesFilter(request, dict(request.GET.items()), LogModel, model_admin).queryset(
+            request, LogEntry.search()).to_dict()['query']
+        # The field and the values are matched by the same change, in filter context.
+        self.assertEqual(query['bool']['filter'], [{'nested': {'path': 'changes', 'query': {'bool': {'filter': [
+            {'term': {'changes.field': 'name'}},
+            {'term': {'changes.old.keyword': {'value': 'Jane Doe', 'case_insensitive': True}}},
+            {'prefix': {'changes.new.keyword': {'value': 'J', 'case_insensitive': True}}},
+        ]}}}}])
+        # Values too long for the keyword subfield are matched as a phrase.
+        query = LogEntry.objects.changed('text', new='x' * 300).search.to_dict()['query']
+        self.assertIn({'match_phrase': {'changes.new': 'x' * 300}},
+                      query['bool']['filter'][0]['nested']['query']['bool']['filter'])
+
+    def test_update_mapping(self):
+        client = MagicMock()
+        client.update_by_query.return_value = {'task': 'node:2'}
+        client.tasks.get.return_value = {'completed': True, 'response': {'total': 5, 'updated': 5}}
+        out = StringIO()
+        with mock.patch('auditlog.management.commands.update_logs_mapping.get_client', return_value=client):
+            call_command('update_logs_mapping', stdout=out)
+        body = client.indices.put_mapping.call_args[1]['body']
+        self.assertEqual(body['properties']['object_repr']['fields']['wildcard'], {'type': 'wildcard'})
+        self.assertIn('keyword', body['properties']['changes']['properties']['old']['fields'])
+        self.assertFalse(client.update_by_query.call_args[1]['wait_for_completion'])
+        self.assertIn('Updated 5 log entries.', out.getvalue())
+
+
+class LogEntryQuerySetTest(TestCase):
+    """LogEntry.objects builds lazy searches in filter context"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.mocked_client = mock.patch('auditlog.documents.get_client', return_value=self.client)
+        self.mocked_client.start()
+
+    def tearDown(self):
+        self.mocked_client.stop()
+
+    def hits(self, *ids):
+        return {'hits': {'total': {'value': len(ids), 'relation': 'eq'}, 'hits': [
+            {'_index': 'test-logs', '_id': str(i), '_source': {'action': 'update'}, 'sort': [i, str(i)]} for i in ids
+        ]}}
+
+    def test_filters(self):
+        user = User(pk=3)
+        since = timezone.now()
+        query = LogEntry.objects.for_object(SimpleModel(pk=1)).by_actor(user).since(since).actions('update') \
+            .changed('text').search.to_dict()['query']
+        self.assertEqual(list(query['bool']), ['filter'])
+        filters = query['bool']['filter']
+        self.assertIn({'term': {'content_type_model': 'simplemodel'}}, filters)
+        self.assertIn({'bool': {'should': [{'term': {'object_pk': '1'}}, {'term': {'object_id': 1}}]}}, filters)
+        self.assertIn({'term': {'actor_id': '3'}}, filters)
+        self.assertIn({'range': {'timestamp': {'gte': since.isoformat()}}}, filters)
+        self.assertIn({'terms': {'action': ['update']}}, filters)
+        self.client.search.assert_not_called()
+
+    def test_iteration(self):
+        self.client.search.side_effect = [self.hits(1, 2), self.hits(3)]
+        entries = list(LogEntry.objects.actions('update').order_by('-timestamp').iterator(chunk_size=2))
+        self.assertEqual([entry.meta.id for entry in entries], ['1', '2', '3'])
+        body = self.client.search.call_args[1]['body']
+        self.assertEqual(body['sort'], [{'timestamp': {'order': 'desc'}}, {'_id': 'asc'}])
+        self.assertEqual(body['search_after'], [2, '2'])
+
+    def test_for_objects(self):
+        objects = [SimpleModel.objects.create(text=str(i)) for i in range(5)]
+        with self.assertNumQueries(1):
+            query = LogEntry.objects.get_for_objects(SimpleModel.objects.order_by('pk'), chunk_size=2) \
+                .search.to_dict()['query']
+        should = query['bool']['filter'][2]['bool']['should']
+        self.assertEqual(should, [{'terms': {'object_pk': [str(obj.pk) for obj in objects[i:i + 2]]}}
+                                  for i in range(0, 5, 2)])
+        self.assertEqual(LogEntry.objects.for_objects([]).search.to_dict()['query'],
+                         {'bool': {'filter': [{'match_none': {}}]}})
+        with self.assertRaises(ValueError):
+            LogEntry.objects.for_objects(objects, chunk_size=2, max_chunks=2)
+
+    def test_iter_for_objects(self):
+        objects = [SimpleModel(pk=i) for i in range(1, 4)]
+        self.client.search.side_effect = [self.hits(1), self.hits(3)]
+        entries = list(LogEntry.objects.actions('update').iter_for_objects(objects, chunk_size=2))
+        self.assertEqual([entry.meta.id for entry in entries], ['1', '3'])
+        # One search per chunk of objects.
+        self.assertEqual(self.client.search.call_count, 2)
+        query = self.client.search.call_args[1]['body']['query']
+        self.assertIn({'terms': {'object_pk': ['3']}}, query['bool']['filter'])
+
+    def test_latest_for_objects(self):
+        objects = [SimpleModel(pk=i) for i in range(1, 4)]
+        self.client.msearch.side_effect = [
+            {'responses': [self.hits(1), self.hits(2)]},
+            {'responses': [self.hits()]},
+        ]
+        latest = LogEntry.objects.actions('update').latest_for_objects(objects, n=2, batch_size=2)
+        self.assertEqual({pk: [entry.meta.id for entry in entries] for pk, entries in latest.items()},
+                         {'1': ['1'], '2': ['2'], '3': []})
+        # One _msearch request per batch of objects.
+        self.assertEqual(self.client.msearch.call_count, 2)
+        body = self.client.msearch.call_args_list[0][1]['body']
+        self.assertEqual(body[1]['size'], 2)
+        self.assertIn({'term': {'object_pk': '1'}}, body[1]['query']['bool']['filter'])
+
+    def test_slicing_and_count(self):
+        self.client.search.return_value = self.hits(1)
+        self.client.count.return_value = {'count': 42}
+        entries = LogEntry.objects.all()[5:6]
+        self.assertEqual([entry.meta.id for entry in entries], ['1'])
+        self.assertEqual(self.client.search.call_args[1]['body']['from'], 5)
+        self.assertEqual(LogEntry.objects.actions('create').count(), 42)
+
+
+class AnalyticsTest(TestCase):
+    """Aggregations over the log entries, for the dashboard and reports"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.mocked_client = mock.patch('auditlog.documents.get_client', return_value=self.client)
+        self.mocked_client.start()
+        cache.clear()
+
+    def tearDown(self):
+        self.mocked_client.stop()
+
+    def aggregations(self, **aggregations):
+        return {'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}, 'aggregations': aggregations}
+
+    def summary(self):
+        return self.aggregations(
+            histogram={'buckets': [{'key': 1609459200000, 'doc_count': 3, 'app_labels': {'buckets': [
+                {'key': 'auth', 'doc_count': 3, 'models': {'buckets': [
+                    {'key': 'user', 'doc_count': 3, 'actions': {'buckets': [
+                        {'key': 'update', 'doc_count': 2}, {'key': 'create', 'doc_count': 1},
+                    ]}},
+                ]}},
+            ]}}]},
+            actors={'buckets': [{'key': '7', 'doc_count': 3, 'emails': {'buckets': [
+                {'key': 'a@b.c', 'doc_count': 3}]}}]},
+            content_types={'buckets': [
+                {'key': '4', 'doc_count': 3, 'app_labels': {'buckets': [{'key': 'auth', 'doc_count': 3}]},
+                 'models': {'buckets': [{'key': 'user', 'doc_count': 3}]}},
+                {'key': '9', 'doc_count': 1, 'app_labels': {'buckets': [{'key': 'accounts', 'doc_count': 1}]},
+                 'models': {'buckets': [{'key': 'user', 'doc_count': 1}]}},
+            ]},
+            changes={'doc_count': 4, 'fields': {'buckets': [
+                {'key': 'email', 'doc_count': 3, 'entries': {'doc_count': 2}}]}},
+        )
+
+    def test_summary(self):
+        self.client.search.return_value = self.summary()
+        summary = analytics.summary(LogEntry.objects.actions('update'), interval='day')
+        body = self.client.search.call_args[1]['body']
+        # All aggregations take a single request that fetches no hits.
+        self.client.search.assert_called_once()
+        self.assertEqual(body['size'], 0)
+        self.assertFalse(body['track_total_hits'])
+        self.assertEqual(body['query'], {'bool': {'filter': [{'terms': {'action': ['update']}}]}})
+        self.assertEqual(body['aggs']['histogram']['date_histogram'],
+                         {'field': 'timestamp', 'calendar_interval': 'day'})
+        self.assertEqual(body['aggs']['changes']['nested'], {'path': 'changes'})
+        self.assertEqual(summary['histogram'], [{
+            'date': datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc), 'count': 3, 'breakdown': [
+                {'content_type': 'auth.user', 'action': 'update', 'count': 2},
+                {'content_type': 'auth.user', 'action': 'create', 'count': 1},
+            ]}])
+        self.assertEqual(summary['actors'], [{'actor_id': '7', 'actor_email': 'a@b.c', 'count': 3}])
+        # Models with the same name in different apps are counted separately.
+        self.assertEqual(body['aggs']['content_types']['terms'], {'field': 'content_type_id', 'size': 10})
+        self.assertEqual(summary['models'], [{'content_type_id': '4', 'content_type': 'auth.user', 'count': 3},
+                                             {'content_type_id': '9', 'content_type': 'accounts.user', 'count': 1}])
+        self.assertEqual(summary['fields'], [{'field': 'email', 'entries': 2}])
+        with self.assertRaises(ValueError):
+            analytics.activity_histogram(interval='fortnight')
+
+    def test_breakdown(self):
+        self.client.search.side_effect = [
+            self.aggregations(breakdown={'after_key': {'actor_id': '2', 'action': 'update'}, 'buckets': [
+                {'key': {'actor_id': '1', 'action': 'create'}, 'doc_count': 5},
+                {'key': {'actor_id': '2', 'action': 'update'}, 'doc_count': 1},
+            ]}),
+            self.aggregations(breakdown={'buckets': [{'key': {'actor_id': '3', 'action': 'delete'}, 'doc_count': 2}]}),
+        ]
+        breakdown = list(analytics.iter_breakdown(['actor_id', 'action'], size=2))
+        self.assertEqual(breakdown, [
+            {'actor_id': '1', 'action': 'create', 'count': 5},
+            {'actor_id': '2', 'action': 'update', 'count': 1},
+            {'actor_id': '3', 'action': 'delete', 'count': 2},
+        ])
+        first, second = [call[1]['body']['aggs']['breakdown']['composite']
+                         for call in self.client.search.call_args_list]
+        self.assertNotIn('after', first)
+        self.assertEqual(second['after'], {'actor_id': '2', 'action': 'update'})
+        self.assertEqual(second['sources'], [{'actor_id': {'terms': {'field': 'actor_id'}}},
+                                             {'action': {'terms': {'field': 'action'}}}])
+
+    def test_dashboard(self):
+        self.client.search.return_value = self.summary()
+        model_admin = admin.site._registry[LogModel]
+        for i in range(2):
+            request = RequestFactory().get('/admin/auditlog/logmodel/dashboard/', {'days': '7'})
+            request.user = User(is_staff=True, is_superuser=True)
+            response = model_admin.dashboard_view(request)
+            self.assertContains(response, 'a@b.c')
+            self.assertContains(response, 'auth.user update: 2')
+            self.assertContains(response, 'accounts.user')
+        # The aggregations are cached for a short while.
+        self.client.search.assert_called_once()
+        query = self.client.search.call_args[1]['body']['query']
+        self.assertIn('gte', query['bool']['filter'][0]['range']['timestamp'])
+
+    def test_dashboard_permissions(self):
+        response = Client().get('/admin/auditlog/logmodel/dashboard/')
+        self.assertEqual(response.status_code, 302)
+
+        request = RequestFactory().get('/admin/auditlog/logmodel/dashboard/')
+        request.user = User.objects.create_user(username='staff', is_staff=True)
+        with self.assertRaises(PermissionDenied):
+            admin.site._registry[LogModel].dashboard_view(request)
+        self.client.search.assert_not_called()
+
+
+class ReconstructionTest(TestCase):
+    """The state of an object at a point in time is replayed from its log entries and checkpoints"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.mocked_clients = [mock.patch(target, return_value=self.client) for target in
+                               ('auditlog.documents.get_client', 'auditlog.reconstruction.get_client')]
+        for mocked_client in self.mocked_clients:
+            mocked_client.start()
+
+    def tearDown(self):
+        for mocked_client in self.mocked_clients:
+            mocked_client.stop()
+
+    def hits(self, *hits):
+        return {'hits': {'total': {'value': len(hits), 'relation': 'eq'}, 'hits': list(hits)}}
+
+    def entry(self, i, action, **changes):
+        return {'_index': 'test-logs', '_id': 'e%d' % i, 'sort': [i, 'e%d' % i], '_source': {
+            'action': action, 'timestamp': '2021-01-0%dT00:00:00+00:00' % i,
+            'changes': [{'field': field, 'old': None, 'new': new} for field, new in changes.items()],
+        }}
+
+    def test_replay(self):
+        self.client.search.side_effect = [
+            self.hits(),
+            self.hits(self.entry(1, 'create', id='1', text='a', boolean='False'), self.entry(2, 'update', text='b'),
+                      self.entry(3, 'update', boolean='True')),
+        ]
+        at = datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc)
+        with mock.patch('auditlog.reconstruction.bulk') as bulk:
+            state = reconstruction.reconstruct(SimpleModel, 1, at, checkpoint_interval=2)
+            actions = list(bulk.call_args[0][1])
+        self.assertEqual(state, {'id': '1', 'text': 'b', 'boolean': 'True'})
+
+        body = self.client.search.call_args[1]['body']
+        self.assertEqual(body['sort'], ['timestamp', {'_id': 'asc'}])
+        self.assertIn({'range': {'timestamp': {'lte': at.isoformat()}}}, body['query']['bool']['filter'])
+        # A checkpoint is saved after the second log entry.
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(actions[0]['_index'], 'test-logs_checkpoints')
+        checkpoint = actions[0]['_source']
+        self.assertEqual(checkpoint['state'], {'id': '1', 'text': 'b', 'boolean': 'False'})
+        self.assertEqual((checkpoint['sort_timestamp'], checkpoint['entry_id'], checkpoint['entries']), (2, 'e2', 2))
+
+    def test_resume_from_checkpoint(self):
+        self.client.search.side_effect = [
+            self.hits({'_index': 'test-logs_checkpoints', '_id': 'c', '_source': {
+                'entries': 2, 'exists': True, 'state': {'text': 'b'}, 'sort_timestamp': 2, 'entry_id': 'e2'}}),
+            self.hits(self.entry(3, 'update', text='c')),
+        ]
+        self.assertEqual(reconstruction.reconstruct(SimpleModel, 1), {'text': 'c'})
+        self.assertEqual(self.client.search.call_args[1]['body']['search_after'], [2, 'e2'])
+        self.client.bulk.assert_not_called()
+
+    def test_deleted(self):
+        self.client.search.side_effect = lambda **kwargs: (
+            self.hits() if kwargs['index'] == ['test-logs_checkpoints'] else
+            self.hits(self.entry(1, 'create', text='a'), self.entry(2, 'delete', text='a')))
+        self.assertEqual(reconstruction.reconstruct_many(SimpleModel, [1, 2], workers=2), {'1': None, '2': None})
+
+
+class ReindexTest(TestCase):
+    """The reindex_logs command copies the log entries to a new index and swaps the alias without downtime"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.indices.exists_alias.return_value = False
+        self.client.indices.exists.return_value = True
+        self.client.indices.get.return_value = {}
+        self.client.indices.get_settings.side_effect = lambda index: {index: {'settings': {'index': {
+            'number_of_shards': '2', 'number_of_replicas': '1'}}}}
+        self.client.reindex.return_value = {'task': 'node:3'}
+        # The log entries per index, the reindex tasks add the log entries they create to their target.
+        self.counts = {'test-logs': 6}
+        self.created = []
+        self.client.count.side_effect = lambda index: {'count': self.counts.get(index, 0)}
+        self.client.tasks.get.side_effect = self.get_task
+        self.mocked_client = mock.patch('auditlog.management.commands.reindex_logs.get_client',
+                                        return_value=self.client)
+        self.mocked_client.start()
+
+    def tearDown(self):
+        self.mocked_client.stop()
+
+    def get_task(self, task_id):
+        created = self.created.pop(0)
+        target = self.client.reindex.call_args[1]['body']['dest']['index']
+        self.counts[target] = self.counts.get(target, 0) + created
+        return {'completed': True, 'response': {'total': created, 'created': created}}
+
+    @override_settings(AUDITLOG_SPOOL={'ENABLED': True})
+    def test_replace_index(self):
+        with self.assertRaises(CommandError):
+            call_command('reindex_logs', stdout=StringIO())
+        self.client.indices.create.assert_not_called()
+
+        # A full copy and a catch-up with the log entry written meanwhile.
+        self.created = [5, 1]
+        call_command('reindex_logs', '--delete-old', stdout=StringIO())
+        create = self.client.indices.create.call_args[1]
+        self.assertEqual(create['index'], 'test-logs_v1')
+        self.assertEqual(create['body']['settings'], {'number_of_shards': '2', 'number_of_replicas': 0,
+                                                      'refresh_interval': '-1'})
+        self.assertEqual(self.client.reindex.call_count, 2)
+        self.assertNotIn('query', self.client.reindex.call_args_list[0][1]['body']['source'])
+        self.assertIn('range', self.client.reindex.call_args[1]['body']['source']['query'])
+        self.assertEqual(self.client.reindex.call_args[1]['body']['dest']['op_type'], 'create')
+        self.assertFalse(self.client.reindex.call_args[1]['wait_for_completion'])
+        # The index is deleted by the swap, so it is blocked while the counts are compared a last time.
+        self.client.indices.put_settings.assert_any_call(index='test-logs', body={'index.blocks.write': True})
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove_index': {'index': 'test-logs'}},
+            {'add': {'index': 'test-logs_v1', 'alias': 'test-logs'}},
+        ]})
+
+    def test_replace_index_requires_spool(self):
+        # Log entries written while the index is blocked would be lost.
+        with self.assertRaisesMessage(CommandError, "enable the spool"):
+            call_command('reindex_logs', '--delete-old', stdout=StringIO())
+        self.client.indices.create.assert_not_called()
+
+    @override_settings(AUDITLOG_SPOOL={'ENABLED': True})
+    def test_replace_index_late_entries(self):
+        """All log entries are compared before writes are blocked, only the recent ones while they are."""
+        blocked_after = []
+        self.client.indices.put_settings.side_effect = lambda index, body: blocked_after.append(
+            self.client.reindex.call_count) if body == {'index.blocks.write': True} else None
+        # A full copy, a catch-up that finds nothing, and a copy of all missing log entries.
+        self.created = [5, 0, 1]
+        call_command('reindex_logs', '--delete-old', stdout=StringIO())
+        self.assertEqual(blocked_after, [3])
+        self.assertNotIn('query', self.client.reindex.call_args[1]['body']['source'])
+        self.assertEqual(self.client.reindex.call_args[1]['body']['dest']['op_type'], 'create')
+        self.client.indices.update_aliases.assert_called_once()
+
+    @override_settings(AUDITLOG_SPOOL={'ENABLED': True})
+    def test_replace_index_failure(self):
+        # While writes are blocked, only the recent log entries are copied again.
+        self.created = [5, 0, 0, 0]
+        with self.assertRaisesMessage(CommandError, '1 log entries of test-logs are missing from test-logs_v1'):
+            call_command('reindex_logs', '--delete-old', stdout=StringIO())
+        self.assertEqual(self.client.reindex.call_count, 4)
+        self.assertIn('range', self.client.reindex.call_args[1]['body']['source']['query'])
+        self.client.indices.put_settings.assert_called_with(index='test-logs', body={'index.blocks.write': None})
+        self.client.indices.update_aliases.assert_not_called()
+
+    def use_alias(self):
+        self.client.indices.exists_alias.return_value = True
+        self.client.indices.get_alias.return_value = {'test-logs_v1': {'aliases': {'test-logs': {}}}}
+        self.client.indices.get.return_value = {'test-logs_v1': {}, 'test-logs_checkpoints': {}}
+        self.counts = {'test-logs_v1': 6}
+
+    def test_late_entries(self):
+        """Log entries indexed late, with an older timestamp, are found by counting after the swap."""
+        self.use_alias()
+        self.created = [5, 0, 0, 1]
+        call_command('reindex_logs', stdout=StringIO())
+        self.assertEqual(self.client.indices.create.call_args[1]['index'], 'test-logs_v2')
+        # Writes are never blocked, the alias is swapped first.
+        self.client.indices.put_settings.assert_called_once()
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'test-logs_v1', 'alias': 'test-logs'}},
+            {'add': {'index': 'test-logs_v2', 'alias': 'test-logs'}},
+        ]})
+        # A full copy, a catch-up before and after the swap and a copy of all missing log entries.
+        self.assertEqual(self.client.reindex.call_count, 4)
+        last = self.client.reindex.call_args[1]['body']
+        self.assertNotIn('query', last['source'])
+        self.assertEqual(last['dest']['op_type'], 'create')
+        self.client.indices.delete.assert_not_called()
+
+    def test_failure(self):
+        self.use_alias()
+        self.created = [5, 0, 0, 0]
+        with self.assertRaisesMessage(CommandError, '1 log entries of test-logs_v1 are missing from test-logs_v2'):
+            call_command('reindex_logs', '--delete-old', stdout=StringIO())
+        # The old index is kept.
+        self.client.indices.delete.assert_not_called()
+
+    @override_settings(AUDITLOG_LIFECYCLE={'ENABLED': True})
+    def test_lifecycle(self):
+        self.client.indices.rollover.return_value = {'new_index': 'test-logs-2021.01.03-000003'}
+        self.client.indices.get_alias.return_value = {
+            'test-logs': {}, 'test-logs-2021.01.01-000001': {}, 'test-logs_v1-2021.01.02-000002': {},
+            'test-logs-2021.01.03-000003': {},
+        }
+        self.client.indices.get.return_value = {'test-logs_v1-2021.01.02-000002': {}}
+        source = reindex.get_source(self.client)
+        self.client.indices.put_index_template.assert_called_once()
+        self.assertEqual(source['alias'], 'test-logs-read')
+        self.assertEqual(source['indices'], ['test-logs', 'test-logs-2021.01.01-000001',
+                                             'test-logs_v1-2021.01.02-000002'])
+        # Every generation is copied to an index of its own, outside of the index template of the generations.
+        targets = reindex.get_targets(self.client, source)
+        self.assertEqual(targets, {
+            'test-logs_v2': ['test-logs'],
+            'test-logs_v2-2021.01.01-000001': ['test-logs-2021.01.01-000001'],
+            'test-logs_v2-2021.01.02-000002': ['test-logs_v1-2021.01.02-000002'],
+        })
+        reindex.swap(self.client, source, targets)
+        actions = self.client.indices.update_aliases.call_args[1]['body']['actions']
+        self.assertEqual(actions[0], {'remove': {'index': 'test-logs', 'alias': 'test-logs-read'}})
+        self.assertEqual(actions[-1], {'add': {'index': 'test-logs_v2-2021.01.02-000002', 'alias': 'test-logs-read'}})
+
 
 class NoDeleteHistoryTest(BaseTest, TransactionTestCase):
     def test_delete_related(self):
         instance = SimpleModel.objects.create(integer=1)
-        self.assertEqual(self.mock_save.call_count, 1)
+        self.assertEqual(self.mock_bulk.call_count, 1)
         instance.integer = 2
         instance.save()
-        self.assertEqual(self.mock_save.call_count, 2)
+        self.assertEqual(self.mock_bulk.call_count, 2)
 
         instance.delete()
-        self.assertEqual(self.mock_save.call_count, 3)
+        self.assertEqual(self.mock_bulk.call_count, 3)
 
     def test_no_delete_related(self):
         instance = NoDeleteHistoryModel.objects.create(integer=1)
-        self.assertEqual(self.mock_save.call_count, 1)
+        self.assertEqual(self.mock_bulk.call_count, 1)
         instance.integer = 2
         instance.save()
-        self.assertEqual(self.mock_save.call_count, 2)
+        self.assertEqual(self.mock_bulk.call_count, 2)
 
         instance.delete()
-        self.assertEqual(self.mock_save.call_count, 3)
+        self.assertEqual(self.mock_bulk.call_count, 3)
+
+
+class TransactionBufferTest(BaseTest, TransactionTestCase):
+    """Log entries created within a transaction are indexed with a single bulk call on commit"""
+
+    def indexed_entries(self, call=0):
+        return list(self.mock_bulk.call_args_list[call][0][1])
+
+    def test_bulk_on_commit(self):
+        with transaction.atomic():
+            for i in range(5):
+                SimpleModel.objects.create(integer=i)
+            self.assertEqual(self.mock_bulk.call_count, 0)
+
+        self.assertEqual(self.mock_bulk.call_count, 1)
+        self.assertEqual(len(self.indexed_entries()), 5)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                SimpleModel.objects.create(integer=1)
+                raise ValueError
+
+        self.assertEqual(self.mock_bulk.call_count, 0)
+
+        with transaction.atomic():
+            SimpleModel.objects.create(integer=2)
+        self.assertEqual(self.mock_bulk.call_count, 1)
+        self.assertEqual(len(self.indexed_entries()), 1)
+
+    def test_savepoint_rollback(self):
+        with transaction.atomic():
+            outer = SimpleModel.objects.create(text='outer')
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    SimpleModel.objects.create(text='inner')
+                    raise ValueError
+            after = SimpleModel.objects.create(text='after')
+
+        self.assertEqual(self.mock_bulk.call_count, 1)
+        self.assertEqual([entry.object_pk for entry in self.indexed_entries()], [str(outer.pk), str(after.pk)])
+
+    def test_signal_sent_for_each_entry(self):
+        receiver = MagicMock()
+        log_created.connect(receiver, sender=LogEntry)
+        try:
+            with transaction.atomic():
+                SimpleModel.objects.create(integer=1)
+                SimpleModel.objects.create(integer=2)
+        finally:
+            log_created.disconnect(receiver, sender=LogEntry)
+        self.assertEqual(receiver.call_count, 2)
+
+    def test_partial_failure(self):
+        obj = SimpleModel.objects.create(integer=1)
+        entries = [log_create(SimpleModel, obj, True), log_create(SimpleModel, obj, True)]
+        self.mock_bulk.return_value = iter([(True, {}), (False, {'index': {'status': 400}})])
+        with mock.patch('auditlog.buffer.logging') as logging_mock:
+            failed = send_entries(entries)
+        self.assertEqual(failed, [entries[1]])
+        self.assertEqual(logging_mock.error.call_count, 1)
+
+
+@mock.patch('auditlog.shipper.index_entries', return_value=[])
+class LogShipperTest(TestCase):
+    """Log entries handed to the shipper are indexed in batches on background threads"""
+
+    def test_batches(self, index_mock):
+        shipper = LogShipper(batch_size=2, flush_interval=0.05, max_workers=1)
+        shipper.start()
+        shipper.put(['a', 'b', 'c', 'd', 'e'])
+        shipper.stop()
+        self.assertEqual(sorted(entry for call in index_mock.call_args_list for entry in call[0][0]),
+                         ['a', 'b', 'c', 'd', 'e'])
+        self.assertTrue(all(len(call[0][0]) <= 2 for call in index_mock.call_args_list))
+
+    def test_drop_oldest(self, index_mock):
+        shipper = LogShipper(queue_size=2, overflow='drop_oldest')
+        shipper.put(['a', 'b', 'c'])
+        self.assertEqual(shipper.dropped, 1)
+        self.assertEqual([shipper.queue.get_nowait(), shipper.queue.get_nowait()], ['b', 'c'])
+
+    def test_retry(self, index_mock):
+        attempts = iter([['b'], ['b'], []])
+
+        def index(entries, resend=None):
+            failed = next(attempts)
+            if resend is None:
+                return failed
+            resend.extend(failed)
+            return []
+
+        index_mock.side_effect = index
+        shipper = LogShipper(batch_size=2, flush_interval=0.05, max_workers=1, retries=2, retry_backoff=0)
+        shipper.start()
+        shipper.put(['a', 'b'])
+        shipper.stop()
+        self.assertEqual([call[0][0] for call in index_mock.call_args_list], [['a', 'b'], ['b'], ['b']])
+        self.assertEqual(shipper.failed, 0)
+
+        # On the last attempt entries that may succeed later fail as well.
+        def unavailable(entries, resend=None):
+            if resend is None:
+                return entries
+            resend.extend(entries)
+            return []
+
+        index_mock.reset_mock()
+        index_mock.side_effect = unavailable
+        shipper = LogShipper(flush_interval=0.05, max_workers=1, retries=1, retry_backoff=0)
+        shipper.start()
+        shipper.put(['c'])
+        shipper.stop()
+        self.assertEqual(index_mock.call_count, 2)
+        self.assertIsNone(index_mock.call_args[1]['resend'])
+        self.assertEqual(shipper.failed, 1)
+
+    def test_rejected_entries_are_not_retried(self, index_mock):
+        index_mock.side_effect = index_entries
+        a, b = MagicMock(), MagicMock()
+        results = {a: {'index': {'status': 400, 'error': {'type': 'mapper_parsing_exception'}}},
+                   b: {'index': {'status': 503}}}
+        shipper = LogShipper(batch_size=2, flush_interval=0.05, max_workers=1, retries=2, retry_backoff=0)
+        shipper.start()
+        with mock.patch('auditlog.documents.LogEntry.streaming_bulk',
+                        side_effect=lambda client, entries, **kwargs: iter((False, results[e]) for e in entries)), \
+                mock.patch('auditlog.buffer.logging'):
+            shipper.put([a, b])
+            shipper.stop()
+        # The rejected entry fails at once, only the other one is sent again.
+        self.assertEqual([call[0][0] for call in index_mock.call_args_list], [[a, b], [b], [b]])
+        self.assertEqual(shipper.failed, 2)
+
+    def test_spill(self, index_mock):
+        index_mock.return_value = ['c']
+        shipper = LogShipper(queue_size=2, overflow='spill')
+        self.assertEqual(shipper.put(['a', 'b', 'c']), ['c'])
+        index_mock.assert_called_once_with(['c'])
+
+    def test_invalid_overflow(self, index_mock):
+        with self.assertRaises(ValueError):
+            LogShipper(overflow='explode')
+
+    @override_settings(AUDITLOG_SHIPPER={'ENABLED': True})
+    def test_send_entries(self, index_mock):
+        entry = LogEntry(action=LogEntry.Action.CREATE, content_type_id=1, content_type_app_label='auditlog_tests',
+                         content_type_model='simplemodel', timestamp=timezone.now())
+        with mock.patch('auditlog.shipper.LogShipper.put', return_value=[]) as put_mock:
+            self.assertEqual(send_entries([entry]), [])
+        put_mock.assert_called_once_with([entry])
+
+
+class SpoolTest(TestCase):
+    """Log entries that cannot be indexed are spooled to disk and replayed later"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spool = Spool(self.tmp.name, fsync='always')
+
+    def tearDown(self):
+        mark_available()
+        self.tmp.cleanup()
+
+    def make_entries(self, count):
+        return [LogEntry(meta={'id': str(i)}, action=LogEntry.Action.CREATE, content_type_id=1,
+                         content_type_app_label='auditlog_tests', content_type_model='simplemodel',
+                         object_repr=str(i), timestamp=timezone.now()) for i in range(count)]
+
+    def replay(self, results):
+        sent = []
+
+        def streaming_bulk(client, actions, **kwargs):
+            for action, result in zip(actions, results):
+                sent.append(action)
+                yield result
+
+        with mock.patch('auditlog.spool.streaming_bulk', side_effect=streaming_bulk):
+            return self.spool.replay(client=MagicMock()), sent
+
+    def test_replay(self):
+        self.assertEqual(self.spool.append(self.make_entries(3)), 3)
+        (indexed, complete), sent = self.replay([(True, {})] * 3)
+        self.assertEqual((indexed, complete), (3, True))
+        self.assertEqual([action['_id'] for action in sent], ['0', '1', '2'])
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_resume(self):
+        self.spool.append(self.make_entries(3))
+        (indexed, complete), sent = self.replay([(True, {}), (False, {'index': {'status': 'N/A'}})])
+        self.assertEqual((indexed, complete), (1, False))
+
+        (indexed, complete), sent = self.replay([(True, {})] * 3)
+        self.assertEqual((indexed, complete), (2, True))
+        self.assertEqual([action['_id'] for action in sent], ['1', '2'])
+
+    def test_rejected_entries_are_skipped(self):
+        self.spool.append(self.make_entries(2))
+        (indexed, complete), sent = self.replay([(False, {'index': {'status': 400}}), (True, {})])
+        self.assertEqual((indexed, complete), (1, True))
+
+    def test_blocked_index(self):
+        """Writes rejected by a write block, e.g. while reindex_logs swaps the index, are kept for later."""
+        self.spool.append(self.make_entries(2))
+        blocked = {'index': {'status': 403, 'error': {'type': 'cluster_block_exception'}}}
+        (indexed, complete), sent = self.replay([(True, {}), (False, blocked)])
+        self.assertEqual((indexed, complete), (1, False))
+
+    def test_max_size(self):
+        self.spool.max_size = 10
+        self.assertEqual(self.spool.append(self.make_entries(1)), 0)
+
+    def test_rotation(self):
+        self.spool.segment_size = 1
+        self.spool.append(self.make_entries(1))
+        self.spool.append(self.make_entries(1))
+        self.assertEqual(len(self.spool.segments()), 2)
+
+    def test_segment_age(self):
+        self.spool.segment_max_age = 0
+        self.spool.append(self.make_entries(1))
+        self.assertEqual(glob.glob(os.path.join(self.tmp.name, '*.open')), [])
+        self.assertEqual(len(self.spool.segments()), 1)
+
+    def test_take_over_idle_segment(self):
+        worker = Spool(self.tmp.name, fsync='never')
+        worker.append(self.make_entries(1))
+        [name] = glob.glob(os.path.join(self.tmp.name, '*.open'))
+        self.assertEqual(self.spool.segments(), [])
+        os.utime(name, (time.time() - 120, time.time() - 120))
+        # The idle segment of the running worker is sealed for the replay, the worker continues in a new one.
+        self.assertEqual(self.spool.segments(), [name[:-len('.open')] + '.seg'])
+        worker.append(self.make_entries(1))
+        self.assertEqual(len(glob.glob(os.path.join(self.tmp.name, '*.open'))), 1)
+        (indexed, complete), sent = self.replay([(True, {})])
+        self.assertEqual((indexed, complete), (1, True))
+
+    def test_index_entries_spools_on_connection_error(self):
+        entries = self.make_entries(2)
+        results = iter([(True, {}), (False, {'index': {'status': 'N/A', 'error': 'ConnectionError'}})])
+        with mock.patch('auditlog.buffer.get_spool', return_value=self.spool), \
+                mock.patch('auditlog.documents.LogEntry.streaming_bulk', return_value=results) as bulk_mock:
+            self.assertEqual(index_entries(entries), [])
+            # Elasticsearch is considered unavailable, entries go straight to the spool
+            self.assertEqual(index_entries(entries), [])
+        self.assertEqual(bulk_mock.call_count, 1)
+        self.spool.seal()
+        with open(self.spool.segments()[0]) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+
+class SnapshotModelTest(BaseTest, TransactionTestCase):
+    """Updates of models registered with snapshots are diffed without fetching the old instance"""
+
+    def setUp(self):
+        super().setUp()
+        SnapshotModel.objects.create(text='Snapshot', integer=1)
+
+    def changes(self):
+        return list(self.mock_bulk.call_args[0][1])[0].changes
+
+    def test_update_without_query(self):
+        obj = SnapshotModel.objects.get()
+        obj.integer = 2
+        with self.assertNumQueries(1):
+            obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '1', 'new': '2'}])
+
+    def test_repeated_saves(self):
+        obj = SnapshotModel.objects.get()
+        obj.integer = 2
+        obj.save()
+        obj.integer = 3
+        obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '2', 'new': '3'}])
+
+    def test_update_fields(self):
+        obj = SnapshotModel.objects.get()
+        obj.integer = 2
+        obj.text = 'Not saved'
+        obj.save(update_fields=['integer'])
+        obj.integer = 3
+        obj.save()
+        self.assertEqual(sorted(change['field'] for change in self.changes()), ['integer', 'text'])
+
+    def test_deferred_fields(self):
+        obj = SnapshotModel.objects.only('integer').get()
+        obj.integer = 2
+        obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '1', 'new': '2'}])
+
+    def test_mutable_values(self):
+        SnapshotModel.objects.update(data={'tags': ['a']})
+        obj = SnapshotModel.objects.get()
+        obj.data['tags'].append('b')
+        obj.save()
+        self.assertEqual([(change['field'], change['new']) for change in self.changes()],
+                         [('data', str({'tags': ['a', 'b']}))])
+
+    def test_refresh_from_db(self):
+        obj = SnapshotModel.objects.get()
+        SnapshotModel.objects.update(integer=2)
+        obj.refresh_from_db()
+        obj.integer = 3
+        with self.assertNumQueries(1):
+            obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '2', 'new': '3'}])
+
+    def test_load_deferred_field(self):
+        obj = SnapshotModel.objects.only('text').get()
+        obj.integer += 1
+        obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '1', 'new': '2'}])
+
+    def test_fallback_fetches_tracked_fields(self):
+        obj = SnapshotModel.objects.get()
+        del obj._auditlog_snapshot
+        obj.integer = 2
+        with self.assertNumQueries(2):
+            obj.save()
+        self.assertEqual(self.changes(), [{'field': 'integer', 'old': '1', 'new': '2'}])
+
+
+class BulkOperationTest(BaseTest, TransactionTestCase):
+    """Bulk operations on models with an AuditlogManager are logged with a single bulk call"""
+
+    def indexed_entries(self):
+        self.assertEqual(self.mock_bulk.call_count, 1)
+        return list(self.mock_bulk.call_args[0][1])
+
+    def selects(self, queries):
+        return [query for query in queries if query['sql'].startswith('SELECT "auditlog_tests_bulkmodel"')]
+
+    @skipUnlessDBFeature('can_return_rows_from_bulk_insert')
+    def test_bulk_create(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=i) for i in range(3)])
+        entries = self.indexed_entries()
+        self.assertEqual([entry.action for entry in entries], [LogEntry.Action.CREATE] * 3)
+
+    def test_bulk_update(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=i) for i in range(3)])
+        self.mock_bulk.reset_mock()
+        objs = list(BulkModel.objects.order_by('pk'))
+        for obj in objs:
+            obj.integer += 10
+            obj.text = 'Not updated'
+        with CaptureQueriesContext(connection) as queries:
+            BulkModel.objects.bulk_update(objs, ['integer'])
+        self.assertEqual(len(self.selects(queries)), 1)
+        entries = self.indexed_entries()
+        self.assertEqual([entry.changes for entry in entries],
+                         [[{'field': 'integer', 'old': str(i), 'new': str(i + 10)}] for i in range(3)])
+
+    def test_update(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=i) for i in range(3)])
+        self.mock_bulk.reset_mock()
+        with CaptureQueriesContext(connection) as queries:
+            BulkModel.objects.filter(integer__gte=1).update(integer=5)
+        # The primary keys, then the old values.
+        self.assertEqual(len(self.selects(queries)), 2)
+        entries = self.indexed_entries()
+        self.assertEqual(sorted(change['old'] for entry in entries for change in entry.changes), ['1', '2'])
+
+    def test_update_chunks(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=i) for i in range(5)])
+        self.mock_bulk.reset_mock()
+        queryset = BulkModel.objects.all()
+        queryset.audit_chunk_size = 2
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(queryset.update(integer=F('integer') + 1), 5)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        # The primary keys, then the old and new values per chunk.
+        self.assertEqual(len(self.selects(queries)), 7)
+        entries = self.indexed_entries()
+        self.assertEqual(sorted(change['new'] for entry in entries for change in entry.changes),
+                         ['1', '2', '3', '4', '5'])
+
+    def test_update_expression(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=i) for i in range(3)])
+        self.mock_bulk.reset_mock()
+        BulkModel.objects.update(integer=F('integer') + 1)
+        entries = self.indexed_entries()
+        self.assertEqual(sorted(change['new'] for entry in entries for change in entry.changes), ['1', '2', '3'])
+
+    def test_update_unchanged(self):
+        BulkModel.objects.bulk_create([BulkModel(integer=1)])
+        self.mock_bulk.reset_mock()
+        BulkModel.objects.update(integer=1)
+        self.assertEqual(self.mock_bulk.call_count, 0)
+
+
+class DiffPlanTest(TestCase):
+    """The registry compiles the fields to compare once per model"""
+
+    def tearDown(self):
+        auditlog.register(SimpleExcludeModel, exclude_fields=['text'])
+
+    def test_plan_is_cached(self):
+        self.assertIs(auditlog.get_diff_plan(SimpleExcludeModel), auditlog.get_diff_plan(SimpleExcludeModel))
+
+    def test_plan_respects_registration(self):
+        plan = auditlog.get_diff_plan(SimpleExcludeModel)
+        self.assertEqual([name for name, field, get_value in plan.update_plan], ['id', 'label'])
+
+        auditlog.register(SimpleExcludeModel, exclude_fields=['label'])
+        plan = auditlog.get_diff_plan(SimpleExcludeModel)
+        self.assertEqual([name for name, field, get_value in plan.update_plan], ['id', 'text'])
+
+
+class ModelInstancesDiffTest(BaseTest, TransactionTestCase):
+    """Diffing many pairs at once gives the same result as diffing every pair on its own"""
+
+    def test_matches_model_instance_diff(self):
+        related = SimpleModel.objects.create(text='Related')
+        objs = [SnapshotModel.objects.create(text='Object %d' % i, integer=i) for i in range(100)]
+        olds = list(SnapshotModel.objects.order_by('pk'))
+        for i, obj in enumerate(objs):
+            if i % 3 == 0:
+                obj.integer += 1
+            if i % 5 == 0:
+                obj.text = 'Changed'
+            if i % 7 == 0:
+                obj.related = related
+
+        pairs = list(zip(olds, objs)) + [(None, objs[0]), (objs[1], None), (None, None)]
+        self.assertEqual(model_instances_diff(pairs), [model_instance_diff(old, new) for old, new in pairs])
+
+    def test_datetime_fields(self):
+        timestamp = datetime.datetime(2017, 1, 10, 12, 0, tzinfo=timezone.utc)
+        obj = DateTimeFieldModel.objects.create(label='DateTime', timestamp=timestamp, date=timestamp.date(),
+                                               time=timestamp.time(), naive_dt=timestamp)
+        unchanged = DateTimeFieldModel.objects.get(pk=obj.pk)
+        changed = DateTimeFieldModel.objects.get(pk=obj.pk)
+        changed.timestamp = timestamp + datetime.timedelta(hours=1)
+
+        pairs = [(obj, unchanged), (obj, changed)]
+        self.assertEqual(model_instances_diff(pairs), [model_instance_diff(old, new) for old, new in pairs])
+        self.assertIsNone(model_instances_diff(pairs)[0])
+
+    def test_field_names(self):
+        obj = SnapshotModel.objects.create(text='Object', integer=1)
+        new = SnapshotModel.objects.get(pk=obj.pk)
+        new.text = 'Changed'
+        new.integer = 2
+
+        diffs = model_instances_diff([(obj, new)], field_names={'integer'})
+        self.assertEqual(diffs, [[{'field': 'integer', 'old': '1', 'new': '2'}]])
+
+
+class AsyncTest(BaseTest, TransactionTestCase):
+    """Log entries are indexed and searched with the AsyncElasticsearch client on the event loop"""
+
+    def make_entry(self):
+        return LogEntry.log_create(SimpleModel(id=1, text='I am not difficult.'), action=LogEntry.Action.CREATE,
+                                   changes=[])
+
+    async def test_middleware(self):
+        """The actor is logged for async requests."""
+        user = await sync_to_async(User.objects.create_user)(username='test', email='test@example.com')
+
+        async def get_response(request):
+            return await sync_to_async(self.make_entry)()
+
+        request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+        request.user = user
+        middleware = AuditlogMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        log_entry = await middleware(request)
+        self.assertEqual(log_entry.actor_id, user.pk)
+        self.assertEqual(log_entry.remote_addr, '127.0.0.1')
+
+    async def test_asave(self):
+        client = MagicMock()
+        log_entry = await sync_to_async(self.make_entry)()
+        client.index = AsyncMock(return_value={'_id': log_entry.meta.id, '_index': 'auditlog', 'result': 'created'})
+
+        with set_actor(None, remote_addr='127.0.0.1'):
+            self.assertEqual(await log_entry.asave(client=client), 'created')
+        self.assertEqual(client.index.call_args[1]['body']['remote_addr'], '127.0.0.1')
+        self.assertEqual(client.index.call_args[1]['id'], log_entry.meta.id)
+        self.assertEqual(log_entry.meta.index, 'auditlog')
+
+    async def test_index_entries(self):
+        entries = [await sync_to_async(self.make_entry)(), await sync_to_async(self.make_entry)()]
+
+        async def results(client, documents, **kwargs):
+            yield True, {}
+            yield False, {'index': {'status': 400}}
+
+        with mock.patch('auditlog.documents.LogEntry.async_streaming_bulk', side_effect=results):
+            self.assertEqual(await async_index_entries(entries, client=MagicMock()), entries[1:])
+
+    async def test_shipper(self):
+        indexed = []
+
+        async def index(entries):
+            indexed.append(entries)
+            return []
+
+        with mock.patch('auditlog.aio.async_index_entries', side_effect=index):
+            shipper = AsyncLogShipper(asyncio.get_running_loop(), batch_size=2, flush_interval=0.01)
+            shipper.start()
+            shipper.put(['a', 'b', 'c', 'd', 'e'])
+            await shipper.stop()
+        self.assertEqual(sorted(entry for batch in indexed for entry in batch), ['a', 'b', 'c', 'd', 'e'])
+        self.assertTrue(all(len(batch) <= 2 for batch in indexed))
+
+    async def test_history(self):
+        def hits(ids):
+            return {'hits': {'total': {'value': 12, 'relation': 'eq'}, 'hits': [
+                {'_index': 'auditlog', '_id': 'e%02d' % i, '_source': {'action': 'update', 'object_repr': str(i)},
+                 'sort': [i, 'e%02d' % i]} for i in ids]}}
+
+        client = MagicMock()
+        client.search = AsyncMock(side_effect=[hits(range(12, 1, -1)), hits([2, 1])])
+
+        page = await aget_history(SimpleModel(id=1), per_page=10, client=client)
+        self.assertEqual([entry.object_repr for entry in page.object_list], [str(i) for i in range(12, 2, -1)])
+        self.assertTrue(page.has_next)
+        body = client.search.call_args[1]['body']
+        self.assertIn({'term': {'content_type_model': 'simplemodel'}}, body['query']['bool']['filter'])
+        self.assertEqual(body['sort'], [{'timestamp': 'desc'}, {'_id': 'desc'}])
+        self.assertEqual(body['size'], 11)
+
+        page = await aget_history(SimpleModel(id=1), after=page.object_list[-1].meta.sort, per_page=10, client=client)
+        self.assertEqual([entry.object_repr for entry in page.object_list], ['2', '1'])
+        self.assertFalse(page.has_next)
+        self.assertTrue(page.has_previous)
+        self.assertEqual(client.search.call_args[1]['body']['search_after'], [3, 'e03'])
+
+
+class ConnectionTest(TestCase):
+    """The Elasticsearch client is created lazily from the AUDITLOG_ELASTICSEARCH setting"""
+
+    @override_settings(AUDITLOG_ELASTICSEARCH={'ALIAS': 'auditlog-test', 'HOSTS': ['es1:9200', 'es2:9200'],
+                                               'MAXSIZE': 25, 'HTTP_COMPRESS': True, 'RETRY_ON_TIMEOUT': True})
+    def test_settings(self):
+        kwargs = get_client_kwargs()
+        self.assertEqual(kwargs['hosts'], ['es1:9200', 'es2:9200'])
+        self.assertEqual(kwargs['maxsize'], 25)
+        self.assertTrue(kwargs['http_compress'])
+        self.assertTrue(kwargs['retry_on_timeout'])
+
+        client = get_client()
+        self.assertIs(connections.get_connection('auditlog-test'), client)
+        self.assertEqual(len(client.transport.hosts), 2)
+        self.assertIs(get_client(), client)
+
+    def test_host_fallback(self):
+        self.assertEqual(get_client_kwargs()['hosts'], ['localhost'])
+
+    @override_settings(AUDITLOG_ELASTICSEARCH={'ALIAS': 'auditlog-fork'})
+    def test_fork(self):
+        """A forked child process creates its own client."""
+        client = get_client()
+        with mock.patch('auditlog.connection.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(get_client(), client)
+
+    def test_search_timeout(self):
+        self.assertEqual(LogEntry.search()._params['request_timeout'], 30)
+
+    @override_settings(AUDITLOG_ELASTICSEARCH={'ALIAS': 'auditlog-default'})
+    def test_default_connection(self):
+        """The client is the default connection, unless the project configured one."""
+        client = get_client()
+        self.assertIs(connections.get_connection(), client)
+
+        own = MagicMock()
+        connections.add_connection('default', own)
+        try:
+            with mock.patch('auditlog.connection.os.getpid', return_value=os.getpid() + 1):
+                self.assertIsNot(get_client(), client)
+            self.assertIs(connections.get_connection(), own)
+        finally:
+            connections.remove_connection('default')
+
+
+@override_settings(AUDITLOG_LIFECYCLE={'ENABLED': True, 'PERIOD': 'weekly', 'MAX_DOCS': 1000000})
+class LifecycleTest(TestCase):
+    """Log entries are written to rolling indices through aliases or a data stream"""
+
+    def setUp(self):
+        self.client = MagicMock()
+
+    def make_entry(self):
+        return LogEntry.log_create(SimpleModel(id=1, text='I am not difficult.'), action=LogEntry.Action.CREATE,
+                                   changes=[])
+
+    def test_aliases(self):
+        entry = self.make_entry()
+        self.assertEqual(entry.to_dict(include_meta=True)['_index'], 'test-logs-write')
+        self.assertEqual(LogEntry.search()._index, ['test-logs-read'])
+
+    @override_settings(AUDITLOG_LIFECYCLE={'ENABLED': True, 'DATA_STREAM': True})
+    def test_data_stream(self):
+        action = self.make_entry().to_dict(include_meta=True)
+        self.assertEqual(action['_index'], 'test-logs-stream')
+        self.assertEqual(action['_op_type'], 'create')
+        self.assertEqual(action['_source']['@timestamp'], action['_source']['timestamp'])
+        self.assertIn('data_stream', lifecycle.get_index_template())
+
+    def test_setup(self):
+        self.client.indices.exists_alias.return_value = False
+        self.client.indices.exists.return_value = True
+        LogEntry.init(using=self.client)
+
+        template = self.client.indices.put_index_template.call_args[1]['body']
+        self.assertEqual(template['index_patterns'], ['test-logs-*'])
+        self.assertEqual(template['template']['aliases'], {'test-logs-read': {}})
+        self.client.indices.create.assert_called_once_with(
+            index='<test-logs-{now/w{yyyy.MM.dd}}-000001>',
+            body={'aliases': {'test-logs-write': {'is_write_index': True}}})
+        self.client.indices.put_alias.assert_called_once_with(index='test-logs', name='test-logs-read')
+
+    def test_rollover(self):
+        self.client.indices.rollover.return_value = {
+            'rolled_over': True, 'old_index': 'test-logs-2021.03.01-000001', 'new_index': 'test-logs-2021.03.08-000002',
+            'conditions': {'[max_age: 7d]': True}}
+        out = StringIO()
+        with mock.patch('auditlog.management.commands.rollover_logs.get_client', return_value=self.client):
+            call_command('rollover_logs', stdout=out)
+        self.client.indices.rollover.assert_called_once_with(
+            alias='test-logs-write', body={'conditions': {'max_size': '50gb', 'max_docs': 1000000, 'max_age': '7d'}},
+            dry_run=False)
+        self.assertIn('test-logs-2021.03.08-000002', out.getvalue())
+
+    def test_expired_generations(self):
+        self.client.indices.get_alias.side_effect = [
+            {'test-logs': {}, 'test-logs-1': {}, 'test-logs-2': {}},
+            {'test-logs-1': {'aliases': {'test-logs-write': {'is_write_index': False}}},
+             'test-logs-2': {'aliases': {'test-logs-write': {'is_write_index': True}}}},
+        ]
+        old = datetime.datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp() * 1000
+        self.client.search.return_value = {'aggregations': {'generations': {'buckets': [
+            {'key': 'test-logs', 'doc_count': 10, 'newest': {'value': old}},
+            {'key': 'test-logs-1', 'doc_count': 5, 'newest': {'value': timezone.now().timestamp() * 1000}},
+            {'key': 'test-logs-2', 'doc_count': 1, 'newest': {'value': old}},
+        ]}}}
+
+        expired = lifecycle.get_expired_generations(self.client, datetime.timedelta(days=30))
+        self.assertEqual([generation['index'] for generation in expired], ['test-logs'])
+        lifecycle.delete_generations(self.client, expired)
+        self.client.indices.delete.assert_called_once_with(index='test-logs')
+
+
+class RetentionTest(TestCase):
+    """Expired log entries are deleted from Elasticsearch by dropping indices or with delete-by-query tasks"""
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.delete_by_query.return_value = {'task': 'node:1'}
+        self.client.tasks.get.return_value = {'completed': True, 'response': {'total': 3, 'deleted': 3}}
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(AUDITLOG_RETENTION={
+            'MAX_AGE': '90d',
+            'POLICIES': [{'content_type': 'auth.user', 'max_age': '365d'}, {'action': 'delete', 'max_age': '7d'}],
+            'STATE_PATH': os.path.join(self.directory.name, 'state.json'),
+        })
+        self.settings.enable()
+        self.mocked_client = mock.patch('auditlog.management.commands.auditlogflush.get_client',
+                                        return_value=self.client)
+        self.mocked_client.start()
+
+    def tearDown(self):
+        self.mocked_client.stop()
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_policies(self):
+        now = timezone.now()
+        deletes = retention.get_deletes(retention.get_policies(), now=now)
+        self.assertEqual([delete['name'] for delete in deletes], ['auth.user', 'delete', 'default'])
+        self.assertEqual(deletes[2]['cutoff'], (now - datetime.timedelta(days=90)).isoformat())
+        # Every log entry falls under the first policy that matches it.
+        self.assertNotIn('must_not', deletes[0]['query']['bool'])
+        self.assertEqual(len(deletes[2]['query']['bool']['must_not']), 2)
+
+    @override_settings(AUDITLOG_RETENTION={})
+    def test_delete_all(self):
+        """Without any retention configured, all log entries are only deleted with --all."""
+        self.assertEqual(retention.get_policies(), [])
+        with self.assertRaises(CommandError):
+            call_command('auditlogflush', yes=True, poll_interval=0, stdout=StringIO())
+        self.client.delete_by_query.assert_not_called()
+
+        call_command('auditlogflush', yes=True, all=True, poll_interval=0, stdout=StringIO())
+        self.client.delete_by_query.assert_called_once()
+        self.assertEqual(self.client.delete_by_query.call_args[1]['body']['query']['bool']['filter'][0],
+                         {'match_all': {}})
+
+    @override_settings(AUDITLOG_RETENTION={'POLICIES': [{'action': 'delete', 'max_age': '7d'}]})
+    def test_policies_only(self):
+        """Log entries that no policy matches are kept."""
+        self.assertEqual([policy['name'] for policy in retention.get_policies()], ['delete'])
+
+    def test_flush(self):
+        out = StringIO()
+        call_command('auditlogflush', yes=True, poll_interval=0, stdout=out)
+        self.assertEqual(self.client.delete_by_query.call_count, 3)
+        self.assertEqual(self.client.delete_by_query.call_args[1]['slices'], 'auto')
+        self.assertFalse(self.client.delete_by_query.call_args[1]['wait_for_completion'])
+        self.assertIn('Deleted 3 default log entries.', out.getvalue())
+        self.assertFalse(os.path.exists(retention.RetentionState.from_settings().path))
+
+    def test_resume(self):
+        state = retention.RetentionState.from_settings()
+        state.tasks = {'default': {'name': 'default', 'cutoff': '2021-01-01T00:00:00+00:00',
+                                   'query': {'match_all': {}}, 'task': 'node:1'}}
+        state.save()
+        self.client.tasks.get.side_effect = [NotFoundError(404, 'not_found', {}),
+                                             {'completed': True, 'response': {'total': 3, 'deleted': 3}}]
+
+        out = StringIO()
+        call_command('auditlogflush', yes=True, poll_interval=0, stdout=out)
+        # The lost task is started again with the same query.
+        self.client.delete_by_query.assert_called_once()
+        self.assertEqual(self.client.delete_by_query.call_args[1]['body'], {'query': {'match_all': {}}})
+        self.assertIn('Resuming 1 delete requests.', out.getvalue())
+
+    def test_dry_run(self):
+        self.client.indices.stats.return_value = {'indices': {'test-logs': {'primaries': {
+            'docs': {'count': 10}, 'store': {'size_in_bytes': 1000}}}}}
+        self.client.search.return_value = {'aggregations': {'indices': {'buckets': [
+            {'key': 'test-logs', 'doc_count': 4}]}}}
+
+        out = StringIO()
+        call_command('auditlogflush', dry_run=True, stdout=out)
+        self.assertIn('default: 4 log entries, 400 bytes.', out.getvalue())
+        self.client.delete_by_query.assert_not_called()
+
+
+class MigrateLogsTest(TestCase):
+    """Log entries of the database table of older versions are streamed to Elasticsearch and can be resumed"""
+
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(SimpleModel)
+        self.user = User.objects.create_user(username='migrate', email='migrate@example.com')
+        self.rows = [
+            LogEntry_db.objects.create(content_type=content_type, object_pk=str(i), object_id=i,
+                                       object_repr='Object %d' % i, action=LogEntry_db.Action.UPDATE,
+                                       changes={'text': ['old', 'new %d' % i]}, actor=self.user)
+            for i in range(5)
+        ]
+        self.actions = []
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+        self.patches = [
+            mock.patch('auditlog.management.commands.migrate_logs.streaming_bulk', side_effect=self.bulk),
+            mock.patch('auditlog.management.commands.migrate_logs.get_client'),
+            mock.patch('auditlog.documents.LogEntry.init'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.directory.cleanup()
+
+    def bulk(self, client, actions, **kwargs):
+        for action in actions:
+            self.actions.append(action)
+            yield True, {}
+
+    def test_migrate(self):
+        out = StringIO()
+        with self.assertNumQueries(4):
+            call_command('migrate_logs', batch_size=2, chunk_size=2, checkpoint=self.checkpoint, stdout=out)
+        self.assertEqual([action['_id'] for action in self.actions], [row.pk for row in self.rows])
+        self.assertEqual(self.actions[0]['_source']['actor_email'], 'migrate@example.com')
+        self.assertEqual(self.actions[0]['_source']['changes'], [{'field': 'text', 'old': 'old', 'new': 'new 0'}])
+        self.assertIn('Migrated 5 log entries', out.getvalue())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'ranges': [{'start': 0, 'end': self.rows[-1].pk, 'done': self.rows[2].pk}]}, f)
+        call_command('migrate_logs', checkpoint=self.checkpoint, stdout=StringIO())
+        self.assertEqual([action['_id'] for action in self.actions], [row.pk for row in self.rows[3:]])
+
+    def test_failures(self):
+        """Log entries that could not be indexed are recorded in the checkpoint and retried on the next run."""
+        failing = {self.rows[1].pk, self.rows[3].pk}
+
+        def bulk(client, actions, **kwargs):
+            for action in actions:
+                self.actions.append(action)
+                yield action['_id'] not in failing, {}
+
+        with mock.patch('auditlog.management.commands.migrate_logs.streaming_bulk', side_effect=bulk), \
+                self.assertLogs(level='ERROR'):
+            with self.assertRaisesMessage(CommandError, '2 log entries could not be migrated'):
+                call_command('migrate_logs', chunk_size=2, checkpoint=self.checkpoint, stdout=StringIO())
+        with open(self.checkpoint) as f:
+            ranges = json.load(f)['ranges']
+        self.assertEqual(ranges[0]['done'], self.rows[-1].pk)
+        self.assertEqual(ranges[0]['failed'], sorted(failing))
+
+        self.actions = []
+        call_command('migrate_logs', checkpoint=self.checkpoint, stdout=StringIO())
+        self.assertEqual([action['_id'] for action in self.actions], sorted(failing))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_workers(self):
+        """Every worker is followed until its last message, also when its range ends on a full chunk."""
+
+        class Process(object):
+            # Runs the worker right away, in this process.
+            def __init__(self, target, args, daemon):
+                self.target, self.args = target, args
+
+            def start(self):
+                self.target(*self.args)
+
+            def is_alive(self):
+                return False
+
+            def join(self):
+                pass
+
+        context = MagicMock(Queue=queue.Queue, Process=Process)
+        with mock.patch('auditlog.management.commands.migrate_logs.multiprocessing.get_context',
+                        return_value=context), \
+                mock.patch('auditlog.management.commands.migrate_logs.db_connections'):
+            call_command('migrate_logs', workers=2, chunk_size=1, checkpoint=self.checkpoint, stdout=StringIO())
+        self.assertEqual(sorted(action['_id'] for action in self.actions), [row.pk for row in self.rows])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class ExportTest(TestCase):
+    """Log entries are streamed out of Elasticsearch to NDJSON files or the database table of older versions"""
+
+    def setUp(self):
+        self.hits = [
+            {'_id': str(i), '_index': 'test-logs', 'sort': [i, i], '_source': {
+                'action': 'update', 'content_type_id': '1', 'content_type_app_label': 'auditlog_tests',
+                'content_type_model': 'simplemodel', 'object_pk': str(i), 'object_id': i, 'object_repr': 'Object',
+                'timestamp': '2021-01-0%dT12:00:00+00:00' % (i + 1),
+                'changes': [{'field': 'text', 'old': 'old', 'new': 'new'}],
+            }}
+            for i in range(3)
+        ]
+        self.client = MagicMock()
+        self.client.open_point_in_time.return_value = {'id': 'pit-1'}
+        self.client.search.side_effect = [
+            {'pit_id': 'pit-2', 'hits': {'hits': self.hits[:2]}},
+            {'pit_id': 'pit-3', 'hits': {'hits': self.hits[2:]}},
+        ]
+        self.directory = tempfile.TemporaryDirectory()
+        self.mocked_client = mock.patch('auditlog.management.commands.auditlog_export.get_client',
+                                        return_value=self.client)
+        self.mocked_client.start()
+
+    def tearDown(self):
+        self.mocked_client.stop()
+        self.directory.cleanup()
+
+    def test_query(self):
+        query = export.get_query(content_types=['auth.User'], actors=[1], since=timezone.now()).to_dict()
+        self.assertEqual(len(query['bool']['filter']), 3)
+        self.assertEqual(query['bool']['filter'][1], {'terms': {'actor_id': ['1']}})
+
+    def test_ndjson(self):
+        path = os.path.join(self.directory.name, 'export.ndjson.gz')
+        call_command('auditlog_export', output=path, page_size=2, since='2021-01-01', stdout=StringIO())
+        with gzip.open(path, 'rt') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['_id'] for line in lines], ['0', '1', '2'])
+        # The pages follow each other with search_after on the latest point in time, which is closed afterwards.
+        body = self.client.search.call_args[1]['body']
+        self.assertEqual(body['pit']['id'], 'pit-2')
+        self.assertEqual(body['search_after'], [1, 1])
+        self.client.close_point_in_time.assert_called_once_with(body={'id': 'pit-3'})
+
+    def test_slices(self):
+        path = os.path.join(self.directory.name, 'export.ndjson.gz')
+        with mock.patch('auditlog.export.scan', side_effect=[iter(self.hits[:1]), iter(self.hits[1:])]) as scan:
+            call_command('auditlog_export', output=path, slices=2, stdout=StringIO())
+        self.assertEqual(sorted(call[1]['query']['slice']['id'] for call in scan.call_args_list), [0, 1])
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'export-0.ndjson.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'export-1.ndjson.gz')))
+
+    def test_sql(self):
+        call_command('auditlog_export', sql=True, page_size=2, stdout=StringIO())
+        entries = LogEntry_db.objects.order_by('timestamp')
+        self.assertEqual(entries.count(), 3)
+        self.assertEqual(entries[0].timestamp, datetime.datetime(2021, 1, 1, 12, tzinfo=datetime.timezone.utc))
+        self.assertEqual(entries[0].changes, {'text': ['old', 'new']})
+        self.assertEqual(entries[0].action, LogEntry_db.Action.UPDATE)
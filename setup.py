@@ -27,6 +27,9 @@ setup(
         'elasticsearch-dsl==7.3.0',
 
     ],
+    extras_require={
+        'async': ['elasticsearch[async]==7.12'],
+    },
     zip_safe=False,
     classifiers=[
         'Programming Language :: Python :: 2',